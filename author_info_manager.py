@@ -1,53 +1,368 @@
 
-import json
+import os
+import sys
+import mmap
+import struct
+from array import array
+import numpy as np
+from id_index import IdIndex
+from storage_files import get_temporary_file_path, sync_file, commit_temporary_files
 
 
 class AuthorInfoManager:
 
-    PAPERS_KEY_NAME = 'papers'
-    CO_AUTHORS_KEY_NAME = 'co_authors'
-    AUTHOR_STORAGE_FILE_PATH = r'storage/authors.json'
-
-    def __init__(self):
-        self.__authors = self.__load_author_storage()
-
-    def __load_author_storage(self):
-        # todo: load authors file
-        return dict()
-
-    def add_author_publication(self, author_id, paper_id, co_authors):
-        # validate author record's existence
-        if author_id not in self.__authors.keys():
-            self.__authors[author_id] = {
-                AuthorInfoManager.PAPERS_KEY_NAME: [],
-                AuthorInfoManager.CO_AUTHORS_KEY_NAME: []
-            }
-
-        # add paper id
-        if paper_id in self.__authors[author_id][AuthorInfoManager.PAPERS_KEY_NAME]:
-            raise Exception('author {author_id} already has paper {paper_id}'.format(
-                author_id=author_id, paper_id=paper_id))
-        else:
-            self.__authors[author_id][AuthorInfoManager.PAPERS_KEY_NAME].append(paper_id)
-
-        # add co-authors
-        for co_author_id in co_authors:
-            if co_author_id not in self.__authors[author_id][AuthorInfoManager.CO_AUTHORS_KEY_NAME]:
-                self.__authors[author_id][AuthorInfoManager.CO_AUTHORS_KEY_NAME].append(co_author_id)
+    AUTHOR_INDEX_FILE_PATH = r'storage/authors_name_index.bin'
 
-    def store_author_info(self):
-        print('num of authors: ' + str(len(self.__authors.keys())))
-        info_as_string = json.dumps(self.__authors)
+    # authors are split to shards by interned id, each shard holds author records followed by an offset index
+    NUMBER_OF_AUTHOR_SHARDS = 64
+    AUTHOR_STORAGE_FILE_PATH_FORMAT = r'storage/authors_{shard_id}.bin'
+    STORAGE_FORMAT_MAGIC = b'HIAU'
+    STORAGE_FORMAT_VERSION = 1
+    STORAGE_FILE_HEADER_STRUCT = struct.Struct('<4sHHQQ')
+    SHARD_INDEX_ENTRY_TYPE = np.dtype([
+        ('author', '<u4'), ('papers', '<u4'), ('co_authors', '<u4'), ('offset', '<u8')
+    ])
+    STORAGE_WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+    # loaded authors are kept within the memory budget by releasing shards that are already stored.
+    # resident size of an author is estimated as its two sets and an interned id per set entry.
+    # shards are released down to a part of the budget, so the next papers do not go over it right away
+    DEFAULT_MEMORY_BUDGET = 1024 ** 3
+    MEMORY_BUDGET_RELEASE_TARGET = 0.7
+    ESTIMATED_AUTHOR_RECORD_SIZE = 2 * sys.getsizeof(set())
+    ESTIMATED_AUTHOR_ENTRY_SIZE = 64
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        # publications and co-authors are kept in sets of interned ids, indexed by the author's interned id.
+        # None marks an author that is stored in its shard and was not loaded yet
+        self.__author_index = IdIndex()
+        self.__author_papers = list()
+        self.__author_co_authors = list()
+        self.__number_of_unloaded_authors = 0
+        self.__shard_readers = dict()
+        # shard files in storage are read only once loaded or committed by this manager- until then they may be
+        # left by another run. every shard is written by the first checkpoint, so no stale shard outlives it
+        self.__are_stored_shards_current = False
+        self.__modified_shards = set(range(AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS))
+        # shards written ahead as pending files of the next checkpoint, they are read from those files until it
+        self.__spilled_shards = set()
+        self.__spill_generation = None
+        self.__memory_budget = memory_budget
+        self.__shard_resident_sizes = [0] * AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS
+
+    def __add_resident_size(self, author_index, number_of_entries, is_new_record=False):
+        self.__shard_resident_sizes[author_index % AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS] += \
+            number_of_entries * AuthorInfoManager.ESTIMATED_AUTHOR_ENTRY_SIZE + \
+            (AuthorInfoManager.ESTIMATED_AUTHOR_RECORD_SIZE if is_new_record else 0)
+
+    def __get_author_index(self, author_id):
+        # intern author id, creating empty records for new authors
+        author_index = self.__author_index.get_id(author_id)
+        if author_index is None:
+            author_index = self.__author_index.add(author_id)
+            self.__author_papers.append(set())
+            self.__author_co_authors.append(set())
+            self.__add_resident_size(author_index, 0, is_new_record=True)
+        return author_index
+
+    def __get_shard_file_path(self, shard_id):
+        storage_file_path = AuthorInfoManager.AUTHOR_STORAGE_FILE_PATH_FORMAT.format(shard_id=shard_id)
+        if shard_id in self.__spilled_shards:
+            return get_temporary_file_path(storage_file_path, self.__spill_generation)
+        if not self.__are_stored_shards_current:
+            return None
+        return storage_file_path
+
+    def __get_shard_reader(self, shard_id):
+        # map shard file and read its index entries, the map is kept open for later lookups
+        if shard_id not in self.__shard_readers:
+            storage_file_path = self.__get_shard_file_path(shard_id)
+            if storage_file_path is None or not os.path.exists(storage_file_path):
+                self.__shard_readers[shard_id] = None
+                return None
+
+            with open(storage_file_path, 'rb') as storage_file:
+                storage_map = mmap.mmap(storage_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version, number_of_shards, number_of_authors, index_offset = \
+                AuthorInfoManager.STORAGE_FILE_HEADER_STRUCT.unpack_from(storage_map, 0)
+            if magic != AuthorInfoManager.STORAGE_FORMAT_MAGIC \
+                    or version != AuthorInfoManager.STORAGE_FORMAT_VERSION \
+                    or number_of_shards != AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS:
+                raise Exception('unsupported author storage file: {file_path} version={version} shards={shards}'
+                                .format(file_path=storage_file_path, version=version, shards=number_of_shards))
+
+            shard_index = np.frombuffer(
+                storage_map, dtype=AuthorInfoManager.SHARD_INDEX_ENTRY_TYPE, count=number_of_authors, offset=index_offset
+            ).copy()
+            self.__shard_readers[shard_id] = (storage_map, shard_index)
+
+        return self.__shard_readers[shard_id]
+
+    @staticmethod
+    def __map_author_entry(storage_map, index_entry):
+        # papers array is followed by co-authors array, both are views of the mapped shard
+        papers_offset = int(index_entry['offset'])
+        co_authors_offset = papers_offset + 4 * int(index_entry['papers'])
+        author_papers = np.frombuffer(storage_map, dtype='<u4', count=int(index_entry['papers']), offset=papers_offset)
+        author_co_authors = \
+            np.frombuffer(storage_map, dtype='<u4', count=int(index_entry['co_authors']), offset=co_authors_offset)
+        return author_papers, author_co_authors
+
+    @staticmethod
+    def __read_author_entry(storage_map, index_entry):
+        author_papers, author_co_authors = AuthorInfoManager.__map_author_entry(storage_map, index_entry)
+        return set(author_papers.tolist()), set(author_co_authors.tolist())
+
+    def __ensure_author_loaded(self, author_index):
+        if self.__author_papers[author_index] is not None:
+            return
+
+        # find author's entry in its shard index
+        author_papers, author_co_authors = set(), set()
+        shard_reader = self.__get_shard_reader(author_index % AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS)
+        if shard_reader is not None:
+            storage_map, shard_index = shard_reader
+            entry_position = np.searchsorted(shard_index['author'], author_index)
+            if entry_position < len(shard_index) and shard_index['author'][entry_position] == author_index:
+                author_papers, author_co_authors = \
+                    AuthorInfoManager.__read_author_entry(storage_map, shard_index[entry_position])
+
+        self.__author_papers[author_index] = author_papers
+        self.__author_co_authors[author_index] = author_co_authors
+        self.__number_of_unloaded_authors -= 1
+        self.__add_resident_size(author_index, len(author_papers) + len(author_co_authors), is_new_record=True)
+
+    def load_author_shard(self, shard_id):
+        # load all authors of a shard that are not loaded yet
+        shard_reader = self.__get_shard_reader(shard_id)
+        if shard_reader is not None:
+            storage_map, shard_index = shard_reader
+            for index_entry in shard_index:
+                author_index = int(index_entry['author'])
+                if self.__author_papers[author_index] is None:
+                    self.__author_papers[author_index], self.__author_co_authors[author_index] = \
+                        AuthorInfoManager.__read_author_entry(storage_map, index_entry)
+                    self.__number_of_unloaded_authors -= 1
+                    self.__add_resident_size(
+                        author_index, int(index_entry['papers']) + int(index_entry['co_authors']), is_new_record=True
+                    )
+
+        # authors without an entry in the shard file get empty records
+        for author_index in range(shard_id, len(self.__author_papers), AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS):
+            self.__ensure_author_loaded(author_index)
+
+    def __load_all_authors(self):
+        if self.__number_of_unloaded_authors > 0:
+            print('loading all author shards..')
+            for shard_id in range(AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS):
+                self.load_author_shard(shard_id)
+
+    def __mark_author_modified(self, author_index):
+        self.__modified_shards.add(author_index % AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS)
+
+    def add_paper_authors(self, paper_id, author_ids):
+        # add paper to all of its authors at once, each author gets the others as co-authors
+        author_indices = [self.__get_author_index(author_id) for author_id in author_ids]
+        for author_index, author_id in zip(author_indices, author_ids):
+            self.__ensure_author_loaded(author_index)
+            if paper_id in self.__author_papers[author_index]:
+                raise Exception('author {author_id} already has paper {paper_id}'.format(
+                    author_id=author_id, paper_id=paper_id))
+
+        for author_index in author_indices:
+            self.__author_papers[author_index].add(paper_id)
+            author_co_authors = self.__author_co_authors[author_index]
+            number_of_co_authors = len(author_co_authors)
+            author_co_authors.update(author_indices)
+            author_co_authors.discard(author_index)
+            self.__add_resident_size(author_index, 1 + len(author_co_authors) - number_of_co_authors)
+            self.__mark_author_modified(author_index)
+
+        return author_indices
+
+    def get_stored_author(self, author_index):
+        """
+        read author's (papers, co-authors) arrays straight from its stored shard, without loading the author.
+        changes made since the author info was stored are not included.
+        """
+        shard_reader = self.__get_shard_reader(author_index % AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS)
+        if shard_reader is not None:
+            storage_map, shard_index = shard_reader
+            entry_position = np.searchsorted(shard_index['author'], author_index)
+            if entry_position < len(shard_index) and shard_index['author'][entry_position] == author_index:
+                author_papers, author_co_authors = \
+                    AuthorInfoManager.__map_author_entry(storage_map, shard_index[entry_position])
+                return author_papers.copy(), author_co_authors.copy()
+
+        return np.empty(0, dtype='<u4'), np.empty(0, dtype='<u4')
 
-        with open(AuthorInfoManager.AUTHOR_STORAGE_FILE_PATH, 'wt') as storage_file:
-            storage_file.write(info_as_string)
+    def get_author_index(self, author_id):
+        return self.__author_index.get_id(author_id)
+
+    def get_author_id(self, author_index):
+        return self.__author_index.get_key(author_index)
+
+    def get_number_of_authors(self):
+        return len(self.__author_papers)
+
+    def get_author_papers(self, author_index):
+        self.__ensure_author_loaded(author_index)
+        return self.__author_papers[author_index]
+
+    def iterate_author_papers(self):
+        self.__load_all_authors()
+        for author_index, author_papers in enumerate(self.__author_papers):
+            yield author_index, author_papers
+
+    def __write_author_shard(self, shard_id, file_path):
+        # make sure all of the shard's authors are in memory before it is rewritten
+        self.load_author_shard(shard_id)
+
+        # shard file may be the one written now, later lookups need to map the new file
+        shard_reader = self.__shard_readers.pop(shard_id, None)
+        if shard_reader is not None:
+            shard_reader[0].close()
+
+        shard_author_indices = range(shard_id, len(self.__author_papers), AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS)
+        shard_index = np.zeros(len(shard_author_indices), dtype=AuthorInfoManager.SHARD_INDEX_ENTRY_TYPE)
+
+        with open(file_path, 'wb', buffering=AuthorInfoManager.STORAGE_WRITE_BUFFER_SIZE) as storage_file:
+            # header is rewritten once the index offset is known
+            storage_file.write(bytes(AuthorInfoManager.STORAGE_FILE_HEADER_STRUCT.size))
+
+            # stream author records one by one
+            current_offset = AuthorInfoManager.STORAGE_FILE_HEADER_STRUCT.size
+            for entry_position, author_index in enumerate(shard_author_indices):
+                author_papers = array('I', sorted(self.__author_papers[author_index]))
+                author_co_authors = array('I', sorted(self.__author_co_authors[author_index]))
+                shard_index[entry_position] = (author_index, len(author_papers), len(author_co_authors), current_offset)
+
+                storage_file.write(author_papers.tobytes())
+                storage_file.write(author_co_authors.tobytes())
+                current_offset += 4 * (len(author_papers) + len(author_co_authors))
+
+            # write offset index and complete header
+            storage_file.write(shard_index.tobytes())
+            storage_file.seek(0)
+            storage_file.write(AuthorInfoManager.STORAGE_FILE_HEADER_STRUCT.pack(
+                AuthorInfoManager.STORAGE_FORMAT_MAGIC,
+                AuthorInfoManager.STORAGE_FORMAT_VERSION,
+                AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS,
+                len(shard_index),
+                current_offset
+            ))
+            sync_file(storage_file)
+
+    def __set_spill_generation(self, generation):
+        # shards spilled for another generation are loaded back, and written again for this one
+        if self.__spill_generation != generation:
+            for shard_id in self.__spilled_shards:
+                self.load_author_shard(shard_id)
+            self.__modified_shards.update(self.__spilled_shards)
+            self.__spilled_shards = set()
+            self.__spill_generation = generation
+
+    def __write_modified_shards(self, generation):
+        # write modified shards as pending files of checkpoint 'generation', returns their shard ids
+        print('storing {num_shards} modified author shards'.format(num_shards=len(self.__modified_shards)))
+        written_shards = sorted(self.__modified_shards)
+        for shard_id in written_shards:
+            storage_file_path = AuthorInfoManager.AUTHOR_STORAGE_FILE_PATH_FORMAT.format(shard_id=shard_id)
+            self.__write_author_shard(shard_id, get_temporary_file_path(storage_file_path, generation))
+        self.__modified_shards.clear()
+        return written_shards
+
+    def spill_modified_shards(self, generation):
+        """
+        release loaded authors down to the memory budget release target. written shards are released first, then
+        modified shards are written ahead as pending files of the next checkpoint 'generation' and released.
+        only the shards are written- the id index and the stored shards are left as they are, so a crash before
+        that checkpoint does not see the spilled shards.
+        """
+        self.__set_spill_generation(generation)
+        self.__release_stored_shards(generation)
+
+    def prepare_author_info(self, generation=None):
+        # write author index and modified shards next to the stored files, returns the files to commit
+        print('num of authors: ' + str(len(self.__author_papers)))
+        pending_file_paths = [AuthorInfoManager.AUTHOR_INDEX_FILE_PATH]
+        self.__author_index.write(get_temporary_file_path(AuthorInfoManager.AUTHOR_INDEX_FILE_PATH, generation))
+
+        # only shards with modified authors need to be written, spilled shards already were
+        self.__set_spill_generation(generation)
+        written_shards = set(self.__write_modified_shards(generation)) | self.__spilled_shards
+        pending_file_paths += [
+            AuthorInfoManager.AUTHOR_STORAGE_FILE_PATH_FORMAT.format(shard_id=shard_id)
+            for shard_id in sorted(written_shards)
+        ]
+        return pending_file_paths
+
+    def commit_author_info(self, pending_file_paths, generation=None):
+        commit_temporary_files(pending_file_paths, generation)
+        self.__are_stored_shards_current = True
+        self.__spilled_shards = set()
+        self.__spill_generation = None
+        self.__author_index.load(AuthorInfoManager.AUTHOR_INDEX_FILE_PATH)
+        self.__release_stored_shards()
+
+    def is_over_memory_budget(self):
+        # modified shards can only be released once written, the checkpoint manager then spills them early
+        return sum(self.__shard_resident_sizes) > self.__memory_budget
+
+    def __release_stored_shards(self, spill_generation=None):
+        # drop loaded authors of written shards, largest first, until the estimate is within the release target.
+        # with spill_generation, modified shards are then spilled and dropped too, largest first.
+        # released authors are read again from their shard on next access
+        released_shards = 0
+        released_shard_order = sorted(
+            range(AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS),
+            key=lambda shard: (shard in self.__modified_shards, -self.__shard_resident_sizes[shard])
+        )
+        for shard_id in released_shard_order:
+            if sum(self.__shard_resident_sizes) <= \
+                    self.__memory_budget * AuthorInfoManager.MEMORY_BUDGET_RELEASE_TARGET:
+                break
+            if shard_id in self.__modified_shards:
+                if spill_generation is None:
+                    break
+                storage_file_path = AuthorInfoManager.AUTHOR_STORAGE_FILE_PATH_FORMAT.format(shard_id=shard_id)
+                self.__write_author_shard(shard_id, get_temporary_file_path(storage_file_path, spill_generation))
+                self.__modified_shards.discard(shard_id)
+                self.__spilled_shards.add(shard_id)
+
+            for author_index in range(shard_id, len(self.__author_papers), AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS):
+                if self.__author_papers[author_index] is not None:
+                    self.__author_papers[author_index] = None
+                    self.__author_co_authors[author_index] = None
+                    self.__number_of_unloaded_authors += 1
+            self.__shard_resident_sizes[shard_id] = 0
+            released_shards += 1
+
+        if released_shards > 0:
+            print('released {num_shards} stored author shards, estimated resident size {num_bytes} bytes'
+                  .format(num_shards=released_shards, num_bytes=sum(self.__shard_resident_sizes)))
+
+    def store_author_info(self):
+        self.commit_author_info(self.prepare_author_info())
 
     def load_author_info(self):
         print('loading author info from storage..')
 
-        with open(AuthorInfoManager.AUTHOR_STORAGE_FILE_PATH, 'rt') as storage_file:
-            file_content = storage_file.read()
-
-        print('parsing as json..')
-        self.__authors = json.loads(file_content)
-        print('num of loaded authors: ' + str(len(self.__authors.keys())))
+        # only the id index is loaded, authors are read from their shard on first access
+        self.__author_index = IdIndex()
+        self.__author_index.load(AuthorInfoManager.AUTHOR_INDEX_FILE_PATH)
+        number_of_authors = len(self.__author_index)
+        self.__author_papers = [None] * number_of_authors
+        self.__author_co_authors = [None] * number_of_authors
+        self.__number_of_unloaded_authors = number_of_authors
+        self.__are_stored_shards_current = True
+        self.__modified_shards = set()
+        self.__spilled_shards = set()
+        self.__spill_generation = None
+        self.__shard_resident_sizes = [0] * AuthorInfoManager.NUMBER_OF_AUTHOR_SHARDS
+        for shard_reader in self.__shard_readers.values():
+            if shard_reader is not None:
+                shard_reader[0].close()
+        self.__shard_readers = dict()
+        print('num of loaded authors: ' + str(number_of_authors))
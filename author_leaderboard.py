@@ -0,0 +1,354 @@
+import json
+import time
+from array import array
+from bisect import bisect_left, insort
+from itertools import chain
+import numpy as np
+from h_index_engine import load_author_papers
+from storage_files import get_temporary_file_path, sync_file, commit_temporary_files
+
+
+class RankedKeyList:
+    """
+    sorted list of integer keys, kept as sorted chunks of at most MAX_CHUNK_SIZE keys.
+    adding or removing a key moves keys of one chunk only, the rank of a key sums lengths of the chunks before it.
+    """
+
+    MAX_CHUNK_SIZE = 2048
+    KEY_TYPE_CODE = 'Q'
+
+    def __init__(self, sorted_keys=None):
+        # sorted_keys is a sorted numpy uint64 array
+        self.__chunks = list()
+        if sorted_keys is not None:
+            chunk_size = RankedKeyList.MAX_CHUNK_SIZE // 2
+            for chunk_start in range(0, len(sorted_keys), chunk_size):
+                chunk = array(RankedKeyList.KEY_TYPE_CODE)
+                chunk.frombytes(sorted_keys[chunk_start:chunk_start + chunk_size].tobytes())
+                self.__chunks.append(chunk)
+        self.__chunk_maxes = [chunk[-1] for chunk in self.__chunks]
+        self.__number_of_keys = sum(len(chunk) for chunk in self.__chunks)
+
+    def __len__(self):
+        return self.__number_of_keys
+
+    def __iter__(self):
+        return chain.from_iterable(self.__chunks)
+
+    def add(self, key):
+        if len(self.__chunks) == 0:
+            self.__chunks.append(array(RankedKeyList.KEY_TYPE_CODE, [key]))
+            self.__chunk_maxes.append(key)
+            self.__number_of_keys = 1
+            return
+
+        chunk_index = min(bisect_left(self.__chunk_maxes, key), len(self.__chunks) - 1)
+        chunk = self.__chunks[chunk_index]
+        insort(chunk, key)
+        self.__chunk_maxes[chunk_index] = chunk[-1]
+        self.__number_of_keys += 1
+
+        # split a full chunk in halves
+        if len(chunk) > RankedKeyList.MAX_CHUNK_SIZE:
+            upper_half = chunk[len(chunk) // 2:]
+            del chunk[len(chunk) // 2:]
+            self.__chunks.insert(chunk_index + 1, upper_half)
+            self.__chunk_maxes.insert(chunk_index + 1, upper_half[-1])
+            self.__chunk_maxes[chunk_index] = chunk[-1]
+
+    def remove(self, key):
+        chunk_index = bisect_left(self.__chunk_maxes, key)
+        chunk = self.__chunks[chunk_index] if chunk_index < len(self.__chunks) else None
+        key_position = bisect_left(chunk, key) if chunk is not None else 0
+        if chunk is None or key_position == len(chunk) or chunk[key_position] != key:
+            raise Exception('key not in ranked key list: {key}'.format(key=key))
+
+        del chunk[key_position]
+        self.__number_of_keys -= 1
+        if len(chunk) == 0:
+            del self.__chunks[chunk_index]
+            del self.__chunk_maxes[chunk_index]
+        else:
+            self.__chunk_maxes[chunk_index] = chunk[-1]
+
+    def get_rank(self, key):
+        # number of keys smaller than key
+        chunk_index = bisect_left(self.__chunk_maxes, key)
+        keys_before = sum(len(chunk) for chunk in self.__chunks[:chunk_index])
+        if chunk_index == len(self.__chunks):
+            return keys_before
+        return keys_before + bisect_left(self.__chunks[chunk_index], key)
+
+    def iterate_key_blocks(self):
+        # yield keys in order, a chunk at a time as numpy arrays
+        for chunk in self.__chunks:
+            yield np.array(chunk, dtype=np.uint64)
+
+    def get_keys(self):
+        # all keys as a sorted numpy array
+        all_keys = np.empty(self.__number_of_keys, dtype=np.uint64)
+        key_position = 0
+        for chunk in self.__chunks:
+            all_keys[key_position:key_position + len(chunk)] = chunk
+            key_position += len(chunk)
+        return all_keys
+
+
+class AuthorLeaderboard:
+    """
+    ranked index of authors by h-index and by total citations, overall or for authors active since a year-
+    authors with a paper published in that year or later.
+    h-index is taken from the h-index tracker, citations and last active year are kept from the tracker's author
+    papers and the paper manager's citations. updates only mark authors as changed, and changed authors are
+    moved in the ranking before the next query, so adding papers and citations costs O(1) per author.
+    each metric ranks authors by a key of (descending value, author index)- ties are ordered by author index.
+    the index is stored next to the author info with each checkpoint, and loading it does not sort.
+    """
+
+    H_INDEX_METRIC = 'h_index'
+    CITATIONS_METRIC = 'citations'
+    METRICS = (H_INDEX_METRIC, CITATIONS_METRIC)
+
+    AUTHOR_VALUES_FILE_PATH = r'storage/leaderboard_author_values.npy'
+    RANKED_KEYS_FILE_PATH_FORMAT = r'storage/leaderboard_{metric}_keys.npy'
+    INFO_FILE_PATH = r'storage/leaderboard_info.json'
+    NUMBER_OF_AUTHORS_KEY_NAME = 'number_of_authors'
+
+    # key is (max value - value) << 32 | author index, so ascending keys are descending values
+    AUTHOR_INDEX_BITS = 32
+    AUTHOR_INDEX_MASK = (1 << AUTHOR_INDEX_BITS) - 1
+    MAX_VALUE = (1 << 31) - 1
+    # above this share of changed authors, rankings are rebuilt by sorting rather than moving each author
+    REBUILD_CHANGED_FRACTION = 0.1
+
+    def __init__(self, h_index_tracker=None):
+        # without a tracker, the leaderboard can only be loaded and queried
+        self.__h_index_tracker = h_index_tracker
+        # per-author values, indexed by author index
+        self.__total_citations = array('Q')
+        # years are bounded by dataset_parser.MAX_PAPER_YEAR before a paper is added, so they fit 16 bits
+        self.__last_active_years = array('H')
+        # values the authors are currently ranked by, per metric
+        self.__ranked_values = {metric: array('Q') for metric in AuthorLeaderboard.METRICS}
+        self.__ranked_keys = {metric: RankedKeyList() for metric in AuthorLeaderboard.METRICS}
+        self.__changed_authors = set()
+        if h_index_tracker is not None:
+            h_index_tracker.add_author_paper_listener(self.add_author_paper)
+
+    @staticmethod
+    def __get_key(value, author_index):
+        return ((AuthorLeaderboard.MAX_VALUE - min(value, AuthorLeaderboard.MAX_VALUE))
+                << AuthorLeaderboard.AUTHOR_INDEX_BITS) | author_index
+
+    def __ensure_author(self, author_index):
+        while len(self.__total_citations) <= author_index:
+            self.__total_citations.append(0)
+            self.__last_active_years.append(0)
+
+    def add_author_paper(self, author_index, citation_count, paper_year):
+        # called by the h-index tracker when a paper is added to an author
+        self.__ensure_author(author_index)
+        self.__total_citations[author_index] += citation_count
+        if paper_year is not None and int(paper_year) > self.__last_active_years[author_index]:
+            self.__last_active_years[author_index] = int(paper_year)
+        self.__changed_authors.add(author_index)
+
+    def on_citation_added(self, paper_record_id, citation_count, added_citations_count=1):
+        # paper manager's citation listener, registered after the h-index tracker's
+        for author_index in self.__h_index_tracker.get_paper_authors(paper_record_id):
+            self.__total_citations[author_index] += added_citations_count
+            self.__changed_authors.add(author_index)
+
+    def __get_value(self, metric, author_index):
+        if metric == AuthorLeaderboard.H_INDEX_METRIC:
+            return self.__h_index_tracker.get_h_index(author_index) or 0
+        return self.__total_citations[author_index]
+
+    def __get_values(self, metric):
+        # values of all authors as a numpy array
+        if metric == AuthorLeaderboard.H_INDEX_METRIC:
+            return np.fromiter(
+                (self.__get_value(metric, author_index) for author_index in range(len(self.__total_citations))),
+                dtype=np.int64, count=len(self.__total_citations)
+            )
+        return np.frombuffer(self.__total_citations, dtype=np.uint64).astype(np.int64)
+
+    def __rebuild_rankings(self):
+        author_indices = np.arange(len(self.__total_citations), dtype=np.uint64)
+        for metric in AuthorLeaderboard.METRICS:
+            author_values = self.__get_values(metric)
+            ranked_keys = ((AuthorLeaderboard.MAX_VALUE - np.minimum(author_values, AuthorLeaderboard.MAX_VALUE))
+                           .astype(np.uint64) << np.uint64(AuthorLeaderboard.AUTHOR_INDEX_BITS)) | author_indices
+            ranked_keys.sort()
+            self.__ranked_keys[metric] = RankedKeyList(ranked_keys)
+            self.__ranked_values[metric] = array('Q', author_values.astype(np.uint64).tobytes())
+        self.__changed_authors = set()
+
+    def __update_rankings(self):
+        # move changed authors to their new positions, new authors are added
+        number_of_authors = len(self.__total_citations)
+        if len(self.__changed_authors) == 0:
+            return
+        if len(self.__changed_authors) > AuthorLeaderboard.REBUILD_CHANGED_FRACTION * number_of_authors:
+            self.__rebuild_rankings()
+            return
+
+        for metric in AuthorLeaderboard.METRICS:
+            ranked_values = self.__ranked_values[metric]
+            ranked_keys = self.__ranked_keys[metric]
+            number_of_ranked_authors = len(ranked_values)
+            for author_index in self.__changed_authors:
+                author_value = self.__get_value(metric, author_index)
+                if author_index >= number_of_ranked_authors:
+                    continue
+                if author_value != ranked_values[author_index]:
+                    ranked_keys.remove(AuthorLeaderboard.__get_key(ranked_values[author_index], author_index))
+                    ranked_keys.add(AuthorLeaderboard.__get_key(author_value, author_index))
+                    ranked_values[author_index] = author_value
+
+            for author_index in range(number_of_ranked_authors, number_of_authors):
+                author_value = self.__get_value(metric, author_index)
+                ranked_keys.add(AuthorLeaderboard.__get_key(author_value, author_index))
+                ranked_values.append(author_value)
+
+        self.__changed_authors = set()
+
+    def rebuild(self, author_info_manager, paper_info_manager):
+        # derive all values from stored records, after the h-index tracker was rebuilt
+        print('rebuilding author leaderboard..')
+        citation_counts = np.fromiter(
+            paper_info_manager.iterate_total_citation_counts(), dtype=np.int64,
+            count=paper_info_manager.get_number_of_records()
+        )
+        publication_years = np.fromiter(
+            (0 if paper_year is None else int(paper_year)
+             for paper_year in paper_info_manager.iterate_publication_years()),
+            dtype=np.int64, count=paper_info_manager.get_number_of_records()
+        )
+        author_offsets, paper_indices = load_author_papers(author_info_manager)
+        pair_author_index = np.repeat(np.arange(len(author_offsets) - 1), np.diff(author_offsets))
+
+        total_citations = np.bincount(
+            pair_author_index, weights=citation_counts[paper_indices], minlength=len(author_offsets) - 1
+        )
+        last_active_years = np.zeros(len(author_offsets) - 1, dtype=np.int64)
+        np.maximum.at(last_active_years, pair_author_index, publication_years[paper_indices])
+
+        self.__total_citations = array('Q', total_citations.astype(np.uint64).tobytes())
+        self.__last_active_years = array('H', last_active_years.astype(np.uint16).tobytes())
+        self.__rebuild_rankings()
+
+    def __iterate_ranked_authors(self, metric, active_since_year=None):
+        # yield blocks of author indices in rank order, filtered by activity
+        for block_keys in self.__ranked_keys[metric].iterate_key_blocks():
+            author_indices = (block_keys & np.uint64(AuthorLeaderboard.AUTHOR_INDEX_MASK)).astype(np.int64)
+            if active_since_year is not None:
+                author_indices = author_indices[self.__get_last_active_years(author_indices) >= active_since_year]
+            yield author_indices
+
+    def __get_last_active_years(self, author_indices):
+        # the view of the array is released right after indexing, so the array can still grow
+        return np.frombuffer(self.__last_active_years, dtype=np.uint16)[author_indices]
+
+    def get_top_authors(self, metric, number_of_authors, active_since_year=None):
+        # returns [(author index, value)] of the top ranked authors
+        self.__update_rankings()
+        top_authors = list()
+        for author_indices in self.__iterate_ranked_authors(metric, active_since_year):
+            for author_index in author_indices[:number_of_authors - len(top_authors)].tolist():
+                top_authors.append((author_index, self.__ranked_values[metric][author_index]))
+            if len(top_authors) >= number_of_authors:
+                break
+        return top_authors
+
+    def get_author_rank(self, metric, author_index, active_since_year=None):
+        # 1-based rank of the author, None if author is unknown or was not active since the year
+        self.__update_rankings()
+        if author_index >= len(self.__ranked_values[metric]):
+            return None
+        if active_since_year is not None and self.__last_active_years[author_index] < active_since_year:
+            return None
+
+        author_key = AuthorLeaderboard.__get_key(self.__ranked_values[metric][author_index], author_index)
+        number_of_authors_before = self.__ranked_keys[metric].get_rank(author_key)
+        if active_since_year is None:
+            return number_of_authors_before + 1
+
+        # count active authors ranked before, a block of keys at a time
+        active_authors_before = 0
+        for author_indices in self.__iterate_ranked_authors(metric):
+            block_authors = author_indices[:number_of_authors_before]
+            active_authors_before += \
+                int(np.count_nonzero(self.__get_last_active_years(block_authors) >= active_since_year))
+            number_of_authors_before -= len(block_authors)
+            if number_of_authors_before == 0:
+                break
+        return active_authors_before + 1
+
+    def get_author_values(self, author_index):
+        # {metric: value} and last active year of the author, None if author is unknown
+        self.__update_rankings()
+        if author_index >= len(self.__total_citations):
+            return None
+        author_values = {metric: self.__ranked_values[metric][author_index] for metric in AuthorLeaderboard.METRICS}
+        author_values['last_active_year'] = self.__last_active_years[author_index]
+        return author_values
+
+    def prepare_leaderboard(self, generation=None):
+        # write the leaderboard next to the stored files, returns paths to pass to commit_leaderboard
+        start_time = time.time()
+        self.__update_rankings()
+        author_values = np.zeros((len(self.__total_citations), 3), dtype=np.uint64)
+        for metric_position, metric in enumerate(AuthorLeaderboard.METRICS):
+            author_values[:, metric_position] = np.frombuffer(self.__ranked_values[metric], dtype=np.uint64)
+        author_values[:, 2] = np.frombuffer(self.__last_active_years, dtype=np.uint16)
+
+        array_files = [(AuthorLeaderboard.AUTHOR_VALUES_FILE_PATH, author_values)] + [
+            (AuthorLeaderboard.RANKED_KEYS_FILE_PATH_FORMAT.format(metric=metric),
+             self.__ranked_keys[metric].get_keys())
+            for metric in AuthorLeaderboard.METRICS
+        ]
+        for file_path, array_data in array_files:
+            with open(get_temporary_file_path(file_path, generation), 'wb') as array_file:
+                np.save(array_file, array_data)
+                sync_file(array_file)
+        with open(get_temporary_file_path(AuthorLeaderboard.INFO_FILE_PATH, generation), 'wb') as info_file:
+            info_file.write(json.dumps({
+                AuthorLeaderboard.NUMBER_OF_AUTHORS_KEY_NAME: len(self.__total_citations)
+            }).encode())
+            sync_file(info_file)
+
+        print('stored author leaderboard of {num_authors} authors in {seconds:.2f} seconds'
+              .format(num_authors=len(self.__total_citations), seconds=time.time() - start_time))
+        # info file is replaced last
+        return [file_path for file_path, _ in array_files] + [AuthorLeaderboard.INFO_FILE_PATH]
+
+    def commit_leaderboard(self, pending_file_paths, generation=None):
+        commit_temporary_files(pending_file_paths, generation)
+
+    def store(self):
+        self.commit_leaderboard(self.prepare_leaderboard())
+
+    def get_number_of_authors(self):
+        return len(self.__total_citations)
+
+    def load(self):
+        with open(AuthorLeaderboard.INFO_FILE_PATH, 'rt') as info_file:
+            number_of_authors = json.loads(info_file.read())[AuthorLeaderboard.NUMBER_OF_AUTHORS_KEY_NAME]
+        author_values = np.load(AuthorLeaderboard.AUTHOR_VALUES_FILE_PATH)
+        if len(author_values) != number_of_authors:
+            raise Exception('author leaderboard files do not match: {file_path}'
+                            .format(file_path=AuthorLeaderboard.AUTHOR_VALUES_FILE_PATH))
+
+        # stored keys are sorted, so rankings are loaded as they are
+        for metric_position, metric in enumerate(AuthorLeaderboard.METRICS):
+            self.__ranked_values[metric] = \
+                array('Q', np.ascontiguousarray(author_values[:, metric_position]).tobytes())
+            self.__ranked_keys[metric] = RankedKeyList(
+                np.load(AuthorLeaderboard.RANKED_KEYS_FILE_PATH_FORMAT.format(metric=metric))
+            )
+        self.__total_citations = array('Q', np.ascontiguousarray(
+            author_values[:, AuthorLeaderboard.METRICS.index(AuthorLeaderboard.CITATIONS_METRIC)]
+        ).tobytes())
+        self.__last_active_years = array('H', author_values[:, 2].astype(np.uint16).tobytes())
+        self.__changed_authors = set()
@@ -0,0 +1,394 @@
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import contextlib
+import multiprocessing
+import urllib.parse
+import main
+import query_server
+from paper_info_manager import PaperInfoManager
+from h_index_engine import HIndexEngine
+from metrics_registry import MetricsRegistry, set_metrics_registry
+from dataset_parser import PAPER_ID_FIELD_NAME, PAPER_YEAR_FIELD_NAME, REFERENCES_FIELD_NAME, parse_paper_line, \
+    open_dataset_file
+from synthetic_dataset import SyntheticDatasetGenerator
+
+
+DATASET_FILE_NAME_FORMAT = 'synthetic-ref-{file_id}.json'
+DEFAULT_NUMBER_OF_PAPERS = 100000
+DEFAULT_NUMBER_OF_FILES = 4
+DEFAULT_RESULTS_FILE_PATH = 'benchmark_results.json'
+PAPER_BATCH_SIZE = main.DEFAULT_PAPER_BATCH_SIZE
+# small enough to keep the cache evicting for most of the run
+EVICTION_CACHE_MEMORY_BUDGET = 4 * 1024 ** 2
+PARTITIONED_INGESTION_PARTITIONS = 4
+QUERY_CLIENT_CONNECTIONS = 64
+QUERY_SERVER_START_TIMEOUT_SECONDS = 60
+
+
+def load_papers(db_file_info_list):
+    # papers as given to PaperInfoManager.add_papers, in file order
+    papers = list()
+    for dataset_file_path, _ in db_file_info_list:
+        with open(dataset_file_path, 'rb') as dataset_file:
+            for line_index, file_line in enumerate(dataset_file):
+                paper_attributes = parse_paper_line(file_line, line_index)
+                if paper_attributes is not None:
+                    papers.append((
+                        paper_attributes[PAPER_ID_FIELD_NAME],
+                        str(paper_attributes[PAPER_YEAR_FIELD_NAME]),
+                        paper_attributes[REFERENCES_FIELD_NAME]
+                    ))
+    return papers
+
+
+def add_papers_in_batches(paper_info_manager, papers):
+    # returns latency of every batch
+    batch_seconds = list()
+    for batch_start in range(0, len(papers), PAPER_BATCH_SIZE):
+        start_time = time.perf_counter()
+        paper_info_manager.add_papers(papers[batch_start:batch_start + PAPER_BATCH_SIZE])
+        batch_seconds.append(time.perf_counter() - start_time)
+    return batch_seconds
+
+
+def summarize_latencies(latencies):
+    sorted_latencies = sorted(latencies)
+    return {
+        'mean_seconds': sum(sorted_latencies) / len(sorted_latencies),
+        'p50_seconds': sorted_latencies[len(sorted_latencies) // 2],
+        'p99_seconds': sorted_latencies[min(len(sorted_latencies) - 1, int(len(sorted_latencies) * 0.99))],
+        'max_seconds': sorted_latencies[-1]
+    } if len(sorted_latencies) > 0 else None
+
+
+def build_result(operations, operation_name, seconds, latency=None, **extra_results):
+    benchmark_result = {
+        'operations': operations,
+        'operation_name': operation_name,
+        'seconds': seconds,
+        'throughput': operations / seconds if seconds > 0 else None,
+        'latency': latency
+    }
+    benchmark_result.update(extra_results)
+    return benchmark_result
+
+
+def count_dataset_lines(db_file_info_list):
+    number_of_lines = 0
+    for dataset_file_path, _ in db_file_info_list:
+        dataset_file, _ = open_dataset_file(dataset_file_path, 0, None)
+        with dataset_file:
+            number_of_lines += sum(1 for _ in dataset_file)
+    return number_of_lines
+
+
+def benchmark_ingestion(db_file_info_list, **main_arguments):
+    # end to end run of main.main, h-index calculation and final checkpoint included
+    start_time = time.perf_counter()
+    main.main(db_file_info_list, **main_arguments)
+    seconds = time.perf_counter() - start_time
+    return build_result(count_dataset_lines(db_file_info_list), 'lines', seconds)
+
+
+def benchmark_sequential_ingestion(db_file_info_list):
+    return benchmark_ingestion(db_file_info_list)
+
+
+def benchmark_pipeline_ingestion(db_file_info_list):
+    return benchmark_ingestion(db_file_info_list, number_of_parser_workers=2)
+
+
+def benchmark_bulk_ingestion(db_file_info_list):
+    return benchmark_ingestion(db_file_info_list, bulk_build=True)
+
+
+def benchmark_partitioned_ingestion(db_file_info_list):
+    return benchmark_ingestion(db_file_info_list, number_of_partitions=PARTITIONED_INGESTION_PARTITIONS)
+
+
+def benchmark_compressed_ingestion(db_file_info_list):
+    # sequential ingestion of the dataset files gzip compressed, compare with sequential_ingestion
+    compressed_file_info_list = list()
+    for dataset_file_path, first_line in db_file_info_list:
+        compressed_file_path = os.path.abspath(os.path.basename(dataset_file_path) + '.gz')
+        with open(dataset_file_path, 'rb') as dataset_file, gzip.open(compressed_file_path, 'wb') as compressed_file:
+            shutil.copyfileobj(dataset_file, compressed_file)
+        compressed_file_info_list.append([compressed_file_path, first_line])
+    return benchmark_ingestion(compressed_file_info_list)
+
+
+def benchmark_cache_eviction(db_file_info_list):
+    # add papers with a cache much smaller than the records, latency is per batch and per eviction
+    papers = load_papers(db_file_info_list)
+    metrics_registry = MetricsRegistry(snapshot_interval=float('inf'))
+    set_metrics_registry(metrics_registry)
+    paper_info_manager = PaperInfoManager(cache_memory_budget=EVICTION_CACHE_MEMORY_BUDGET)
+
+    start_time = time.perf_counter()
+    batch_seconds = add_papers_in_batches(paper_info_manager, papers)
+    seconds = time.perf_counter() - start_time
+
+    metrics_snapshot = metrics_registry.get_snapshot()
+    return build_result(
+        metrics_snapshot['counters']['citations_applied'], 'citations', seconds, summarize_latencies(batch_seconds),
+        eviction=metrics_snapshot['timers'].get('cache_eviction'),
+        cache=paper_info_manager.get_cache_statistics()
+    )
+
+
+def benchmark_record_codec(db_file_info_list):
+    # encode and decode every record of the dataset
+    paper_info_manager = PaperInfoManager()
+    add_papers_in_batches(paper_info_manager, load_papers(db_file_info_list))
+    paper_records = [
+        {PaperInfoManager.PUBLICATION_YEAR_KEY_NAME: None, PaperInfoManager.CITATION_INFO_KEY_NAME: citation_info}
+        for citation_info in paper_info_manager.iterate_citation_histories()
+    ]
+    records_data = [PaperInfoManager.encode_record(paper_record) for paper_record in paper_records]
+
+    start_time = time.perf_counter()
+    for paper_record in paper_records:
+        PaperInfoManager.encode_record(paper_record)
+    encode_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for record_data in records_data:
+        PaperInfoManager.decode_record(record_data)
+    decode_seconds = time.perf_counter() - start_time
+
+    return build_result(
+        2 * len(records_data), 'records', encode_seconds + decode_seconds,
+        encode_seconds=encode_seconds, decode_seconds=decode_seconds,
+        mean_record_size=sum(map(len, records_data)) / max(1, len(records_data))
+    )
+
+
+def benchmark_store_cache(db_file_info_list):
+    # flush a cache where every record is dirty
+    paper_info_manager = PaperInfoManager()
+    add_papers_in_batches(paper_info_manager, load_papers(db_file_info_list))
+
+    start_time = time.perf_counter()
+    paper_info_manager.store_cache()
+    seconds = time.perf_counter() - start_time
+    return build_result(
+        paper_info_manager.get_number_of_records(), 'records', seconds,
+        storage=paper_info_manager.get_storage_statistics()
+    )
+
+
+def benchmark_restore(db_file_info_list):
+    # restore stored state, then read every record from storage
+    paper_info_manager = PaperInfoManager()
+    add_papers_in_batches(paper_info_manager, load_papers(db_file_info_list))
+    paper_info_manager.store_cache()
+    del paper_info_manager
+
+    start_time = time.perf_counter()
+    paper_info_manager = PaperInfoManager()
+    paper_info_manager.restore_stored_state()
+    restore_seconds = time.perf_counter() - start_time
+    total_citations = sum(paper_info_manager.iterate_total_citation_counts())
+    seconds = time.perf_counter() - start_time
+
+    return build_result(
+        paper_info_manager.get_number_of_records(), 'records', seconds,
+        restore_seconds=restore_seconds, read_seconds=seconds - restore_seconds, total_citations=total_citations
+    )
+
+
+def get_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind((query_server.QueryServer.DEFAULT_HOST, 0))
+        return free_socket.getsockname()[1]
+
+
+async def send_queries(server_port, query_paths, number_of_connections):
+    # query paths are split between keep-alive connections, returns latency of every query
+    query_latencies = list()
+
+    async def send_connection_queries(connection_query_paths):
+        stream_reader, stream_writer = \
+            await asyncio.open_connection(query_server.QueryServer.DEFAULT_HOST, server_port)
+        for query_path in connection_query_paths:
+            start_time = time.perf_counter()
+            stream_writer.write('GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path=query_path).encode())
+            response_head = await stream_reader.readuntil(b'\r\n\r\n')
+            for header_line in response_head.split(b'\r\n'):
+                if header_line.lower().startswith(b'content-length:'):
+                    await stream_reader.readexactly(int(header_line.split(b':', 1)[1]))
+            query_latencies.append(time.perf_counter() - start_time)
+        stream_writer.close()
+
+    await asyncio.gather(*[
+        send_connection_queries(query_paths[connection_index::number_of_connections])
+        for connection_index in range(number_of_connections)
+    ])
+    return query_latencies
+
+
+def wait_for_server(server_port, server_process):
+    start_time = time.time()
+    while time.time() - start_time < QUERY_SERVER_START_TIMEOUT_SECONDS and server_process.is_alive():
+        try:
+            socket.create_connection((query_server.QueryServer.DEFAULT_HOST, server_port)).close()
+            return
+        except ConnectionError:
+            time.sleep(0.1)
+    raise Exception('query server did not start on port {port}'.format(port=server_port))
+
+
+def benchmark_query_server(db_file_info_list):
+    # build the store, then query h-index, citations and co-authors of every author in a seeded random order
+    main.main(db_file_info_list)
+    with open(HIndexEngine.H_INDEX_STORAGE_FILE_PATH, 'rt') as h_index_file:
+        author_ids = list(json.load(h_index_file).keys())
+    query_paths = [
+        '/authors/{author_id}/{query_name}'.format(author_id=urllib.parse.quote(author_id), query_name=query_name)
+        for author_id in author_ids
+        for query_name in sorted(query_server.QueryServer.AUTHOR_QUERY_NAMES)
+    ]
+    random.Random(SyntheticDatasetGenerator.DEFAULT_SEED).shuffle(query_paths)
+
+    server_port = get_free_port()
+    server_process = multiprocessing.Process(target=query_server.run_query_server, args=(
+        query_server.QueryServer.DEFAULT_HOST, server_port, query_server.QueryServer.DEFAULT_RESULT_CACHE_SIZE
+    ))
+    server_process.start()
+    try:
+        wait_for_server(server_port, server_process)
+        start_time = time.perf_counter()
+        query_latencies = asyncio.run(send_queries(server_port, query_paths, QUERY_CLIENT_CONNECTIONS))
+        seconds = time.perf_counter() - start_time
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    return build_result(len(query_latencies), 'queries', seconds, summarize_latencies(query_latencies),
+                        connections=QUERY_CLIENT_CONNECTIONS)
+
+
+BENCHMARKS = {
+    'sequential_ingestion': benchmark_sequential_ingestion,
+    'pipeline_ingestion': benchmark_pipeline_ingestion,
+    'bulk_ingestion': benchmark_bulk_ingestion,
+    'partitioned_ingestion': benchmark_partitioned_ingestion,
+    'compressed_ingestion': benchmark_compressed_ingestion,
+    'cache_eviction': benchmark_cache_eviction,
+    'record_codec': benchmark_record_codec,
+    'store_cache': benchmark_store_cache,
+    'restore': benchmark_restore,
+    'query_server': benchmark_query_server
+}
+
+
+def run_benchmark(benchmark_name, db_file_info_list, working_directory, result_connection):
+    """
+    runs in a process of its own, so peak rss is the benchmark's alone. the process is not a pool worker,
+    since benchmarks may start worker processes themselves. peak rss of the largest of those processes
+    (parser pool, partitions, query server) is reported separately, once they were joined.
+    storage paths are relative, the benchmark runs in an empty working directory.
+    """
+    os.makedirs(os.path.join(working_directory, 'storage'))
+    os.chdir(working_directory)
+    with open(os.devnull, 'wt') as null_file, contextlib.redirect_stdout(null_file):
+        benchmark_result = BENCHMARKS[benchmark_name](db_file_info_list)
+
+    benchmark_result['benchmark'] = benchmark_name
+    benchmark_result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    benchmark_result['peak_children_rss_bytes'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    result_connection.send(benchmark_result)
+    result_connection.close()
+
+
+def get_commit_id():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(benchmark_names, number_of_papers=DEFAULT_NUMBER_OF_PAPERS,
+                   number_of_files=DEFAULT_NUMBER_OF_FILES, seed=SyntheticDatasetGenerator.DEFAULT_SEED):
+    """
+    generate the dataset once, and run each benchmark on it in a new process.
+    returns a report that is comparable across commits for the same scale and seed.
+    """
+    base_directory = tempfile.mkdtemp(prefix='h_index_benchmark_')
+    try:
+        print('generating {num_papers} papers, seed {seed}'.format(num_papers=number_of_papers, seed=seed))
+        db_file_info_list = SyntheticDatasetGenerator(seed).generate_files(
+            os.path.join(base_directory, DATASET_FILE_NAME_FORMAT), number_of_papers, number_of_files
+        )
+
+        benchmark_results = list()
+        for benchmark_name in benchmark_names:
+            print('running benchmark: {benchmark_name}'.format(benchmark_name=benchmark_name))
+            receive_connection, send_connection = multiprocessing.Pipe(duplex=False)
+            benchmark_process = multiprocessing.Process(target=run_benchmark, args=(
+                benchmark_name, db_file_info_list, os.path.join(base_directory, benchmark_name), send_connection
+            ))
+            benchmark_process.start()
+            send_connection.close()
+            try:
+                benchmark_result = receive_connection.recv()
+            except EOFError:
+                raise Exception('benchmark {benchmark_name} failed'.format(benchmark_name=benchmark_name))
+            finally:
+                benchmark_process.join()
+            print('  {operations} {operation_name} in {seconds:.2f} seconds, peak rss {rss} MB, '
+                  'peak child process rss {children_rss} MB'.format(
+                      operations=benchmark_result['operations'], operation_name=benchmark_result['operation_name'],
+                      seconds=benchmark_result['seconds'], rss=benchmark_result['peak_rss_bytes'] // 1024 ** 2,
+                      children_rss=benchmark_result['peak_children_rss_bytes'] // 1024 ** 2
+                  ))
+            benchmark_results.append(benchmark_result)
+
+    finally:
+        shutil.rmtree(base_directory, ignore_errors=True)
+
+    return {
+        'commit': get_commit_id(),
+        'time': time.time(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'number_of_papers': number_of_papers,
+        'number_of_files': number_of_files,
+        'seed': seed,
+        'benchmarks': benchmark_results
+    }
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='run benchmarks on a synthetic dblp-like dataset')
+    argument_parser.add_argument('benchmarks', nargs='*',
+                                 help='benchmarks to run, all by default: ' + ', '.join(BENCHMARKS.keys()))
+    argument_parser.add_argument('--papers', type=int, default=DEFAULT_NUMBER_OF_PAPERS)
+    argument_parser.add_argument('--files', type=int, default=DEFAULT_NUMBER_OF_FILES)
+    argument_parser.add_argument('--seed', type=int, default=SyntheticDatasetGenerator.DEFAULT_SEED)
+    argument_parser.add_argument('--output', default=DEFAULT_RESULTS_FILE_PATH)
+    arguments = argument_parser.parse_args()
+    for benchmark_name in arguments.benchmarks:
+        if benchmark_name not in BENCHMARKS:
+            raise Exception('unknown benchmark: {benchmark_name}'.format(benchmark_name=benchmark_name))
+
+    benchmark_report = run_benchmarks(
+        arguments.benchmarks or list(BENCHMARKS.keys()), arguments.papers, arguments.files, arguments.seed
+    )
+    with open(arguments.output, 'wt') as results_file:
+        json.dump(benchmark_report, results_file, indent=2)
+    print('results written to {file_path}'.format(file_path=arguments.output))
@@ -0,0 +1,232 @@
+import os
+import time
+import numpy as np
+from array import array
+from paper_info_manager import PaperInfoManager
+from metrics_registry import get_metrics_registry
+from dataset_parser import \
+    PAPER_ID_FIELD_NAME, AUTHOR_LIST_FIELD_NAME, PAPER_YEAR_FIELD_NAME, REFERENCES_FIELD_NAME, \
+    parse_paper_line, build_failed_line, open_dataset_file
+
+
+class BulkBuilder:
+    """
+    builds paper records from scratch using sequential i/o only, instead of a random read-modify-write
+    of the cited record for every reference.
+    1. dataset files are scanned once- paper ids are interned, publication years are kept in memory, authors
+       are added, and (cited record id, citing year) pairs are sorted in memory-sized runs written to run files
+    2. runs are merged block by block, and pairs are counted per (record, year)
+    3. records are encoded in record id order and appended sequentially to the paper storage files
+    storage must be empty- a bulk build can not continue a stored state, and is not undo logged.
+    """
+
+    RUN_FILE_PATH_FORMAT = r'storage/bulk_run_{run_id}.bin'
+    DEFAULT_MEMORY_BUDGET = 512 * 1024 ** 2
+
+    # citation pair key: cited record id in the high bits, citing year in the low bits, so keys sort by record
+    CITATION_KEY_TYPE = np.dtype('<u8')
+    CITATION_YEAR_BITS = 16
+    CITATION_YEAR_MASK = (1 << CITATION_YEAR_BITS) - 1
+
+    RECORDS_IN_WRITE_BLOCK = 65536
+
+    def __init__(self, author_info_manager, paper_info_manager, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.__author_info_manager = author_info_manager
+        self.__paper_info_manager = paper_info_manager
+        self.__memory_budget = memory_budget
+        self.__publication_years = array('H')
+        self.__run_keys = array('Q')
+        self.__run_file_paths = list()
+
+    def build(self, db_file_info_list):
+        """
+        db_file_info_list items are [file path, first line, start position or None].
+        returns failed lines, and per file its end position as (file path, byte offset, line index, number of lines).
+        """
+        start_time = time.time()
+        failed_lines = list()
+        file_end_positions = list()
+        for db_file_info in db_file_info_list:
+            print('bulk scanning file: {file_info}'.format(file_info=db_file_info))
+            file_failed_lines, file_end_position = self.__scan_dataset_file(db_file_info)
+            failed_lines.append(file_failed_lines)
+            file_end_positions.append(file_end_position)
+        self.__write_run()
+        print('scanned {num_papers} papers into {num_runs} runs in {seconds:.2f} seconds'.format(
+            num_papers=self.__paper_info_manager.get_number_of_records(), num_runs=len(self.__run_file_paths),
+            seconds=time.time() - start_time
+        ))
+
+        # merge runs and write all records
+        start_time = time.time()
+        self.__write_records()
+        for run_file_path in self.__run_file_paths:
+            os.remove(run_file_path)
+        self.__run_file_paths = list()
+        print('wrote paper records in {seconds:.2f} seconds'.format(seconds=time.time() - start_time))
+
+        return failed_lines, file_end_positions
+
+    def __scan_dataset_file(self, dataset_file_info):
+        dataset_file_path, first_line, start_position = dataset_file_info
+        failed_lines = list()
+        number_of_lines = 0
+        run_capacity = self.__memory_budget // BulkBuilder.CITATION_KEY_TYPE.itemsize
+        metrics_registry = get_metrics_registry()
+
+        dataset_file, line_index = open_dataset_file(dataset_file_path, first_line, start_position)
+        with dataset_file:
+            for file_line in dataset_file:
+                try:
+                    paper_attributes = parse_paper_line(file_line, line_index)
+                    if paper_attributes is None:
+                        metrics_registry.increment('skipped_lines')
+                    else:
+                        self.__scan_paper(paper_attributes)
+                        if len(self.__run_keys) >= run_capacity:
+                            self.__write_run()
+
+                except Exception as ex:
+                    failed_lines.append(build_failed_line(dataset_file_path, line_index, file_line, ex))
+
+                line_index += 1
+                number_of_lines += 1
+
+            metrics_registry.increment('lines_parsed', number_of_lines)
+            return failed_lines, (dataset_file_path, dataset_file.tell(), line_index, number_of_lines)
+
+    def __scan_paper(self, paper_attributes):
+        # a year wider than the key's year bits would spill into the cited record id, it is rejected before any key
+        paper_year = int(paper_attributes[PAPER_YEAR_FIELD_NAME])
+        if paper_year > BulkBuilder.CITATION_YEAR_MASK:
+            raise Exception('paper year out of range: {paper_year}'.format(paper_year=paper_year))
+
+        # record ids are allocated in the same order as by the incremental path- paper, then its references
+        paper_record_id = self.__paper_info_manager.allocate_paper_record_id(paper_attributes[PAPER_ID_FIELD_NAME])
+        for referenced_paper_id in paper_attributes[REFERENCES_FIELD_NAME]:
+            referenced_record_id = self.__paper_info_manager.allocate_paper_record_id(referenced_paper_id)
+            self.__run_keys.append((referenced_record_id << BulkBuilder.CITATION_YEAR_BITS) | paper_year)
+
+        # set publication year
+        if paper_record_id >= len(self.__publication_years):
+            self.__publication_years.extend([0] * (paper_record_id + 1 - len(self.__publication_years)))
+        if self.__publication_years[paper_record_id] != 0:
+            print('ERROR: paper {paper_id} already in storage. pub_year={pub_year}'.format(
+                paper_id=paper_attributes[PAPER_ID_FIELD_NAME], pub_year=self.__publication_years[paper_record_id]
+            ))
+        else:
+            self.__publication_years[paper_record_id] = paper_year
+
+        # update all of paper's authors
+        self.__author_info_manager.add_paper_authors(
+            paper_record_id, list(set(paper_attributes[AUTHOR_LIST_FIELD_NAME]))
+        )
+
+    def __write_run(self):
+        # sort current run in place, over the key array's own buffer, and write it as a file of fixed-width keys
+        if len(self.__run_keys) == 0:
+            return
+
+        run_keys = np.frombuffer(self.__run_keys, dtype=BulkBuilder.CITATION_KEY_TYPE)
+        run_keys.sort()
+        run_file_path = BulkBuilder.RUN_FILE_PATH_FORMAT.format(run_id=len(self.__run_file_paths))
+        run_keys.tofile(run_file_path)
+        self.__run_file_paths.append(run_file_path)
+        print('wrote run {file_path}: {num_keys} citations'.format(file_path=run_file_path, num_keys=len(run_keys)))
+        self.__run_keys = array('Q')
+
+    def __merge_runs(self):
+        """
+        k-way merge of the sorted runs, yields (unique keys, counts) in key order.
+        each round takes, from every run's loaded block, all keys up to the smallest last key of a block
+        that has more keys after it- only more copies of that last key can appear later.
+        """
+        runs = [np.memmap(run_file_path, dtype=BulkBuilder.CITATION_KEY_TYPE, mode='r')
+                for run_file_path in self.__run_file_paths]
+        block_size = max(1, self.__memory_budget // (2 * max(1, len(runs)) * BulkBuilder.CITATION_KEY_TYPE.itemsize))
+        blocks = [np.array(run[:block_size]) for run in runs]
+        run_positions = [len(block) for block in blocks]
+
+        while any(len(block) > 0 for block in blocks):
+            # keys up to the threshold are complete
+            unfinished_block_ends = [
+                block[-1] for block, run, run_position in zip(blocks, runs, run_positions) if run_position < len(run)
+            ]
+            threshold = min(unfinished_block_ends) if len(unfinished_block_ends) > 0 else None
+
+            taken_keys = list()
+            for run_index, run in enumerate(runs):
+                block = blocks[run_index]
+                taken_length = len(block) if threshold is None else np.searchsorted(block, threshold, side='right')
+                taken_keys.append(block[:taken_length])
+
+                # refill the block with as many keys as were taken
+                next_position = min(run_positions[run_index] + taken_length, len(run))
+                blocks[run_index] = np.concatenate((block[taken_length:], run[run_positions[run_index]:next_position]))
+                run_positions[run_index] = next_position
+
+            merged_keys = np.concatenate(taken_keys)
+            merged_keys.sort()
+            yield np.unique(merged_keys, return_counts=True)
+
+    def __write_records(self):
+        # write every record in record id order, keys of the last record in a round may continue in the next one
+        number_of_records = self.__paper_info_manager.get_number_of_records()
+        self.__publication_years.extend([0] * (number_of_records - len(self.__publication_years)))
+        publication_years = np.frombuffer(self.__publication_years, dtype=np.uint16)
+
+        next_record_id = 0
+        pending_keys = np.empty(0, dtype=BulkBuilder.CITATION_KEY_TYPE)
+        pending_counts = np.empty(0, dtype=np.int64)
+        for merged_keys, merged_counts in self.__merge_runs():
+            # copies of previous round's last key are added to its count
+            if len(pending_keys) > 0 and merged_keys[0] == pending_keys[-1]:
+                pending_counts[-1] += merged_counts[0]
+                merged_keys = merged_keys[1:]
+                merged_counts = merged_counts[1:]
+
+            pending_keys = np.concatenate((pending_keys, merged_keys))
+            pending_counts = np.concatenate((pending_counts, merged_counts))
+
+            # write records before the last one
+            last_record_id = int(pending_keys[-1] >> BulkBuilder.CITATION_YEAR_BITS)
+            complete_length = np.searchsorted(
+                pending_keys, np.uint64(last_record_id << BulkBuilder.CITATION_YEAR_BITS), side='left'
+            )
+            self.__write_record_range(
+                next_record_id, last_record_id, publication_years,
+                pending_keys[:complete_length], pending_counts[:complete_length]
+            )
+            next_record_id = last_record_id
+            pending_keys = pending_keys[complete_length:]
+            pending_counts = pending_counts[complete_length:]
+
+        self.__write_record_range(next_record_id, number_of_records, publication_years, pending_keys, pending_counts)
+
+    def __write_record_range(self, first_record_id, end_record_id, publication_years, citation_keys, citation_counts):
+        # encode and write records [first_record_id, end_record_id), citation keys are sorted and within the range
+        citation_record_ids = (citation_keys >> BulkBuilder.CITATION_YEAR_BITS).astype(np.int64)
+
+        for block_start in range(first_record_id, end_record_id, BulkBuilder.RECORDS_IN_WRITE_BLOCK):
+            block_end = min(block_start + BulkBuilder.RECORDS_IN_WRITE_BLOCK, end_record_id)
+            key_start, key_end = np.searchsorted(citation_record_ids, [block_start, block_end])
+
+            # citation years of each record are consecutive and in ascending order
+            record_key_ends = (np.searchsorted(
+                citation_record_ids[key_start:key_end], np.arange(block_start, block_end), side='right'
+            )).tolist()
+            block_citation_years = (citation_keys[key_start:key_end] & BulkBuilder.CITATION_YEAR_MASK).tolist()
+            block_citation_counts = citation_counts[key_start:key_end].tolist()
+            block_publication_years = publication_years[block_start:block_end].tolist()
+
+            records_data = list()
+            record_key_start = 0
+            for publication_year, record_key_end in zip(block_publication_years, record_key_ends):
+                records_data.append(PaperInfoManager.encode_citation_history(
+                    publication_year,
+                    block_citation_years[record_key_start:record_key_end],
+                    block_citation_counts[record_key_start:record_key_end]
+                ))
+                record_key_start = record_key_end
+
+            self.__paper_info_manager.write_record_block(block_start, records_data)
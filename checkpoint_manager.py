@@ -0,0 +1,119 @@
+import os
+import json
+import time
+from storage_files import write_file_atomically, commit_temporary_files
+from metrics_registry import get_metrics_registry
+
+
+class CheckpointManager:
+    """
+    takes periodic consistent checkpoints of ingestion state.
+    a checkpoint records, per input file, the byte offset and line index of the next line to process,
+    together with paper and author state written up to that line.
+
+    writing a checkpoint:
+    1. managers write their state next to the stored files (suffixed by the new generation),
+       paper records are written in place under the undo log of the previous generation
+    2. checkpoint file is replaced atomically- this is the commit point
+    3. pending files are renamed over the stored ones and a new undo log is started
+    recovery renames pending files of the last checkpoint that were not renamed yet,
+    and rolls back paper records written after it.
+    between checkpoints, author shards over the memory budget are written ahead as pending files of the next
+    checkpoint- they are committed by it, and ignored by a recovery to the previous one.
+    """
+
+    CHECKPOINT_FILE_PATH = r'storage/checkpoint.json'
+    DEFAULT_CHECKPOINT_INTERVAL = 1000000
+
+    GENERATION_KEY_NAME = 'generation'
+    FILE_POSITIONS_KEY_NAME = 'file_positions'
+    AUTHOR_PENDING_FILES_KEY_NAME = 'author_pending_files'
+    PAPER_PENDING_FILES_KEY_NAME = 'paper_pending_files'
+    LEADERBOARD_PENDING_FILES_KEY_NAME = 'leaderboard_pending_files'
+
+    def __init__(self, author_info_manager, paper_info_manager, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 author_leaderboard=None):
+        self.__author_info_manager = author_info_manager
+        self.__paper_info_manager = paper_info_manager
+        # optional, the leaderboard is stored with the author info it ranks
+        self.__author_leaderboard = author_leaderboard
+        self.__checkpoint_interval = checkpoint_interval
+        self.__generation = 0
+        self.__file_positions = dict()
+        self.__lines_since_checkpoint = 0
+
+    def recover(self):
+        # bring storage to the state of the last checkpoint, must run before managers load their state
+        if not os.path.exists(CheckpointManager.CHECKPOINT_FILE_PATH):
+            print('no checkpoint found')
+            return
+
+        with open(CheckpointManager.CHECKPOINT_FILE_PATH, 'rt') as checkpoint_file:
+            checkpoint = json.loads(checkpoint_file.read())
+
+        self.__generation = checkpoint[CheckpointManager.GENERATION_KEY_NAME]
+        self.__file_positions = checkpoint[CheckpointManager.FILE_POSITIONS_KEY_NAME]
+        print('recovering checkpoint #{generation}'.format(generation=self.__generation))
+
+        # finish renames of the last checkpoint and drop paper writes done after it
+        commit_temporary_files(checkpoint[CheckpointManager.AUTHOR_PENDING_FILES_KEY_NAME], self.__generation)
+        commit_temporary_files(checkpoint[CheckpointManager.PAPER_PENDING_FILES_KEY_NAME], self.__generation)
+        commit_temporary_files(
+            checkpoint.get(CheckpointManager.LEADERBOARD_PENDING_FILES_KEY_NAME, list()), self.__generation
+        )
+        self.__paper_info_manager.rollback_undo_log(self.__generation)
+
+    def start(self):
+        self.__paper_info_manager.start_undo_log(self.__generation)
+
+    def get_file_position(self, file_path):
+        # returns [byte offset, line index] of the next line to process, or None if file was not started
+        return self.__file_positions.get(file_path)
+
+    def on_lines_processed(self, file_path, byte_offset, line_index, number_of_lines=1):
+        self.__file_positions[file_path] = [byte_offset, line_index]
+        self.__lines_since_checkpoint += number_of_lines
+        if self.__lines_since_checkpoint >= self.__checkpoint_interval:
+            self.write_checkpoint()
+        elif self.__author_info_manager.is_over_memory_budget():
+            # loaded authors are released once their shards are written, so the budget is kept between checkpoints
+            # too. modified shards are written ahead as pending files of the next checkpoint, without committing
+            get_metrics_registry().increment('author_shard_spills')
+            get_metrics_registry().log('author_shard_spill', 'author info is over its memory budget after {num_lines} '
+                                       'lines'.format(num_lines=self.__lines_since_checkpoint))
+            self.__author_info_manager.spill_modified_shards(self.__generation + 1)
+
+    def write_checkpoint(self):
+        start_time = time.time()
+        generation = self.__generation + 1
+        print('writing checkpoint #{generation}'.format(generation=generation))
+
+        # 1. write managers state
+        author_pending_files = self.__author_info_manager.prepare_author_info(generation)
+        paper_pending_files = self.__paper_info_manager.prepare_stored_cache(generation)
+        leaderboard_pending_files = list()
+        if self.__author_leaderboard is not None:
+            leaderboard_pending_files = self.__author_leaderboard.prepare_leaderboard(generation)
+
+        # 2. commit point
+        checkpoint = {
+            CheckpointManager.GENERATION_KEY_NAME: generation,
+            CheckpointManager.FILE_POSITIONS_KEY_NAME: self.__file_positions,
+            CheckpointManager.AUTHOR_PENDING_FILES_KEY_NAME: author_pending_files,
+            CheckpointManager.PAPER_PENDING_FILES_KEY_NAME: paper_pending_files,
+            CheckpointManager.LEADERBOARD_PENDING_FILES_KEY_NAME: leaderboard_pending_files
+        }
+        write_file_atomically(CheckpointManager.CHECKPOINT_FILE_PATH, json.dumps(checkpoint).encode())
+        self.__generation = generation
+        self.__lines_since_checkpoint = 0
+
+        # 3. replace stored files and start logging writes of the next checkpoint
+        self.__author_info_manager.commit_author_info(author_pending_files, generation)
+        self.__paper_info_manager.commit_stored_cache(paper_pending_files, generation)
+        if self.__author_leaderboard is not None:
+            self.__author_leaderboard.commit_leaderboard(leaderboard_pending_files, generation)
+        self.__paper_info_manager.start_undo_log(generation)
+
+        get_metrics_registry().add_time('checkpoint', time.time() - start_time)
+        print('checkpoint #{generation} took {seconds:.2f} seconds'
+              .format(generation=generation, seconds=time.time() - start_time))
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import numpy as np
+from array import array
+from h_index_engine import load_author_papers, compute_h_indices, compute_g_indices, compute_i10_indices
+from storage_files import get_temporary_file_path, sync_file, write_file_atomically
+from dataset_parser import is_valid_paper_year
+
+
+class CitationAnalyticsIndex:
+    """
+    frozen per-paper citation history for as-of-year queries.
+    cumulative citation counts are stored sparsely, in csr layout- paper p has the pairs
+    paper_offsets[p]..paper_offsets[p + 1] of (citation year, citations up to the end of that year), years ascending.
+    the index takes space per stored citation year, so an outlier year does not widen it for all papers.
+    together with the author -> papers arrays it answers h-index, g-index and i10-index of any set of authors
+    as of a year, or over a window of years, without reading paper records.
+    all arrays are mmapped, so only the pairs of the queried authors' papers are read.
+    """
+
+    PAPER_OFFSETS_FILE_PATH = r'storage/analytics_paper_offsets.npy'
+    CITATION_YEARS_FILE_PATH = r'storage/analytics_citation_years.npy'
+    CUMULATIVE_CITATIONS_FILE_PATH = r'storage/analytics_cumulative_citations.npy'
+    AUTHOR_OFFSETS_FILE_PATH = r'storage/analytics_author_offsets.npy'
+    AUTHOR_PAPERS_FILE_PATH = r'storage/analytics_author_papers.npy'
+    INFO_FILE_PATH = r'storage/analytics_info.json'
+    FIRST_YEAR_KEY_NAME = 'first_year'
+    NUMBER_OF_YEARS_KEY_NAME = 'number_of_years'
+
+    CITATION_YEARS_TYPE = np.uint16
+    CUMULATIVE_CITATIONS_TYPE = np.uint32
+
+    H_INDEX_KEY_NAME = 'h_index'
+    G_INDEX_KEY_NAME = 'g_index'
+    I10_INDEX_KEY_NAME = 'i10_index'
+
+    def __init__(self):
+        self.__first_year = 0
+        self.__number_of_years = 0
+        self.__paper_offsets = None
+        self.__citation_years = None
+        self.__cumulative_citations = None
+        self.__author_offsets = None
+        self.__author_papers = None
+
+    def build(self, author_info_manager, paper_info_manager):
+        start_time = time.time()
+        print('building citation analytics index..')
+
+        # collect (year, cumulative count) pairs of all papers, ordered by paper and year.
+        # years out of the paper year range (of records converted from legacy storage) can not be stored
+        paper_offsets = array('Q', [0])
+        citation_years = array('H')
+        cumulative_citations = array('I')
+        skipped_years = 0
+        for citation_info in paper_info_manager.iterate_citation_histories():
+            paper_citations = 0
+            for citation_year, citation_count in sorted(
+                    (int(citation_year), citation_count) for citation_year, citation_count in citation_info.items()):
+                if not is_valid_paper_year(citation_year):
+                    skipped_years += 1
+                    continue
+                paper_citations += citation_count
+                citation_years.append(citation_year)
+                cumulative_citations.append(paper_citations)
+            paper_offsets.append(len(citation_years))
+        if skipped_years > 0:
+            print('Warning: skipped {num_years} citation years out of range'.format(num_years=skipped_years))
+
+        citation_years = np.frombuffer(citation_years, dtype=CitationAnalyticsIndex.CITATION_YEARS_TYPE)
+        first_year = int(citation_years.min()) if len(citation_years) > 0 else 0
+        number_of_years = int(citation_years.max()) - first_year + 1 if len(citation_years) > 0 else 1
+
+        # store pairs and author papers
+        author_offsets, author_papers = load_author_papers(author_info_manager)
+        stored_arrays = (
+            (CitationAnalyticsIndex.PAPER_OFFSETS_FILE_PATH, np.frombuffer(paper_offsets, dtype=np.uint64)),
+            (CitationAnalyticsIndex.CITATION_YEARS_FILE_PATH, citation_years),
+            (CitationAnalyticsIndex.CUMULATIVE_CITATIONS_FILE_PATH,
+             np.frombuffer(cumulative_citations, dtype=CitationAnalyticsIndex.CUMULATIVE_CITATIONS_TYPE)),
+            (CitationAnalyticsIndex.AUTHOR_OFFSETS_FILE_PATH, author_offsets),
+            (CitationAnalyticsIndex.AUTHOR_PAPERS_FILE_PATH, author_papers.astype(np.uint32))
+        )
+        for file_path, array_data in stored_arrays:
+            with open(get_temporary_file_path(file_path), 'wb') as array_file:
+                np.save(array_file, array_data)
+                sync_file(array_file)
+
+        # replace stored index, info file is written last
+        for file_path, _ in stored_arrays:
+            os.replace(get_temporary_file_path(file_path), file_path)
+        write_file_atomically(CitationAnalyticsIndex.INFO_FILE_PATH, json.dumps({
+            CitationAnalyticsIndex.FIRST_YEAR_KEY_NAME: first_year,
+            CitationAnalyticsIndex.NUMBER_OF_YEARS_KEY_NAME: number_of_years
+        }).encode())
+
+        print('citation analytics index of {num_papers} papers and {num_pairs} citation years took {seconds:.2f} '
+              'seconds'.format(num_papers=len(paper_offsets) - 1, num_pairs=len(citation_years),
+                      seconds=time.time() - start_time))
+        self.load()
+
+    def load(self):
+        with open(CitationAnalyticsIndex.INFO_FILE_PATH, 'rt') as info_file:
+            index_info = json.loads(info_file.read())
+
+        self.__first_year = index_info[CitationAnalyticsIndex.FIRST_YEAR_KEY_NAME]
+        self.__number_of_years = index_info[CitationAnalyticsIndex.NUMBER_OF_YEARS_KEY_NAME]
+        self.__paper_offsets = np.load(CitationAnalyticsIndex.PAPER_OFFSETS_FILE_PATH, mmap_mode='r')
+        self.__citation_years = np.load(CitationAnalyticsIndex.CITATION_YEARS_FILE_PATH, mmap_mode='r')
+        self.__cumulative_citations = np.load(CitationAnalyticsIndex.CUMULATIVE_CITATIONS_FILE_PATH, mmap_mode='r')
+        self.__author_offsets = np.load(CitationAnalyticsIndex.AUTHOR_OFFSETS_FILE_PATH, mmap_mode='r')
+        self.__author_papers = np.load(CitationAnalyticsIndex.AUTHOR_PAPERS_FILE_PATH, mmap_mode='r')
+
+    def get_year_range(self):
+        return self.__first_year, self.__first_year + self.__number_of_years - 1
+
+    @staticmethod
+    def __gather_segments(offsets, indices):
+        # positions of the items of the given csr segments, and offsets of each segment in the gathered items
+        indices = np.asarray(indices, dtype=np.int64)
+        segment_starts = offsets[indices].astype(np.int64)
+        segment_lengths = offsets[indices + 1].astype(np.int64) - segment_starts
+
+        gathered_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(segment_lengths, out=gathered_offsets[1:])
+        item_positions = np.repeat(segment_starts - gathered_offsets[:-1], segment_lengths) \
+            + np.arange(gathered_offsets[-1], dtype=np.int64)
+        return gathered_offsets, item_positions
+
+    def __read_paper_citations(self, paper_indices):
+        # returns pair offsets of the papers, and the paper, year and cumulative count of each of their pairs
+        pair_offsets, pair_positions = CitationAnalyticsIndex.__gather_segments(self.__paper_offsets, paper_indices)
+        pair_papers = np.repeat(np.arange(len(pair_offsets) - 1, dtype=np.int64), np.diff(pair_offsets))
+        return pair_offsets, pair_papers, \
+            np.asarray(self.__citation_years[pair_positions]), np.asarray(self.__cumulative_citations[pair_positions])
+
+    @staticmethod
+    def __get_cumulative_counts(paper_citations, year):
+        # citations up to the end of year- years of a paper ascend, so its pairs up to year are a prefix
+        pair_offsets, pair_papers, pair_years, pair_citations = paper_citations
+        number_of_papers = len(pair_offsets) - 1
+        prefix_lengths = np.bincount(
+            pair_papers, weights=pair_years <= year, minlength=number_of_papers
+        ).astype(np.int64)
+
+        citation_counts = np.zeros(number_of_papers, dtype=np.int64)
+        has_citations = prefix_lengths > 0
+        citation_counts[has_citations] = \
+            pair_citations[pair_offsets[:-1][has_citations] + prefix_lengths[has_citations] - 1]
+        return citation_counts
+
+    @staticmethod
+    def __get_citation_counts_from_pairs(paper_citations, as_of_year, window_years):
+        get_cumulative_counts = CitationAnalyticsIndex.__get_cumulative_counts
+        citation_counts = get_cumulative_counts(paper_citations, as_of_year)
+        if window_years is not None:
+            citation_counts -= get_cumulative_counts(paper_citations, as_of_year - window_years)
+        return citation_counts
+
+    def get_citation_counts(self, paper_indices, as_of_year, window_years=None):
+        # citations up to the end of as_of_year, or only in the window_years years ending with it
+        return CitationAnalyticsIndex.__get_citation_counts_from_pairs(
+            self.__read_paper_citations(paper_indices), as_of_year, window_years
+        )
+
+    def __get_authors_papers(self, author_indices):
+        # slice author papers arrays to the given authors, papers are returned as positions in a unique papers array
+        author_offsets, pair_positions = \
+            CitationAnalyticsIndex.__gather_segments(self.__author_offsets, author_indices)
+
+        # each paper is read once, even if several of the authors share it
+        unique_papers, paper_positions = np.unique(self.__author_papers[pair_positions], return_inverse=True)
+        return author_offsets, unique_papers, paper_positions
+
+    @staticmethod
+    def __compute_metrics(citation_counts, author_offsets, paper_positions):
+        return {
+            metric_name: compute_metric(citation_counts, author_offsets, paper_positions)
+            for metric_name, compute_metric in (
+                (CitationAnalyticsIndex.H_INDEX_KEY_NAME, compute_h_indices),
+                (CitationAnalyticsIndex.G_INDEX_KEY_NAME, compute_g_indices),
+                (CitationAnalyticsIndex.I10_INDEX_KEY_NAME, compute_i10_indices)
+            )
+        }
+
+    def calculate_author_metrics(self, author_indices, as_of_year, window_years=None):
+        # returns {metric name: array of the authors' values}
+        author_offsets, unique_papers, paper_positions = self.__get_authors_papers(author_indices)
+        citation_counts = self.get_citation_counts(unique_papers, as_of_year, window_years)
+        return CitationAnalyticsIndex.__compute_metrics(citation_counts, author_offsets, paper_positions)
+
+    def calculate_career_trajectories(self, author_indices, first_year, last_year, window_years=None):
+        # returns {metric name: (authors x years) array}, pairs of the authors' papers are read once for all years
+        author_offsets, unique_papers, paper_positions = self.__get_authors_papers(author_indices)
+        paper_citations = self.__read_paper_citations(unique_papers)
+
+        yearly_metrics = [
+            CitationAnalyticsIndex.__compute_metrics(
+                CitationAnalyticsIndex.__get_citation_counts_from_pairs(paper_citations, year, window_years),
+                author_offsets, paper_positions
+            )
+            for year in range(first_year, last_year + 1)
+        ]
+        return {
+            metric_name: np.stack([metrics[metric_name] for metrics in yearly_metrics], axis=1)
+            for metric_name in (CitationAnalyticsIndex.H_INDEX_KEY_NAME,
+                                CitationAnalyticsIndex.G_INDEX_KEY_NAME,
+                                CitationAnalyticsIndex.I10_INDEX_KEY_NAME)
+        }
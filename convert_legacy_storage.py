@@ -0,0 +1,160 @@
+import os
+import re
+import json
+from paper_info_manager import PaperInfoManager
+from author_info_manager import AuthorInfoManager
+from paper_storage_file import PaperStorageFile
+from id_index import IdIndex
+
+
+# converts a storage directory written by the original json based managers: paper records, the paper name mapping
+# and authors.json. run it from the directory that holds 'storage', like main.
+LEGACY_STORAGE_FILE_PATH_PATTERN = r'^papers_(\d+)\.json$'
+LEGACY_STORAGE_DIRECTORY = r'storage'
+LEGACY_MAPPING_FILE_PATH = r'storage/papers_name_mapping.json'
+LEGACY_AUTHOR_STORAGE_FILE_PATH = r'storage/authors.json'
+LEGACY_AUTHOR_PAPERS_KEY_NAME = 'papers'
+LEGACY_RECORD_ID_SEPARATOR = '_'
+LEGACY_MAX_PAPERS_IN_STORAGE_FILE = 250000
+LEGACY_RECORD_FIELD_SEPARATOR = '#'
+LEGACY_RECORD_STRUCTURE_YEAR_LENGTH = 4
+LEGACY_RECORD_STRUCTURE_COUNTER_LENGTH = 4
+LEGACY_RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS = 60
+LEGACY_RECORD_LENGTH = \
+    LEGACY_RECORD_STRUCTURE_YEAR_LENGTH \
+    + 1 \
+    + LEGACY_RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS \
+    * (LEGACY_RECORD_STRUCTURE_YEAR_LENGTH + LEGACY_RECORD_STRUCTURE_COUNTER_LENGTH) \
+    + 1
+
+
+def legacy_record_data_to_paper_record(record_data):
+    paper_record = dict()
+    current_index = 0
+
+    # parse publication year info
+    paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] = \
+        int(record_data[current_index:(current_index + LEGACY_RECORD_STRUCTURE_YEAR_LENGTH)])
+    if paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] == 0:
+        paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] = None
+    current_index += LEGACY_RECORD_STRUCTURE_YEAR_LENGTH + 1
+
+    # parse citation info
+    paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME] = dict()
+    for citation_year_index in range(LEGACY_RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS):
+        if record_data[current_index] == LEGACY_RECORD_FIELD_SEPARATOR:
+            break
+
+        citation_year = record_data[current_index:current_index + LEGACY_RECORD_STRUCTURE_YEAR_LENGTH]
+        current_index += LEGACY_RECORD_STRUCTURE_YEAR_LENGTH
+        citation_count = \
+            int(
+                record_data[current_index:current_index + LEGACY_RECORD_STRUCTURE_COUNTER_LENGTH]
+                .replace(LEGACY_RECORD_FIELD_SEPARATOR, '')
+            )
+        current_index += LEGACY_RECORD_STRUCTURE_COUNTER_LENGTH
+
+        paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME][citation_year] = citation_count
+
+    return paper_record
+
+
+def convert_legacy_storage_file(legacy_file_path, storage_file_path):
+    print('converting {legacy_path} -> {new_path}'.format(legacy_path=legacy_file_path, new_path=storage_file_path))
+
+    # convert records one by one, legacy files hold records back to back without separators
+    records_data = list()
+    with open(legacy_file_path, 'rt') as legacy_file:
+        while True:
+            record_data = legacy_file.read(LEGACY_RECORD_LENGTH)
+            if len(record_data) < LEGACY_RECORD_LENGTH:
+                break
+
+            paper_record = legacy_record_data_to_paper_record(record_data)
+            records_data.append(PaperInfoManager.encode_record(paper_record))
+
+    # records are appended in record order
+    if os.path.exists(storage_file_path):
+        os.remove(storage_file_path)
+    storage_file = PaperStorageFile(storage_file_path, PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE)
+    storage_file.append_records(0, records_data)
+    storage_file.flush()
+    storage_file.close()
+    converted_records = len(records_data)
+
+    print('converted {num_records} records'.format(num_records=converted_records))
+    return converted_records
+
+
+def legacy_record_id_to_paper_record_id(legacy_record_id):
+    # legacy record ids are '{storage file index}_{zero padded record index}'
+    storage_file_index, record_index = legacy_record_id.split(LEGACY_RECORD_ID_SEPARATOR)
+    return int(storage_file_index) * LEGACY_MAX_PAPERS_IN_STORAGE_FILE + int(record_index)
+
+
+def convert_legacy_name_mapping(legacy_mapping_file_path, mapping_file_path):
+    print('converting {legacy_path} -> {new_path}'.format(legacy_path=legacy_mapping_file_path,
+                                                          new_path=mapping_file_path))
+    with open(legacy_mapping_file_path, 'rt') as legacy_mapping_file:
+        legacy_mapping = json.loads(legacy_mapping_file.read())
+
+    # legacy record ids were allocated one after the other, so they are the dense ids of the id index
+    paper_record_ids = sorted(
+        (legacy_record_id_to_paper_record_id(legacy_record_id), paper_id)
+        for paper_id, legacy_record_id in legacy_mapping.items()
+    )
+    paper_index = IdIndex()
+    for paper_record_id, paper_id in paper_record_ids:
+        if paper_index.add(paper_id) != paper_record_id:
+            raise Exception('legacy name mapping is not dense: paper {paper_id} has record id {record_id}'
+                            .format(paper_id=paper_id, record_id=paper_record_id))
+    paper_index.write(mapping_file_path)
+
+    print('converted {num_papers} paper ids'.format(num_papers=len(paper_record_ids)))
+    return len(paper_record_ids)
+
+
+def convert_legacy_author_storage(legacy_author_file_path):
+    print('converting {legacy_path} -> author shards'.format(legacy_path=legacy_author_file_path))
+    with open(legacy_author_file_path, 'rt') as legacy_author_file:
+        legacy_authors = json.loads(legacy_author_file.read())
+
+    # authors are added paper by paper, which rebuilds their co-authors too
+    paper_authors = dict()
+    for author_id, legacy_author in legacy_authors.items():
+        for legacy_record_id in legacy_author[LEGACY_AUTHOR_PAPERS_KEY_NAME]:
+            paper_record_id = legacy_record_id_to_paper_record_id(legacy_record_id)
+            paper_authors.setdefault(paper_record_id, list()).append(author_id)
+
+    author_info_manager = AuthorInfoManager()
+    for paper_record_id in sorted(paper_authors.keys()):
+        author_info_manager.add_paper_authors(paper_record_id, paper_authors[paper_record_id])
+    author_info_manager.store_author_info()
+
+    print('converted {num_authors} authors'.format(num_authors=len(legacy_authors)))
+    return len(legacy_authors)
+
+
+def convert_legacy_storage():
+    # storage file index and record index must map to the same record id in both formats
+    if PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE != LEGACY_MAX_PAPERS_IN_STORAGE_FILE:
+        raise Exception('legacy storage files hold {legacy_size} papers, current files hold {size}'.format(
+            legacy_size=LEGACY_MAX_PAPERS_IN_STORAGE_FILE, size=PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE))
+
+    for file_name in sorted(os.listdir(LEGACY_STORAGE_DIRECTORY)):
+        file_name_match = re.match(LEGACY_STORAGE_FILE_PATH_PATTERN, file_name)
+        if file_name_match is None:
+            continue
+
+        convert_legacy_storage_file(
+            os.path.join(LEGACY_STORAGE_DIRECTORY, file_name),
+            PaperInfoManager.STORAGE_FILE_PATH_FORMAT.format(file_id=int(file_name_match.group(1)))
+        )
+
+    convert_legacy_name_mapping(LEGACY_MAPPING_FILE_PATH, PaperInfoManager.MAPPING_FILE_PATH)
+    if os.path.exists(LEGACY_AUTHOR_STORAGE_FILE_PATH):
+        convert_legacy_author_storage(LEGACY_AUTHOR_STORAGE_FILE_PATH)
+
+
+if __name__ == '__main__':
+    convert_legacy_storage()
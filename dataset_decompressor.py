@@ -0,0 +1,186 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import time
+import queue
+import threading
+from metrics_registry import get_metrics_registry
+
+# zstandard is optional, it is needed only for .zst dataset files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP_FILE_EXTENSION = '.gz'
+BZIP2_FILE_EXTENSION = '.bz2'
+XZ_FILE_EXTENSION = '.xz'
+ZSTANDARD_FILE_EXTENSION = '.zst'
+COMPRESSED_FILE_EXTENSIONS = frozenset([
+    GZIP_FILE_EXTENSION, BZIP2_FILE_EXTENSION, XZ_FILE_EXTENSION, ZSTANDARD_FILE_EXTENSION
+])
+
+
+class DecompressedStream(io.RawIOBase):
+    """
+    raw stream of the decompressed data of a compressed dataset file.
+    a decompression thread reads ahead into a bounded block queue- zlib, bz2, lzma and zstandard release the gil
+    while decompressing, so decompression overlaps with parsing of earlier blocks.
+    positions are offsets in the decompressed data, as saved by checkpoints. seeking is forward only,
+    it decompresses and skips data up to the position.
+    progress is reported as compressed bytes read out of the compressed file size.
+    """
+
+    BLOCK_SIZE = 1024 ** 2
+    QUEUE_SIZE = 16
+    QUEUE_WAIT_SECONDS = 0.1
+    SKIP_BUFFER_SIZE = 1024 ** 2
+
+    def __init__(self, file_path):
+        super().__init__()
+        self.__file_path = file_path
+        self.__compressed_file = open(file_path, 'rb')
+        self.__compressed_size = os.fstat(self.__compressed_file.fileno()).st_size
+        try:
+            self.__decompressed_file = DecompressedStream.__open_decompressed_file(file_path, self.__compressed_file)
+        except Exception:
+            self.__compressed_file.close()
+            raise
+
+        self.__metrics = get_metrics_registry()
+        self.__position = 0
+        self.__compressed_position = 0
+        self.__block = memoryview(b'')
+        self.__block_position = 0
+        self.__is_finished = False
+
+        # queue holds (decompressed block, compressed position after it), an empty block at the end
+        self.__block_queue = queue.Queue(maxsize=DecompressedStream.QUEUE_SIZE)
+        self.__stop_event = threading.Event()
+        self.__decompress_thread = threading.Thread(target=self.__decompress, daemon=True)
+        self.__decompress_thread.start()
+
+    @staticmethod
+    def __open_decompressed_file(file_path, compressed_file):
+        file_extension = os.path.splitext(file_path)[1].lower()
+        if file_extension == GZIP_FILE_EXTENSION:
+            return gzip.GzipFile(fileobj=compressed_file, mode='rb')
+        if file_extension == BZIP2_FILE_EXTENSION:
+            return bz2.BZ2File(compressed_file, 'rb')
+        if file_extension == XZ_FILE_EXTENSION:
+            return lzma.LZMAFile(compressed_file, 'rb')
+        if file_extension == ZSTANDARD_FILE_EXTENSION:
+            if zstandard is None:
+                raise Exception('zstandard is required to read dataset file: {file_path}'.format(file_path=file_path))
+            return zstandard.ZstdDecompressor().stream_reader(compressed_file)
+        raise Exception('unknown compressed dataset file type: {file_path}'.format(file_path=file_path))
+
+    def __put_block(self, block_info):
+        # returns False if the stream was closed while waiting for room in the queue
+        while not self.__stop_event.is_set():
+            try:
+                self.__block_queue.put(block_info, timeout=DecompressedStream.QUEUE_WAIT_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __decompress(self):
+        # decompression thread- errors are passed to the reader in place of a block
+        try:
+            while True:
+                start_time = time.perf_counter()
+                decompressed_block = self.__decompressed_file.read(DecompressedStream.BLOCK_SIZE)
+                self.__metrics.add_time('decompress', time.perf_counter() - start_time)
+                if not self.__put_block((decompressed_block, self.__compressed_file.tell())) or \
+                        len(decompressed_block) == 0:
+                    return
+        except Exception as ex:
+            print('ERROR: failed to decompress dataset file: {file_path}'.format(file_path=self.__file_path))
+            self.__put_block((ex, None))
+
+    def __report_progress(self, compressed_position):
+        self.__metrics.increment('compressed_bytes_read', compressed_position - self.__compressed_position)
+        self.__compressed_position = compressed_position
+        self.__metrics.log(
+            'decompress_progress',
+            'read {read_size} of {file_size} compressed bytes ({percent:.1f}%), {position} bytes decompressed: '
+            '{file_path}'.format(
+                read_size=compressed_position, file_size=self.__compressed_size,
+                percent=100.0 * compressed_position / max(1, self.__compressed_size), position=self.__position,
+                file_path=self.__file_path
+            )
+        )
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        # copy from the current block, the next block is taken from the queue once it is used up
+        if self.__block_position == len(self.__block):
+            if self.__is_finished:
+                return 0
+            decompressed_block, compressed_position = self.__block_queue.get()
+            if isinstance(decompressed_block, Exception):
+                self.__is_finished = True
+                raise decompressed_block
+            self.__block = memoryview(decompressed_block)
+            self.__block_position = 0
+            self.__report_progress(compressed_position)
+            if len(decompressed_block) == 0:
+                self.__is_finished = True
+                return 0
+
+        read_size = min(len(buffer), len(self.__block) - self.__block_position)
+        buffer[:read_size] = self.__block[self.__block_position:self.__block_position + read_size]
+        self.__block_position += read_size
+        self.__position += read_size
+        return read_size
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence != io.SEEK_SET:
+            raise Exception('decompressed stream can only seek from its start or current position')
+        if offset < self.__position:
+            raise Exception('decompressed stream can not seek backwards: {file_path} position={position} '
+                            'offset={offset}'.format(file_path=self.__file_path, position=self.__position,
+                                                     offset=offset))
+
+        skip_buffer = bytearray(min(DecompressedStream.SKIP_BUFFER_SIZE, offset - self.__position))
+        while self.__position < offset:
+            if self.readinto(memoryview(skip_buffer)[:offset - self.__position]) == 0:
+                break
+        return self.__position
+
+    def get_compressed_progress(self):
+        # (compressed bytes read, compressed file size)
+        return self.__compressed_position, self.__compressed_size
+
+    def close(self):
+        # stop the decompression thread before its files are closed
+        if self.closed:
+            return
+        self.__stop_event.set()
+        self.__decompress_thread.join()
+        self.__decompressed_file.close()
+        self.__compressed_file.close()
+        super().close()
+
+
+def is_compressed_dataset_file(dataset_file_path):
+    return os.path.splitext(dataset_file_path)[1].lower() in COMPRESSED_FILE_EXTENSIONS
+
+
+def open_compressed_dataset_file(dataset_file_path):
+    # buffered reader over the decompressed stream, it reads lines and chunks like a plain binary file
+    return io.BufferedReader(DecompressedStream(dataset_file_path), buffer_size=DecompressedStream.BLOCK_SIZE)
@@ -0,0 +1,244 @@
+import os
+import time
+from dataset_decompressor import is_compressed_dataset_file, open_compressed_dataset_file
+from metrics_registry import get_metrics_registry
+
+# orjson is optional, it decodes a dataset line several times faster than the standard json module
+try:
+    from orjson import loads as load_json
+except ImportError:
+    from json import loads as load_json
+
+
+PAPER_ID_FIELD_NAME = 'id'
+AUTHOR_LIST_FIELD_NAME = 'authors'
+PAPER_YEAR_FIELD_NAME = 'year'
+REFERENCES_FIELD_NAME = 'references'
+REQUIRED_FIELDS = [
+    PAPER_ID_FIELD_NAME,
+    AUTHOR_LIST_FIELD_NAME,
+    PAPER_YEAR_FIELD_NAME
+]
+REQUIRED_FIELDS_SET = frozenset(REQUIRED_FIELDS)
+
+# keys of aggregated dataset file info, built by worker processes
+FILE_PATH_KEY_NAME = 'file_path'
+PAPER_ORDER_KEY_NAME = 'paper_order'
+ADDED_PAPERS_KEY_NAME = 'added_papers'
+CITATIONS_KEY_NAME = 'citations'
+PAPER_AUTHORS_KEY_NAME = 'paper_authors'
+FAILED_LINES_KEY_NAME = 'failed_lines'
+END_POSITION_KEY_NAME = 'end_position'
+NUMBER_OF_LINES_KEY_NAME = 'number_of_lines'
+LINE_SEPARATOR = b'\n'
+
+# years are kept in 16-bit arrays (bulk build, leaderboard, analytics index) and in the low 16 bits of bulk
+# build citation keys- a paper with a year out of range is skipped by every ingestion mode
+MIN_PAPER_YEAR = 1
+MAX_PAPER_YEAR = 9999
+
+
+def is_valid_paper_year(paper_year):
+    # years are stored as positive varints, and used as citation years of the paper's references
+    if isinstance(paper_year, str):
+        return paper_year.isdigit() and MIN_PAPER_YEAR <= int(paper_year) <= MAX_PAPER_YEAR
+    return isinstance(paper_year, int) and not isinstance(paper_year, bool) and \
+        MIN_PAPER_YEAR <= paper_year <= MAX_PAPER_YEAR
+
+
+def is_id_list(field_value):
+    return isinstance(field_value, list) and all(isinstance(item_id, str) for item_id in field_value)
+
+
+def parse_paper_line(file_line, line_index):
+    """
+    returns the used fields of the paper, or None if the paper is skipped. a line that is not json raises.
+    warnings are logged at most once per log interval, and without the line- a noisy dump does not flood stdout.
+    """
+    paper_attributes = load_json(file_line)
+
+    # validate required fields exists
+    if not REQUIRED_FIELDS_SET.issubset(paper_attributes.keys()):
+        get_metrics_registry().log('missing_paper_information', 'Warning: missing paper information. '
+                                   'line#{line_index} missing fields={field_names}'
+                                   .format(line_index=line_index,
+                                           field_names=sorted(REQUIRED_FIELDS_SET - set(paper_attributes.keys()))))
+        return None
+
+    # a year that is not an integer can not be stored, the paper is skipped like one with missing fields
+    if not is_valid_paper_year(paper_attributes[PAPER_YEAR_FIELD_NAME]):
+        get_metrics_registry().log('invalid_paper_year', 'Warning: invalid paper year. '
+                                   'line#{line_index} year={paper_year}'
+                                   .format(line_index=line_index, paper_year=paper_attributes[PAPER_YEAR_FIELD_NAME]))
+        return None
+
+    # a field of the wrong type would fail the whole batch it is applied in, so the line fails here instead
+    paper_id = paper_attributes[PAPER_ID_FIELD_NAME]
+    author_list = paper_attributes[AUTHOR_LIST_FIELD_NAME]
+    references = paper_attributes.get(REFERENCES_FIELD_NAME, list())
+    if not isinstance(paper_id, str) or not is_id_list(author_list) or not is_id_list(references):
+        raise Exception('invalid paper fields, id must be a string, authors and references lists of strings. '
+                        'line#{line_index}'.format(line_index=line_index))
+
+    # keep only the fields used by the managers, title, abstract etc. are dropped
+    return {
+        PAPER_ID_FIELD_NAME: paper_id,
+        AUTHOR_LIST_FIELD_NAME: author_list,
+        PAPER_YEAR_FIELD_NAME: paper_attributes[PAPER_YEAR_FIELD_NAME],
+        REFERENCES_FIELD_NAME: references
+    }
+
+
+def open_dataset_file(dataset_file_path, first_line, start_position):
+    """
+    open dataset file in binary mode, so byte offsets of lines can be taken with tell(), and position it.
+    start_position is [byte offset, line index] saved by a checkpoint- the file is seeked directly to it.
+    otherwise the first first_line lines are skipped. returns the file and the index of its next line.
+    compressed files (.gz, .bz2, .xz, .zst) are decompressed while read, and their offsets are decompressed offsets.
+    """
+    if is_compressed_dataset_file(dataset_file_path):
+        dataset_file = open_compressed_dataset_file(dataset_file_path)
+    else:
+        dataset_file = open(dataset_file_path, 'rb')
+    if start_position is not None:
+        dataset_file.seek(start_position[0])
+        return dataset_file, start_position[1]
+
+    line_index = 0
+    while line_index < first_line and dataset_file.readline():
+        line_index += 1
+    return dataset_file, line_index
+
+
+def split_dataset_file(dataset_file_path, start_byte_offset, number_of_ranges):
+    """
+    split a plain dataset file, from start_byte_offset to its end, to up to number_of_ranges byte ranges of whole
+    lines, so its lines can be aggregated by several workers. returns [(start byte offset, end byte offset)].
+    """
+    file_size = os.path.getsize(dataset_file_path)
+    range_boundaries = [start_byte_offset]
+    with open(dataset_file_path, 'rb') as dataset_file:
+        for range_index in range(1, number_of_ranges):
+            range_boundary = start_byte_offset + (file_size - start_byte_offset) * range_index // number_of_ranges
+            if range_boundary <= range_boundaries[-1]:
+                continue
+
+            # move the boundary to the start of the next line
+            dataset_file.seek(range_boundary - 1)
+            dataset_file.readline()
+            range_boundary = dataset_file.tell()
+            if range_boundaries[-1] < range_boundary < file_size:
+                range_boundaries.append(range_boundary)
+
+    range_boundaries.append(max(file_size, start_byte_offset))
+    return list(zip(range_boundaries[:-1], range_boundaries[1:]))
+
+
+def build_failed_line(dataset_file_path, line_index, file_line, ex):
+    # the failed line is logged at most once per log interval, its text is kept only in the returned info.
+    # lines failed in a worker process are counted by the applier, since the worker's counters are not reported
+    metrics_registry = get_metrics_registry()
+    metrics_registry.increment('failed_lines')
+    metrics_registry.log('failed_line', 'failed line#{line_index} file={file_path}: {ex}'
+                       .format(line_index=line_index, file_path=dataset_file_path, ex=ex))
+    return {
+        'file_path': dataset_file_path,
+        'line_index': line_index,
+        'line_text': file_line,
+        'exception': ex
+    }
+
+
+def aggregate_dataset_file(dataset_file_info):
+    """
+    parse a dataset file and pre-aggregate it, so it can be merged into the managers with few calls.
+    runs in a worker process- it does not touch any manager state.
+    dataset_file_info is [file path, first line, start position or None], optionally followed by the byte offset
+    to stop at- lines are then aggregated up to it, as split by split_dataset_file.
+    """
+    dataset_file_path, first_line, start_position = dataset_file_info[:3]
+    end_byte_offset = dataset_file_info[3] if len(dataset_file_info) > 3 else None
+
+    # paper ids in the order the sequential path would allocate their records
+    paper_order = list()
+    seen_papers = set()
+    added_papers = list()
+    citations = dict()
+    paper_authors = list()
+    failed_lines = list()
+    number_of_lines = 0
+
+    dataset_file, line_index = open_dataset_file(dataset_file_path, first_line, start_position)
+    byte_offset = dataset_file.tell()
+    with dataset_file:
+        for file_line in dataset_file:
+            try:
+                paper_attributes = parse_paper_line(file_line, line_index)
+                if paper_attributes is not None:
+                    paper_id = paper_attributes[PAPER_ID_FIELD_NAME]
+                    paper_year = str(paper_attributes[PAPER_YEAR_FIELD_NAME])
+                    references = paper_attributes[REFERENCES_FIELD_NAME]
+
+                    # paper is allocated first, then each of its references
+                    for referenced_paper_id in [paper_id] + references:
+                        if referenced_paper_id not in seen_papers:
+                            seen_papers.add(referenced_paper_id)
+                            paper_order.append(referenced_paper_id)
+
+                    added_papers.append((paper_id, paper_year))
+                    for referenced_paper_id in references:
+                        citation_key = (referenced_paper_id, paper_year)
+                        citations[citation_key] = citations.get(citation_key, 0) + 1
+                    paper_authors.append((paper_id, paper_attributes[AUTHOR_LIST_FIELD_NAME], line_index))
+
+            except Exception as ex:
+                failed_lines.append(build_failed_line(dataset_file_path, line_index, file_line, ex))
+
+            # skipped and failed lines are counted too, so line indices match the file
+            line_index += 1
+            number_of_lines += 1
+            byte_offset += len(file_line)
+            if end_byte_offset is not None and byte_offset >= end_byte_offset:
+                break
+
+        end_position = [byte_offset, line_index]
+
+    return {
+        FILE_PATH_KEY_NAME: dataset_file_path,
+        PAPER_ORDER_KEY_NAME: paper_order,
+        ADDED_PAPERS_KEY_NAME: added_papers,
+        CITATIONS_KEY_NAME: citations,
+        PAPER_AUTHORS_KEY_NAME: paper_authors,
+        FAILED_LINES_KEY_NAME: failed_lines,
+        END_POSITION_KEY_NAME: end_position,
+        NUMBER_OF_LINES_KEY_NAME: number_of_lines
+    }
+
+
+def parse_dataset_chunk(dataset_chunk_info):
+    """
+    parse a chunk of whole dataset file lines, runs in a parser worker of the ingestion pipeline.
+    dataset_chunk_info is [file path, chunk bytes, index of chunk's first line].
+    returns (parsed papers as [(line index, paper attributes)], failed lines, number of lines, parse seconds).
+    """
+    start_time = time.time()
+    dataset_file_path, chunk_data, line_index = dataset_chunk_info
+    parsed_papers = list()
+    failed_lines = list()
+
+    file_lines = chunk_data.split(LINE_SEPARATOR)
+    if file_lines[-1] == b'':
+        file_lines.pop()
+
+    for file_line in file_lines:
+        try:
+            paper_attributes = parse_paper_line(file_line, line_index)
+            if paper_attributes is not None:
+                parsed_papers.append((line_index, paper_attributes))
+
+        except Exception as ex:
+            failed_lines.append(build_failed_line(dataset_file_path, line_index, file_line, ex))
+
+        line_index += 1
+
+    return parsed_papers, failed_lines, len(file_lines), time.time() - start_time
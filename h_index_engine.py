@@ -0,0 +1,131 @@
+import json
+import time
+import numpy as np
+
+
+def sort_author_citations(citation_counts, author_offsets, author_paper_indices):
+    """
+    sort citation counts of each author's papers in descending order.
+    author i owns the papers author_paper_indices[author_offsets[i]:author_offsets[i + 1]],
+    and each paper index points into citation_counts.
+    returns per (author, paper) pair, ordered by author: author index, citation count, rank starting from 1.
+    """
+    number_of_authors = len(author_offsets) - 1
+
+    # collect citation count of each (author, paper) pair
+    paper_citations = citation_counts[author_paper_indices].astype(np.int64)
+    papers_per_author = np.diff(author_offsets)
+    pair_author_index = np.repeat(np.arange(number_of_authors, dtype=np.int64), papers_per_author)
+
+    # sort pairs by author, then by descending citation count, using a single composite key
+    max_citations = int(paper_citations.max())
+    sort_keys = pair_author_index * (max_citations + 1) + (max_citations - paper_citations)
+    sort_keys.sort()
+    sorted_citations = max_citations - (sort_keys % (max_citations + 1))
+
+    # rank of each paper inside its author's list, starting from 1
+    paper_ranks = np.arange(len(sort_keys), dtype=np.int64) - author_offsets[pair_author_index] + 1
+
+    return pair_author_index, sorted_citations, paper_ranks
+
+
+def compute_h_indices(citation_counts, author_offsets, author_paper_indices):
+    """
+    calculate h-index of many authors at once, arguments are as in sort_author_citations.
+    """
+    number_of_authors = len(author_offsets) - 1
+    if len(author_paper_indices) == 0:
+        return np.zeros(number_of_authors, dtype=np.int64)
+
+    pair_author_index, sorted_citations, paper_ranks = \
+        sort_author_citations(citation_counts, author_offsets, author_paper_indices)
+
+    # citations are descending per author, so the qualified papers form a prefix- count them
+    qualified_papers = sorted_citations >= paper_ranks
+    return np.bincount(pair_author_index, weights=qualified_papers, minlength=number_of_authors).astype(np.int64)
+
+
+def compute_g_indices(citation_counts, author_offsets, author_paper_indices):
+    """
+    calculate g-index of many authors at once- the largest g such that the top g papers have at least g^2
+    citations together, bounded by the number of papers. arguments are as in sort_author_citations.
+    """
+    number_of_authors = len(author_offsets) - 1
+    if len(author_paper_indices) == 0:
+        return np.zeros(number_of_authors, dtype=np.int64)
+
+    pair_author_index, sorted_citations, paper_ranks = \
+        sort_author_citations(citation_counts, author_offsets, author_paper_indices)
+
+    # citations of each author's top papers, the difference from rank^2 only decreases, so qualified form a prefix
+    citation_prefix_sums = np.concatenate(([0], np.cumsum(sorted_citations)))
+    top_paper_citations = \
+        citation_prefix_sums[1:] - citation_prefix_sums[np.asarray(author_offsets)[pair_author_index]]
+    qualified_papers = top_paper_citations >= paper_ranks * paper_ranks
+    return np.bincount(pair_author_index, weights=qualified_papers, minlength=number_of_authors).astype(np.int64)
+
+
+def compute_i10_indices(citation_counts, author_offsets, author_paper_indices, min_citations=10):
+    """
+    count papers with at least min_citations citations of many authors at once,
+    arguments are as in sort_author_citations.
+    """
+    number_of_authors = len(author_offsets) - 1
+    papers_per_author = np.diff(author_offsets)
+    pair_author_index = np.repeat(np.arange(number_of_authors, dtype=np.int64), papers_per_author)
+    qualified_papers = citation_counts[author_paper_indices] >= min_citations
+    return np.bincount(pair_author_index, weights=qualified_papers, minlength=number_of_authors).astype(np.int64)
+
+
+def load_author_papers(author_info_manager):
+    # build flat paper index array of all authors and per-author offsets into it
+    author_offsets = np.zeros(author_info_manager.get_number_of_authors() + 1, dtype=np.int64)
+    paper_indices = list()
+    for author_index, paper_record_ids in author_info_manager.iterate_author_papers():
+        author_offsets[author_index + 1] = author_offsets[author_index] + len(paper_record_ids)
+        paper_indices.extend(paper_record_ids)
+
+    return author_offsets, np.array(paper_indices, dtype=np.int64)
+
+
+class HIndexEngine:
+
+    H_INDEX_STORAGE_FILE_PATH = r'storage/h_index.json'
+
+    def __init__(self, author_info_manager, paper_info_manager):
+        self.__author_info_manager = author_info_manager
+        self.__paper_info_manager = paper_info_manager
+
+    def __load_citation_counts(self):
+        number_of_records = self.__paper_info_manager.get_number_of_records()
+        return np.fromiter(
+            self.__paper_info_manager.iterate_total_citation_counts(),
+            dtype=np.int64,
+            count=number_of_records
+        )
+
+    def calculate_h_indices(self):
+        start_time = time.time()
+
+        print('loading citation counts..')
+        citation_counts = self.__load_citation_counts()
+
+        print('loading author papers..')
+        author_offsets, paper_indices = load_author_papers(self.__author_info_manager)
+
+        print('calculating h-index of {num_authors} authors..'.format(num_authors=len(author_offsets) - 1))
+        h_indices = compute_h_indices(citation_counts, author_offsets, paper_indices)
+
+        print('h-index calculation took {seconds:.2f} seconds'.format(seconds=time.time() - start_time))
+        return h_indices
+
+    def get_h_indices_by_author_id(self, h_indices):
+        # map h-index array, indexed by author index, to the authors' DBLP ids
+        return {
+            self.__author_info_manager.get_author_id(author_index): h_index
+            for author_index, h_index in enumerate(h_indices.tolist())
+        }
+
+    def store_h_indices(self, h_indices):
+        with open(HIndexEngine.H_INDEX_STORAGE_FILE_PATH, 'wt') as storage_file:
+            storage_file.write(json.dumps(self.get_h_indices_by_author_id(h_indices)))
@@ -0,0 +1,112 @@
+class HIndexTracker:
+    """
+    keeps every author's h-index up to date while citations are added.
+    per author it holds the current h-index, the number of papers with more than h citations,
+    and a histogram of citation counts above h. one citation changes the h-index by at most one,
+    so each update costs amortized O(1) per author of the cited paper.
+    """
+
+    H_INDEX_POSITION = 0
+    ABOVE_COUNT_POSITION = 1
+    HISTOGRAM_POSITION = 2
+
+    def __init__(self):
+        self.__paper_authors = dict()
+        self.__author_states = dict()
+        self.__author_paper_listeners = list()
+
+    def __get_author_state(self, author_index):
+        if author_index not in self.__author_states:
+            self.__author_states[author_index] = [0, 0, dict()]
+        return self.__author_states[author_index]
+
+    @staticmethod
+    def __raise_h_index(author_state):
+        # each step drops the papers having exactly the new h-index from the 'above' count
+        while author_state[HIndexTracker.ABOVE_COUNT_POSITION] >= author_state[HIndexTracker.H_INDEX_POSITION] + 1:
+            author_state[HIndexTracker.H_INDEX_POSITION] += 1
+            author_state[HIndexTracker.ABOVE_COUNT_POSITION] -= \
+                author_state[HIndexTracker.HISTOGRAM_POSITION].pop(author_state[HIndexTracker.H_INDEX_POSITION], 0)
+
+    @staticmethod
+    def __add_paper_to_state(author_state, citation_count):
+        if citation_count > author_state[HIndexTracker.H_INDEX_POSITION]:
+            histogram = author_state[HIndexTracker.HISTOGRAM_POSITION]
+            histogram[citation_count] = histogram.get(citation_count, 0) + 1
+            author_state[HIndexTracker.ABOVE_COUNT_POSITION] += 1
+            HIndexTracker.__raise_h_index(author_state)
+
+    @staticmethod
+    def __add_citation_to_state(author_state, citation_count):
+        previous_count = citation_count - 1
+        h_index = author_state[HIndexTracker.H_INDEX_POSITION]
+
+        # papers at or below the h-index threshold are not tracked
+        if previous_count < h_index:
+            return
+
+        histogram = author_state[HIndexTracker.HISTOGRAM_POSITION]
+        if previous_count == h_index:
+            # paper crossed the threshold
+            author_state[HIndexTracker.ABOVE_COUNT_POSITION] += 1
+        else:
+            # paper was already above the threshold, only move it in the histogram
+            histogram[previous_count] -= 1
+            if histogram[previous_count] == 0:
+                del histogram[previous_count]
+        histogram[citation_count] = histogram.get(citation_count, 0) + 1
+
+        HIndexTracker.__raise_h_index(author_state)
+
+    def add_author_paper_listener(self, listener):
+        # listener is called as listener(author_index, citation_count, paper_year) for every added author paper
+        self.__author_paper_listeners.append(listener)
+
+    def add_author_paper(self, author_index, paper_record_id, citation_count, paper_year=None):
+        self.__add_author_paper(author_index, paper_record_id, citation_count)
+        for listener in self.__author_paper_listeners:
+            listener(author_index, citation_count, paper_year)
+
+    def __add_author_paper(self, author_index, paper_record_id, citation_count):
+        # update paper -> authors reverse index
+        if paper_record_id not in self.__paper_authors:
+            self.__paper_authors[paper_record_id] = [author_index]
+        else:
+            self.__paper_authors[paper_record_id].append(author_index)
+
+        # update author state with paper's current citation count
+        self.__add_paper_to_state(self.__get_author_state(author_index), citation_count)
+
+    def on_citation_added(self, paper_record_id, citation_count, added_citations_count=1):
+        # citation_count is the paper's total citation count after the new citations
+        for author_index in self.__paper_authors.get(paper_record_id, ()):
+            author_state = self.__author_states[author_index]
+            for intermediate_count in range(citation_count - added_citations_count + 1, citation_count + 1):
+                self.__add_citation_to_state(author_state, intermediate_count)
+
+    def get_paper_authors(self, paper_record_id):
+        return self.__paper_authors.get(paper_record_id, ())
+
+    def get_h_index(self, author_index):
+        if author_index not in self.__author_states:
+            return None
+        return self.__author_states[author_index][HIndexTracker.H_INDEX_POSITION]
+
+    def get_h_indices(self):
+        return {
+            author_index: author_state[HIndexTracker.H_INDEX_POSITION]
+            for author_index, author_state in self.__author_states.items()
+        }
+
+    def rebuild(self, author_info_manager, paper_info_manager):
+        print('rebuilding h-index tracker state..')
+        self.__paper_authors = dict()
+        self.__author_states = dict()
+
+        # load total citation counts, ordered by record id
+        citation_counts = list(paper_info_manager.iterate_total_citation_counts())
+
+        # add all publications, listeners are not notified- they rebuild from the managers themselves
+        for author_index, paper_record_ids in author_info_manager.iterate_author_papers():
+            for paper_record_id in paper_record_ids:
+                self.__add_author_paper(author_index, paper_record_id, citation_counts[paper_record_id])
@@ -0,0 +1,150 @@
+import os
+import mmap
+import zlib
+import struct
+from array import array
+from storage_files import get_temporary_file_path, sync_file, sync_directory
+
+
+class IdIndex:
+    """
+    interns string ids (DBLP paper and author ids) to dense integers 0, 1, 2, ...
+    the stored index is an open-addressing hash table that is mmapped on load, so restoring a large
+    mapping does not parse anything. ids added after the load live in an in-memory overlay
+    until the next store.
+
+    file layout: header, table of (key crc32, id + 1) uint32 slots, key offsets uint64 per id + 1, key bytes.
+    """
+
+    FILE_FORMAT_MAGIC = b'HIID'
+    FILE_FORMAT_VERSION = 1
+    FILE_HEADER_STRUCT = struct.Struct('<4sHHQQ')
+    SLOT_STRUCT = struct.Struct('<II')
+    OFFSET_STRUCT = struct.Struct('<Q')
+    KEY_ENCODING = 'utf-8'
+    MAX_TABLE_LOAD_FACTOR = 0.5
+
+    def __init__(self):
+        self.__stored_map = None
+        self.__stored_count = 0
+        self.__table_mask = 0
+        self.__table_offset = 0
+        self.__key_offsets_offset = 0
+        self.__keys_offset = 0
+        self.__added_ids = dict()
+        self.__added_keys = list()
+
+    def __len__(self):
+        return self.__stored_count + len(self.__added_keys)
+
+    def __get_stored_key_data(self, key_id):
+        key_offsets_position = self.__key_offsets_offset + key_id * IdIndex.OFFSET_STRUCT.size
+        key_start, key_end = struct.unpack_from('<QQ', self.__stored_map, key_offsets_position)
+        return self.__stored_map[self.__keys_offset + key_start:self.__keys_offset + key_end]
+
+    def __find_stored_id(self, key):
+        key_data = key.encode(IdIndex.KEY_ENCODING)
+        key_hash = zlib.crc32(key_data)
+
+        # linear probing from the key's home slot until an empty slot is found
+        slot_index = key_hash & self.__table_mask
+        while True:
+            slot_hash, slot_value = IdIndex.SLOT_STRUCT.unpack_from(
+                self.__stored_map, self.__table_offset + slot_index * IdIndex.SLOT_STRUCT.size
+            )
+            if slot_value == 0:
+                return None
+            if slot_hash == key_hash and self.__get_stored_key_data(slot_value - 1) == key_data:
+                return slot_value - 1
+            slot_index = (slot_index + 1) & self.__table_mask
+
+    def get_id(self, key):
+        # return interned id of key, or None if key was never added
+        key_id = self.__added_ids.get(key)
+        if key_id is None and self.__stored_count > 0:
+            key_id = self.__find_stored_id(key)
+        return key_id
+
+    def add(self, key):
+        # intern a new key, the caller is responsible for checking it is not present
+        key_id = len(self)
+        self.__added_ids[key] = key_id
+        self.__added_keys.append(key)
+        return key_id
+
+    def get_or_add(self, key):
+        key_id = self.get_id(key)
+        if key_id is None:
+            key_id = self.add(key)
+        return key_id
+
+    def get_key(self, key_id):
+        if key_id >= self.__stored_count:
+            return self.__added_keys[key_id - self.__stored_count]
+        return self.__get_stored_key_data(key_id).decode(IdIndex.KEY_ENCODING)
+
+    def iterate_keys(self):
+        for key_id in range(self.__stored_count):
+            yield self.__get_stored_key_data(key_id).decode(IdIndex.KEY_ENCODING)
+        for key in self.__added_keys:
+            yield key
+
+    def store(self, file_path):
+        # write to a temporary file, replace atomically and continue from the stored file
+        temporary_file_path = get_temporary_file_path(file_path)
+        self.write(temporary_file_path)
+        os.replace(temporary_file_path, file_path)
+        sync_directory(os.path.dirname(file_path))
+        self.load(file_path)
+
+    def write(self, file_path):
+        number_of_keys = len(self)
+        table_size = 1
+        while table_size * IdIndex.MAX_TABLE_LOAD_FACTOR < max(number_of_keys, 1):
+            table_size *= 2
+        table_mask = table_size - 1
+
+        # collect key bytes in id order and fill hash table slots
+        table = array('I', bytes(table_size * IdIndex.SLOT_STRUCT.size))
+        key_offsets = array('Q', [0])
+        key_blocks = list()
+        for key_id, key in enumerate(self.iterate_keys()):
+            key_data = key.encode(IdIndex.KEY_ENCODING)
+            key_blocks.append(key_data)
+            key_offsets.append(key_offsets[-1] + len(key_data))
+
+            key_hash = zlib.crc32(key_data)
+            slot_index = key_hash & table_mask
+            while table[2 * slot_index + 1] != 0:
+                slot_index = (slot_index + 1) & table_mask
+            table[2 * slot_index] = key_hash
+            table[2 * slot_index + 1] = key_id + 1
+
+        with open(file_path, 'wb') as index_file:
+            index_file.write(IdIndex.FILE_HEADER_STRUCT.pack(
+                IdIndex.FILE_FORMAT_MAGIC, IdIndex.FILE_FORMAT_VERSION, 0, number_of_keys, table_size
+            ))
+            index_file.write(table.tobytes())
+            index_file.write(key_offsets.tobytes())
+            index_file.write(b''.join(key_blocks))
+            sync_file(index_file)
+
+    def load(self, file_path):
+        with open(file_path, 'rb') as index_file:
+            stored_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, number_of_keys, table_size = IdIndex.FILE_HEADER_STRUCT.unpack_from(stored_map, 0)
+        if magic != IdIndex.FILE_FORMAT_MAGIC or version != IdIndex.FILE_FORMAT_VERSION:
+            raise Exception('unsupported id index file: {file_path} magic={magic} version={version}'
+                            .format(file_path=file_path, magic=magic, version=version))
+
+        if self.__stored_map is not None:
+            self.__stored_map.close()
+        self.__stored_map = stored_map
+        self.__stored_count = number_of_keys
+        self.__table_mask = table_size - 1
+        self.__table_offset = IdIndex.FILE_HEADER_STRUCT.size
+        self.__key_offsets_offset = self.__table_offset + table_size * IdIndex.SLOT_STRUCT.size
+        self.__keys_offset = self.__key_offsets_offset + (number_of_keys + 1) * IdIndex.OFFSET_STRUCT.size
+        self.__added_ids = dict()
+        self.__added_keys = list()
@@ -0,0 +1,183 @@
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from dataset_parser import LINE_SEPARATOR, open_dataset_file, parse_dataset_chunk
+from metrics_registry import get_metrics_registry
+
+
+class PipelineStageStatistics:
+    """
+    amount of work done by a pipeline stage and the time it was busy doing it.
+    """
+
+    def __init__(self, stage_name, unit_name):
+        self.__stage_name = stage_name
+        self.__unit_name = unit_name
+        self.__units = 0
+        self.__busy_seconds = 0.0
+
+    def add(self, units, busy_seconds):
+        self.__units += units
+        self.__busy_seconds += busy_seconds
+
+    def get_throughput(self):
+        if self.__busy_seconds == 0:
+            return 0.0
+        return self.__units / self.__busy_seconds
+
+    def __str__(self):
+        return '{stage_name}: {units} {unit_name} in {seconds:.2f} busy seconds ({throughput:.1f} {unit_name}/s)'\
+            .format(stage_name=self.__stage_name, units=self.__units, unit_name=self.__unit_name,
+                    seconds=self.__busy_seconds, throughput=self.get_throughput())
+
+
+class IngestionPipeline:
+    """
+    ingests a dataset file in three overlapping stages:
+    1. reader thread- reads large chunks of whole lines
+    2. parser worker processes- decode and validate the lines of a chunk
+    3. applier (calling thread)- applies parsed papers, in file order, to the managers
+    bounded queues between the stages provide backpressure, so memory use does not depend on file size.
+    each stage reports its busy time, the stage with the lowest throughput is the bottleneck.
+    """
+
+    DEFAULT_CHUNK_SIZE = 4 * 1024 ** 2
+    DEFAULT_QUEUE_SIZE = 8
+    STATISTICS_REPORT_INTERVAL_SECONDS = 30
+
+    def __init__(self, number_of_parser_workers, chunk_size=DEFAULT_CHUNK_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+        self.__number_of_parser_workers = number_of_parser_workers
+        self.__chunk_size = chunk_size
+        self.__queue_size = queue_size
+        self.__parser_pool = multiprocessing.Pool(processes=number_of_parser_workers)
+
+    def close(self):
+        self.__parser_pool.close()
+        self.__parser_pool.join()
+
+    def __read_chunks(self, dataset_file_info, chunk_queue, reader_statistics):
+        # reader stage- queue chunks as (data, first line index, byte offset after chunk), None at the end
+        dataset_file_path, first_line, start_position = dataset_file_info
+        try:
+            dataset_file, line_index = open_dataset_file(dataset_file_path, first_line, start_position)
+            with dataset_file:
+                byte_offset = dataset_file.tell()
+                remaining_data = b''
+                while True:
+                    start_time = time.time()
+                    read_data = dataset_file.read(self.__chunk_size)
+                    chunk_data = remaining_data + read_data
+
+                    # cut chunk after its last whole line, the rest opens the next chunk
+                    if len(read_data) > 0:
+                        chunk_end = chunk_data.rfind(LINE_SEPARATOR) + 1
+                        remaining_data = chunk_data[chunk_end:]
+                        chunk_data = chunk_data[:chunk_end]
+                    reader_statistics.add(len(read_data), time.time() - start_time)
+
+                    if len(chunk_data) > 0:
+                        byte_offset += len(chunk_data)
+                        chunk_queue.put((chunk_data, line_index, byte_offset))
+                        line_index += chunk_data.count(LINE_SEPARATOR)
+                        if not chunk_data.endswith(LINE_SEPARATOR):
+                            line_index += 1
+
+                    if len(read_data) == 0:
+                        break
+
+            chunk_queue.put(None)
+
+        except Exception as ex:
+            print('ERROR: failed to read dataset file: {file_path}'.format(file_path=dataset_file_path))
+            chunk_queue.put(ex)
+
+    def process_dataset_file(self, dataset_file_info, apply_papers, on_lines_processed):
+        """
+        dataset_file_info is [file path, first line, start position or None].
+        apply_papers(file path, [(line index, paper attributes)]) updates the managers and returns failed lines,
+        on_lines_processed(file path, byte offset, line index, number of lines) is called after each chunk.
+        returns failed lines.
+        """
+        dataset_file_path = dataset_file_info[0]
+        failed_lines = list()
+        reader_statistics = PipelineStageStatistics('reader', 'bytes')
+        parser_statistics = PipelineStageStatistics('parsers', 'lines')
+        applier_statistics = PipelineStageStatistics('applier', 'lines')
+        applier_wait_seconds = 0.0
+        metrics_registry = get_metrics_registry()
+
+        # start reader stage
+        chunk_queue = queue.Queue(maxsize=self.__queue_size)
+        reader_thread = threading.Thread(
+            target=self.__read_chunks, args=(dataset_file_info, chunk_queue, reader_statistics), daemon=True
+        )
+        reader_thread.start()
+
+        # chunks sent to parsers, in file order
+        pending_chunks = deque()
+        is_reader_done = False
+        last_report_time = time.time()
+        while True:
+            # feed parsers up to the queue size, wait for the reader only if there is nothing else to do
+            while not is_reader_done and len(pending_chunks) < self.__queue_size:
+                try:
+                    read_chunk = chunk_queue.get(block=len(pending_chunks) == 0)
+                except queue.Empty:
+                    break
+
+                if read_chunk is None:
+                    is_reader_done = True
+                elif isinstance(read_chunk, Exception):
+                    raise read_chunk
+                else:
+                    chunk_data, first_line_index, end_byte_offset = read_chunk
+                    parse_result = self.__parser_pool.apply_async(
+                        parse_dataset_chunk, ([dataset_file_path, chunk_data, first_line_index],)
+                    )
+                    pending_chunks.append((first_line_index, end_byte_offset, parse_result))
+
+            if len(pending_chunks) == 0:
+                break
+
+            # wait for the oldest chunk, so papers are applied in file order
+            first_line_index, end_byte_offset, parse_result = pending_chunks.popleft()
+            start_time = time.time()
+            parsed_papers, chunk_failed_lines, number_of_lines, parse_seconds = parse_result.get()
+            applier_wait_seconds += time.time() - start_time
+            parser_statistics.add(number_of_lines, parse_seconds)
+            failed_lines += chunk_failed_lines
+            metrics_registry.increment('lines_parsed', number_of_lines)
+
+            # lines were parsed in a worker process, so they are counted here
+            metrics_registry.increment('failed_lines', len(chunk_failed_lines))
+            metrics_registry.increment('skipped_lines', number_of_lines - len(parsed_papers) - len(chunk_failed_lines))
+            metrics_registry.add_time('parse', parse_seconds)
+
+            # applier stage
+            with metrics_registry.time_stage('apply'):
+                start_time = time.time()
+                failed_lines += apply_papers(dataset_file_path, parsed_papers)
+                applier_statistics.add(number_of_lines, time.time() - start_time)
+
+            # chunk is fully applied, file position can be checkpointed
+            on_lines_processed(dataset_file_path, end_byte_offset, first_line_index + number_of_lines, number_of_lines)
+            metrics_registry.report_progress()
+
+            if time.time() - last_report_time > IngestionPipeline.STATISTICS_REPORT_INTERVAL_SECONDS:
+                self.__print_statistics(reader_statistics, parser_statistics, applier_statistics, applier_wait_seconds)
+                last_report_time = time.time()
+
+        reader_thread.join()
+        self.__print_statistics(reader_statistics, parser_statistics, applier_statistics, applier_wait_seconds)
+        return failed_lines
+
+    def __print_statistics(self, reader_statistics, parser_statistics, applier_statistics, applier_wait_seconds):
+        # parser busy time is summed over workers, their combined throughput is workers times higher
+        print('pipeline stage throughput:')
+        print('  {statistics}'.format(statistics=reader_statistics))
+        print('  {statistics}, {workers} workers'
+              .format(statistics=parser_statistics, workers=self.__number_of_parser_workers))
+        print('  {statistics}, waited {seconds:.2f} seconds for parsers'
+              .format(statistics=applier_statistics, seconds=applier_wait_seconds))
@@ -1,179 +1,421 @@
 
-import json
+import os
+import argparse
+import multiprocessing
+from itertools import islice
 from author_info_manager import AuthorInfoManager
 from paper_info_manager import PaperInfoManager
+from h_index_engine import HIndexEngine
+from h_index_tracker import HIndexTracker
+from author_leaderboard import AuthorLeaderboard
+import dataset_parser
+from dataset_parser import \
+    PAPER_ID_FIELD_NAME, AUTHOR_LIST_FIELD_NAME, PAPER_YEAR_FIELD_NAME, REFERENCES_FIELD_NAME, \
+    parse_paper_line, build_failed_line, open_dataset_file, split_dataset_file
+from dataset_decompressor import is_compressed_dataset_file
+from checkpoint_manager import CheckpointManager
+from ingestion_pipeline import IngestionPipeline
+from bulk_builder import BulkBuilder
+from citation_analytics import CitationAnalyticsIndex
+from partitioned_ingestion import run_partitioned
+from metrics_registry import MetricsRegistry, get_metrics_registry, set_metrics_registry
+
+
+# number of dataset lines whose papers are added to paper records in one call
+DEFAULT_PAPER_BATCH_SIZE = 1000
+# memory budget of cached paper records and loaded authors, split between the two managers
+DEFAULT_MEMORY_BUDGET = 3 * 1024 ** 3
+AUTHOR_MEMORY_BUDGET_SHARE = 1 / 3
+# dataset files are split to byte ranges of at least this size for parallel ingestion
+MIN_DATASET_RANGE_SIZE = 16 * 1024 ** 2
+
+
+def update_author_records(paper_record, author_info_manager, paper_info_manager, h_index_tracker):
+    # extract required fields
+    paper_id = paper_record[PAPER_ID_FIELD_NAME]
+    author_list = list(set(paper_record[AUTHOR_LIST_FIELD_NAME]))
+    citation_count = paper_info_manager.get_total_citation_count(paper_id)
 
+    # update all of paper's authors, each one gets the others as co-authors
+    author_indices = author_info_manager.add_paper_authors(paper_id, author_list)
 
-PAPER_ID_FIELD_NAME = 'id'
-AUTHOR_LIST_FIELD_NAME = 'authors'
-PAPER_YEAR_FIELD_NAME = 'year'
-REFERENCES_FIELD_NAME = 'references'
+    for author_index in author_indices:
+        h_index_tracker.add_author_paper(
+            author_index, paper_id, citation_count, paper_record.get(PAPER_YEAR_FIELD_NAME)
+        )
 
 
-def update_paper_records(paper_record, paper_info_manager):
-    # extract required fields
-    paper_id = paper_record[PAPER_ID_FIELD_NAME]
-    paper_year = str(paper_record[PAPER_YEAR_FIELD_NAME])
-    references = paper_record[REFERENCES_FIELD_NAME] if REFERENCES_FIELD_NAME in paper_record.keys() else list()
-
-    # add new paper record
-    try:
-        paper_info_manager.add_paper(paper_id, paper_year)
-    except Exception as ex:
-        print('Error: failed to add paper')
-        raise ex
+def update_records(dataset_file_path, parsed_papers, author_info_manager, paper_info_manager, h_index_tracker):
+    """
+    parsed_papers is a list of (line index, paper attributes).
+    papers and their citations are added to paper records in one batch, then authors are updated paper by paper.
+    a paper that fails in either step is a failed line, it does not fail the batch.
+    returns failed lines.
+    """
+    failed_lines = list()
 
-    # update citation info
-    added_references = list()
-    for referenced_paper_id in references:
+    # update papers
+    paper_record_ids, failed_papers = paper_info_manager.add_papers([
+        (
+            paper_attributes[PAPER_ID_FIELD_NAME],
+            str(paper_attributes[PAPER_YEAR_FIELD_NAME]),
+            paper_attributes[REFERENCES_FIELD_NAME]
+        )
+        for line_index, paper_attributes in parsed_papers
+    ])
+    for paper_index, ex in failed_papers:
+        failed_lines.append(build_failed_line(dataset_file_path, parsed_papers[paper_index][0], None, ex))
+
+    # update authors
+    for (line_index, paper_attributes), paper_record_id in zip(parsed_papers, paper_record_ids):
+        if paper_record_id is None:
+            continue
+        paper_attributes[PAPER_ID_FIELD_NAME] = paper_record_id
         try:
-            paper_info_manager.add_citation(referenced_paper_id, paper_year)
+            update_author_records(paper_attributes, author_info_manager, paper_info_manager, h_index_tracker)
         except Exception as ex:
-            print('Error: failed to add paper citation. referenced paper id={ref_id} added={added} all={all_refs}'
-                  .format(ref_id=referenced_paper_id, added=added_references, all_refs=references))
-            raise ex
-        added_references.append(referenced_paper_id)
+            failed_lines.append(build_failed_line(dataset_file_path, line_index, None, ex))
 
+    return failed_lines
 
-def update_author_records(paper_record, author_info_manager):
-    # extract required fields
-    paper_id = paper_record[PAPER_ID_FIELD_NAME]
-    author_list = list(set(paper_record[AUTHOR_LIST_FIELD_NAME]))
 
-    # iterate paper's authors and update each one
-    added_authors = list()
-    for author_id in author_list:
-        # make author list without current author
-        co_authors = list(author_list)
-        co_authors.remove(author_id)
+def process_dataset_file(dataset_file_info, author_info_manager, paper_info_manager, h_index_tracker,
+                         checkpoint_manager, paper_batch_size=DEFAULT_PAPER_BATCH_SIZE):
+    # read file, from the checkpointed position if there is one
+    dataset_file_path = dataset_file_info[0]
+    first_line = dataset_file_info[1]
+    start_position = dataset_file_info[2]
+    failed_lines = list()
+    metrics_registry = get_metrics_registry()
+
+    dataset_file, line_index = open_dataset_file(dataset_file_path, first_line, start_position)
+    with dataset_file:
+        while True:
+            file_lines = list(islice(dataset_file, paper_batch_size))
+            if len(file_lines) == 0:
+                break
+
+            # parse lines and validate required fields exists
+            parsed_papers = list()
+            with metrics_registry.time_stage('parse'):
+                for file_line in file_lines:
+                    try:
+                        paper_attributes = parse_paper_line(file_line, line_index)
+                        if paper_attributes is None:
+                            metrics_registry.increment('skipped_lines')
+                        else:
+                            parsed_papers.append((line_index, paper_attributes))
+
+                    except Exception as ex:
+                        failed_lines.append(build_failed_line(dataset_file_path, line_index, file_line, ex))
+
+                    # increase line index, skipped and failed lines included
+                    line_index += 1
+            metrics_registry.increment('lines_parsed', len(file_lines))
+
+            # apply batch, then its lines can be checkpointed
+            with metrics_registry.time_stage('apply'):
+                failed_lines += update_records(
+                    dataset_file_path, parsed_papers, author_info_manager, paper_info_manager, h_index_tracker
+                )
+            checkpoint_manager.on_lines_processed(dataset_file_path, dataset_file.tell(), line_index, len(file_lines))
+            metrics_registry.report_progress()
+
+    return failed_lines
+
 
-        # update author information
+def merge_aggregated_dataset_file(
+        aggregated_file_info, author_info_manager, paper_info_manager, h_index_tracker, checkpoint_manager,
+        line_index_offset=0):
+    """
+    merge is done in the same order as the sequential path, so record and author ids are identical.
+    line indices of a file range are counted from the start of the range, line_index_offset is the index
+    of its first line in the file.
+    """
+    dataset_file_path = aggregated_file_info[dataset_parser.FILE_PATH_KEY_NAME]
+    failed_lines = aggregated_file_info[dataset_parser.FAILED_LINES_KEY_NAME]
+    for failed_line in failed_lines:
+        failed_line['line_index'] += line_index_offset
+    print('merging file: {file_path}'.format(file_path=dataset_file_path))
+
+    # lines were parsed in a worker process, so they are counted here
+    metrics_registry = get_metrics_registry()
+    metrics_registry.increment('failed_lines', len(failed_lines))
+    metrics_registry.increment('skipped_lines', aggregated_file_info[dataset_parser.NUMBER_OF_LINES_KEY_NAME] - len(
+        aggregated_file_info[dataset_parser.ADDED_PAPERS_KEY_NAME]) - len(failed_lines))
+
+    # allocate paper records in first-seen order
+    for paper_id in aggregated_file_info[dataset_parser.PAPER_ORDER_KEY_NAME]:
+        paper_info_manager.reserve_paper(paper_id)
+
+    # set publication years
+    for paper_id, paper_year in aggregated_file_info[dataset_parser.ADDED_PAPERS_KEY_NAME]:
+        paper_info_manager.add_paper(paper_id, paper_year)
+
+    # add citation counts, once per (paper, citation year)
+    for (referenced_paper_id, citation_year), citations_count in \
+            aggregated_file_info[dataset_parser.CITATIONS_KEY_NAME].items():
+        paper_info_manager.add_citation(referenced_paper_id, citation_year, citations_count)
+
+    # update authors
+    # papers and their authors were aggregated together, in line order
+    for (paper_id, author_list, line_index), (_, paper_year) in zip(
+            aggregated_file_info[dataset_parser.PAPER_AUTHORS_KEY_NAME],
+            aggregated_file_info[dataset_parser.ADDED_PAPERS_KEY_NAME]):
+        paper_record = {
+            PAPER_ID_FIELD_NAME: paper_info_manager.get_paper_record_id(paper_id),
+            AUTHOR_LIST_FIELD_NAME: author_list,
+            PAPER_YEAR_FIELD_NAME: paper_year
+        }
         try:
-            author_info_manager.add_author_publication(author_id, paper_id, co_authors)
+            update_author_records(paper_record, author_info_manager, paper_info_manager, h_index_tracker)
         except Exception as ex:
-            print('ERROR: failed to add author publication. author={author_id} paper={paper_id} added={added} all={all_authors}'
-                  .format(author_id=author_id, paper_id=paper_id, added=added_authors, all_authors=author_list))
-            raise ex
-        added_authors.append(author_id)
+            failed_lines.append(build_failed_line(dataset_file_path, line_index + line_index_offset, None, ex))
 
+    # file range is checkpointed only as a whole, since its aggregated info is merged at once
+    end_byte_offset, end_line_index = aggregated_file_info[dataset_parser.END_POSITION_KEY_NAME]
+    checkpoint_manager.on_lines_processed(
+        dataset_file_path, end_byte_offset, end_line_index + line_index_offset,
+        aggregated_file_info[dataset_parser.NUMBER_OF_LINES_KEY_NAME]
+    )
 
-def process_dataset_file(dataset_file_info, author_info_manager, paper_info_manager):
-    # read file
-    line_index = 0
-    dataset_file_path = dataset_file_info[0]
-    first_line = dataset_file_info[1]
+    return failed_lines
+
+
+def split_dataset_files(db_file_info_list, number_of_workers):
+    """
+    split dataset files to byte ranges of whole lines, about number_of_workers ranges in total and in proportion
+    to file sizes, so all workers are used even with fewer files than workers.
+    compressed files, and files whose first lines are skipped by count rather than from a checkpoint, are not split.
+    returns aggregation infos in file order, each as [file path, first line, start position, end byte offset].
+    """
+    splittable_files = [
+        db_file_info for db_file_info in db_file_info_list
+        if not is_compressed_dataset_file(db_file_info[0]) and (db_file_info[2] is not None or db_file_info[1] == 0)
+    ]
+    total_size = sum(os.path.getsize(db_file_info[0]) for db_file_info in splittable_files)
+
+    dataset_ranges = list()
+    for db_file_info in db_file_info_list:
+        if db_file_info not in splittable_files:
+            dataset_ranges.append(db_file_info)
+            continue
+
+        dataset_file_path, first_line, start_position = db_file_info
+        file_size = os.path.getsize(dataset_file_path)
+        number_of_ranges = max(1, min(
+            -(-number_of_workers * file_size // max(1, total_size)), file_size // MIN_DATASET_RANGE_SIZE
+        ))
+        start_byte_offset = 0 if start_position is None else start_position[0]
+        for range_start, range_end in split_dataset_file(dataset_file_path, start_byte_offset, number_of_ranges):
+            dataset_ranges.append([dataset_file_path, first_line, [range_start, 0], range_end])
+
+    return dataset_ranges
+
+
+def process_dataset_files_in_parallel(db_file_info_list, author_info_manager, paper_info_manager,
+                                      h_index_tracker, checkpoint_manager, number_of_workers):
+    # parse file ranges in worker processes, merge each one in file order as soon as it is ready
     failed_lines = list()
+    dataset_ranges = split_dataset_files(db_file_info_list, number_of_workers)
+
+    # line indices of split ranges are counted from the range start, they are offset by the lines merged before
+    first_line_indices = {
+        db_file_info[0]: 0 if db_file_info[2] is None else db_file_info[2][1] for db_file_info in db_file_info_list
+    }
+    with multiprocessing.Pool(processes=max(1, min(number_of_workers, len(dataset_ranges)))) as worker_pool:
+        for dataset_range, aggregated_file_info in zip(
+                dataset_ranges, worker_pool.imap(dataset_parser.aggregate_dataset_file, dataset_ranges)):
+            line_index_offset = 0
+            if len(dataset_range) > 3:
+                line_index_offset = first_line_indices[dataset_range[0]]
+                first_line_indices[dataset_range[0]] += \
+                    aggregated_file_info[dataset_parser.NUMBER_OF_LINES_KEY_NAME]
+            with get_metrics_registry().time_stage('merge'):
+                failed_lines.append(merge_aggregated_dataset_file(
+                    aggregated_file_info, author_info_manager, paper_info_manager, h_index_tracker, checkpoint_manager,
+                    line_index_offset
+                ))
+            get_metrics_registry().increment(
+                'lines_parsed', aggregated_file_info[dataset_parser.NUMBER_OF_LINES_KEY_NAME]
+            )
+            get_metrics_registry().report_progress()
+
+    return failed_lines
+
+
+def process_dataset_files_in_pipeline(db_file_info_list, author_info_manager, paper_info_manager,
+                                      h_index_tracker, checkpoint_manager, number_of_parser_workers):
+    # overlap reading, parsing and applying of each file, files are processed one after the other
+    def apply_papers(dataset_file_path, parsed_papers):
+        return update_records(
+            dataset_file_path, parsed_papers, author_info_manager, paper_info_manager, h_index_tracker
+        )
 
-    with open(dataset_file_path, 'rt') as dataset_file:
-        for file_line in dataset_file:
-            if line_index < first_line:
-                line_index += 1
-                continue
-
-            try:
-                # parse line as json
-                try:
-                    paper_attributes = json.loads(file_line)
-                except Exception as ex:
-                    print('ERROR: failed to load line as json')
-                    raise ex
-
-                # validate required fields exists
-                record_ok = True
-                required_fields = [
-                    PAPER_ID_FIELD_NAME,
-                    AUTHOR_LIST_FIELD_NAME,
-                    PAPER_YEAR_FIELD_NAME
-                ]
-                for field_name in required_fields:
-                    if field_name not in paper_attributes.keys():
-                        print('Warning: missing paper information. '
-                              'line#{line_index} line={line} paper record={paper_info}'
-                              .format(line_index=line_index, line=file_line, paper_info=paper_attributes))
-                        record_ok = False
-                        break
-                if not record_ok:
-                    print('skipping paper')
-                    continue
-
-                # update papers
-                try:
-                    update_paper_records(paper_attributes, paper_info_manager)
-                except Exception as ex:
-                    print('ERROR: failed to update papers')
-                    raise ex
-
-                # update authors
-                paper_attributes[PAPER_ID_FIELD_NAME] = \
-                    paper_info_manager.get_paper_record_id(paper_attributes[PAPER_ID_FIELD_NAME])
-                try:
-                    update_author_records(paper_attributes, author_info_manager)
-                except Exception as ex:
-                    print('ERROR: failed to update authors. paper record id={record_id}'
-                          .format(record_id=paper_attributes[PAPER_ID_FIELD_NAME]))
-                    raise ex
-
-                # increase line index
-                line_index += 1
-
-            except Exception as ex:
-                print('line#{line_index} file={file_path} line="{line_text}"'
-                      .format(line_index=line_index, file_path=dataset_file_info, line_text=file_line))
-                print('exception: {ex}'.format(ex=ex))
-                failed_lines.append({
-                    'file_path': dataset_file_path,
-                    'line_index': line_index,
-                    'line_text': file_line,
-                    'exception': ex
-                })
-                print('failed lines in current file: {num_lines}'.format(num_lines=len(failed_lines)))
+    failed_lines = list()
+    ingestion_pipeline = IngestionPipeline(number_of_parser_workers)
+    try:
+        for db_file_info in db_file_info_list:
+            print('processing file: {file_info}'.format(file_info=db_file_info))
+            failed_lines.append(ingestion_pipeline.process_dataset_file(
+                db_file_info, apply_papers, checkpoint_manager.on_lines_processed
+            ))
+    finally:
+        ingestion_pipeline.close()
 
     return failed_lines
 
 
-def make_clean_exit(author_info_manager, paper_info_manager):
-    # store processed info
-    print('store author info')
-    author_info_manager.store_author_info()
-    print('store cached paper info')
-    paper_info_manager.store_cache()
+def process_dataset_files_in_bulk(
+        db_file_info_list, author_info_manager, paper_info_manager, h_index_tracker, checkpoint_manager,
+        memory_budget=BulkBuilder.DEFAULT_MEMORY_BUDGET):
+    # build all records with sequential i/o, then derive tracker state from them
+    bulk_builder = BulkBuilder(author_info_manager, paper_info_manager, memory_budget=memory_budget)
+    failed_lines, file_end_positions = bulk_builder.build(db_file_info_list)
+    h_index_tracker.rebuild(author_info_manager, paper_info_manager)
+
+    # files are checkpointed only once all records are written
+    for dataset_file_path, end_byte_offset, end_line_index, number_of_lines in file_end_positions:
+        checkpoint_manager.on_lines_processed(dataset_file_path, end_byte_offset, end_line_index, number_of_lines)
+
+    return failed_lines
+
 
+def make_clean_exit(paper_info_manager, checkpoint_manager):
+    # store processed info, author info, paper info and author leaderboard are stored with the final checkpoint
+    print('store author info and cached paper info')
+    checkpoint_manager.write_checkpoint()
+    print('paper cache statistics: {statistics}'.format(statistics=paper_info_manager.get_cache_statistics()))
+    print('paper storage statistics: {statistics}'.format(statistics=paper_info_manager.get_storage_statistics()))
+    get_metrics_registry().close()
+
+
+def main(db_file_info_list, should_load_state=False, number_of_workers=1, number_of_parser_workers=0,
+         checkpoint_interval=CheckpointManager.DEFAULT_CHECKPOINT_INTERVAL, bulk_build=False,
+         should_build_analytics_index=False, memory_budget=DEFAULT_MEMORY_BUDGET,
+         metrics_snapshot_interval=MetricsRegistry.DEFAULT_SNAPSHOT_INTERVAL_SECONDS, profiled_stages=(),
+         should_trace_memory=False, number_of_partitions=1):
+    if bulk_build and should_load_state:
+        raise Exception('bulk build starts from empty storage, it can not continue a stored state')
+
+    # partitions keep their own storage under partitions/, only the merged h-index is written to storage/-
+    # the leaderboard, the analytics index and the query server need author and paper info in storage/,
+    # so options that build or feed them are rejected rather than ignored
+    if number_of_partitions > 1:
+        unsupported_options = [option_name for option_name, is_set in [
+            ('bulk_build', bulk_build),
+            ('number_of_workers', number_of_workers > 1),
+            ('number_of_parser_workers', number_of_parser_workers > 0),
+            ('should_build_analytics_index', should_build_analytics_index),
+            ('profiled_stages', len(profiled_stages) > 0),
+            ('should_trace_memory', should_trace_memory)
+        ] if is_set]
+        if len(unsupported_options) > 0:
+            raise ValueError('partitioned ingestion does not support: {option_names}'
+                             .format(option_names=', '.join(unsupported_options)))
+
+        run_partitioned(
+            [db_file_info[:2] for db_file_info in db_file_info_list], number_of_partitions,
+            should_load_state=should_load_state, memory_budget=memory_budget,
+            metrics_snapshot_interval=metrics_snapshot_interval, checkpoint_interval=checkpoint_interval
+        )
+        print('done')
+        return
+
+    # metrics registry is set before managers are created, they keep a reference to it
+    set_metrics_registry(MetricsRegistry(
+        snapshot_interval=metrics_snapshot_interval, profiled_stages=profiled_stages,
+        should_trace_memory=should_trace_memory
+    ))
 
-def main(db_file_info_list, should_load_state=False):
     # initiate info managers
     print('create managers')
-    author_info_manager = AuthorInfoManager()
-    paper_info_manager = PaperInfoManager()
-
-    # load state if needed
+    author_info_manager = AuthorInfoManager(memory_budget=int(memory_budget * AUTHOR_MEMORY_BUDGET_SHARE))
+    paper_info_manager = PaperInfoManager(cache_memory_budget=int(memory_budget * (1 - AUTHOR_MEMORY_BUDGET_SHARE)))
+    h_index_tracker = HIndexTracker()
+    paper_info_manager.add_citation_listener(h_index_tracker.on_citation_added)
+    # leaderboard takes h-indices and paper authors from the tracker
+    author_leaderboard = AuthorLeaderboard(h_index_tracker)
+    paper_info_manager.add_citation_listener(author_leaderboard.on_citation_added)
+    checkpoint_manager = CheckpointManager(
+        author_info_manager, paper_info_manager, checkpoint_interval, author_leaderboard=author_leaderboard
+    )
+
+    # load state if needed, storage is first brought back to the last checkpoint
     if should_load_state:
+        checkpoint_manager.recover()
         author_info_manager.load_author_info()
         paper_info_manager.restore_stored_state()
+        h_index_tracker.rebuild(author_info_manager, paper_info_manager)
+        author_leaderboard.rebuild(author_info_manager, paper_info_manager)
+    checkpoint_manager.start()
+
+    # resume each file from its checkpointed position
+    db_file_info_list = [
+        [db_file_info[0], db_file_info[1], checkpoint_manager.get_file_position(db_file_info[0])]
+        for db_file_info in db_file_info_list
+    ]
 
     # process dataset file
     failed_lines = list()
     print('process dataset files')
-    for db_file_info in db_file_info_list:
-        print('processing file: {file_info}'.format(file_info=db_file_info))
-        file_failed_lines = process_dataset_file(db_file_info, author_info_manager, paper_info_manager)
-        failed_lines.append(file_failed_lines)
+    if bulk_build:
+        # paper records are not cached during a bulk build, its sort runs take the paper share of the budget
+        failed_lines = process_dataset_files_in_bulk(
+            db_file_info_list, author_info_manager, paper_info_manager, h_index_tracker, checkpoint_manager,
+            memory_budget=int(memory_budget * (1 - AUTHOR_MEMORY_BUDGET_SHARE))
+        )
+        author_leaderboard.rebuild(author_info_manager, paper_info_manager)
+    elif number_of_workers > 1:
+        failed_lines = process_dataset_files_in_parallel(
+            db_file_info_list, author_info_manager, paper_info_manager, h_index_tracker, checkpoint_manager,
+            number_of_workers
+        )
+    elif number_of_parser_workers > 0:
+        failed_lines = process_dataset_files_in_pipeline(
+            db_file_info_list, author_info_manager, paper_info_manager, h_index_tracker, checkpoint_manager,
+            number_of_parser_workers
+        )
+    else:
+        for db_file_info in db_file_info_list:
+            print('processing file: {file_info}'.format(file_info=db_file_info))
+            file_failed_lines = process_dataset_file(
+                db_file_info, author_info_manager, paper_info_manager, h_index_tracker, checkpoint_manager
+            )
+            failed_lines.append(file_failed_lines)
 
     # print failed lines
     if len(failed_lines) > 0:
         print('#### {num_lines} failed lines'.format(num_lines=len(failed_lines)))
         # print(failed_lines)
 
+    # calculate h-index of all authors
+    print('calculate h-index')
+    with get_metrics_registry().time_stage('h_index'):
+        h_index_engine = HIndexEngine(author_info_manager, paper_info_manager)
+        h_indices = h_index_engine.calculate_h_indices()
+        h_index_engine.store_h_indices(h_indices)
+
+    # freeze citation histories for as-of-year queries
+    if should_build_analytics_index:
+        CitationAnalyticsIndex().build(author_info_manager, paper_info_manager)
+
     # store volatile information
-    make_clean_exit(author_info_manager, paper_info_manager)
+    make_clean_exit(paper_info_manager, checkpoint_manager)
 
     print('done')
 
 
 if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='ingest dblp-ref files and calculate author h-indices')
+    argument_parser.add_argument('--workers', type=int, default=1,
+                                 help='parser processes of parallel ingestion, files are processed sequentially by 1')
+    arguments = argument_parser.parse_args()
+
     db_files = [
         [r'dataset\dblp.v10\dblp-ref\dblp-ref-0.json', 0],
         [r'dataset\dblp.v10\dblp-ref\dblp-ref-1.json', 0],
         [r'dataset\dblp.v10\dblp-ref\dblp-ref-2.json', 0],
         [r'dataset\dblp.v10\dblp-ref\dblp-ref-3.json', 0],
     ]
-    main(db_files)
+    main(db_files, number_of_workers=arguments.workers)
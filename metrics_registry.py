@@ -0,0 +1,163 @@
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+class MetricsRegistry:
+    """
+    counters and timers of the ingestion hot paths.
+    updating a metric is a dict update- rates, gauges, logging and writing snapshots are done at most once
+    per snapshot interval. snapshots are appended as json lines to the snapshot file.
+    stages named in profiled_stages run under cProfile, and their profiles are dumped with every snapshot.
+    with should_trace_memory, snapshots include traced memory and its top allocation sites.
+    """
+
+    SNAPSHOT_FILE_PATH = r'storage/metrics.jsonl'
+    PROFILE_FILE_PATH_FORMAT = r'storage/profile_{stage_name}.prof'
+    DEFAULT_SNAPSHOT_INTERVAL_SECONDS = 30
+    DEFAULT_LOG_INTERVAL_SECONDS = 10
+    NUMBER_OF_TOP_ALLOCATIONS = 10
+
+    def __init__(self, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL_SECONDS, snapshot_file_path=SNAPSHOT_FILE_PATH,
+                 profiled_stages=(), should_trace_memory=False):
+        self.__snapshot_interval = snapshot_interval
+        self.__snapshot_file_path = snapshot_file_path
+        self.__counters = dict()
+        # timer name -> [count, total seconds, max seconds], timers may be added from storage flush threads
+        self.__timers = dict()
+        self.__timers_lock = threading.Lock()
+        self.__gauges = dict()
+        self.__start_time = time.time()
+        self.__last_snapshot_time = self.__start_time
+        self.__last_snapshot_counters = dict()
+        self.__last_log_times = dict()
+        self.__suppressed_logs = dict()
+        self.__profilers = {stage_name: cProfile.Profile() for stage_name in profiled_stages}
+        self.__should_trace_memory = should_trace_memory and not tracemalloc.is_tracing()
+        if self.__should_trace_memory:
+            tracemalloc.start()
+
+    def increment(self, counter_name, amount=1):
+        self.__counters[counter_name] = self.__counters.get(counter_name, 0) + amount
+
+    def add_time(self, timer_name, seconds):
+        with self.__timers_lock:
+            timer = self.__timers.get(timer_name)
+            if timer is None:
+                self.__timers[timer_name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    @contextmanager
+    def time_stage(self, stage_name):
+        # time the block under stage name, and profile it if the stage is profiled
+        profiler = self.__profilers.get(stage_name)
+        start_time = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.add_time(stage_name, time.perf_counter() - start_time)
+
+    def add_gauge(self, gauge_name, get_value):
+        # get_value is called only when a snapshot is taken
+        self.__gauges[gauge_name] = get_value
+
+    def log(self, message_key, message, min_interval=DEFAULT_LOG_INTERVAL_SECONDS):
+        # print message at most once per interval per key, the number of suppressed messages is printed with it
+        current_time = time.time()
+        if current_time - self.__last_log_times.get(message_key, 0) < min_interval:
+            self.__suppressed_logs[message_key] = self.__suppressed_logs.get(message_key, 0) + 1
+            return
+
+        suppressed_logs = self.__suppressed_logs.pop(message_key, 0)
+        if suppressed_logs > 0:
+            message = '{message} ({num_messages} similar messages suppressed)'\
+                .format(message=message, num_messages=suppressed_logs)
+        print(message)
+        self.__last_log_times[message_key] = current_time
+
+    def report_progress(self):
+        # cheap enough for every batch- a snapshot is written once the snapshot interval passed
+        if time.time() - self.__last_snapshot_time >= self.__snapshot_interval:
+            self.write_snapshot()
+
+    def get_snapshot(self):
+        current_time = time.time()
+        interval_seconds = max(current_time - self.__last_snapshot_time, 1e-9)
+        snapshot = {
+            'time': current_time,
+            'elapsed_seconds': current_time - self.__start_time,
+            'counters': dict(self.__counters),
+            'rates': {
+                counter_name: (counter_value - self.__last_snapshot_counters.get(counter_name, 0)) / interval_seconds
+                for counter_name, counter_value in self.__counters.items()
+            },
+            'timers': {
+                timer_name: {
+                    'count': count, 'total_seconds': total_seconds,
+                    'mean_seconds': total_seconds / count, 'max_seconds': max_seconds
+                }
+                for timer_name, (count, total_seconds, max_seconds) in list(self.__timers.items())
+            },
+            'gauges': {gauge_name: get_value() for gauge_name, get_value in self.__gauges.items()}
+        }
+
+        if self.__should_trace_memory:
+            current_size, peak_size = tracemalloc.get_traced_memory()
+            top_statistics = \
+                tracemalloc.take_snapshot().statistics('lineno')[:MetricsRegistry.NUMBER_OF_TOP_ALLOCATIONS]
+            snapshot['traced_memory'] = {
+                'current_size': current_size,
+                'peak_size': peak_size,
+                'top_allocations': [str(statistic) for statistic in top_statistics]
+            }
+
+        return snapshot
+
+    def write_snapshot(self):
+        snapshot = self.get_snapshot()
+        with open(self.__snapshot_file_path, 'at') as snapshot_file:
+            snapshot_file.write(json.dumps(snapshot) + '\n')
+
+        for stage_name, profiler in self.__profilers.items():
+            profiler.dump_stats(MetricsRegistry.PROFILE_FILE_PATH_FORMAT.format(stage_name=stage_name))
+
+        print('[{timestamp}] metrics: {rates}'.format(
+            timestamp=time.ctime(snapshot['time']),
+            rates=', '.join('{counter_name} {rate:.1f}/s'.format(counter_name=counter_name, rate=rate)
+                            for counter_name, rate in sorted(snapshot['rates'].items()))
+        ))
+        self.__last_snapshot_time = snapshot['time']
+        self.__last_snapshot_counters = snapshot['counters']
+        return snapshot
+
+    def close(self):
+        # final snapshot, tracing is stopped only if it was started here
+        snapshot = self.write_snapshot()
+        if self.__should_trace_memory:
+            tracemalloc.stop()
+            self.__should_trace_memory = False
+        return snapshot
+
+
+# registry used by all managers, it should be replaced before they are created
+metrics_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    return metrics_registry
+
+
+def set_metrics_registry(registry):
+    global metrics_registry
+    metrics_registry = registry
@@ -1,242 +1,405 @@
 
 import os
+import sys
 import time
-import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from record_cache import RecordCache
+from id_index import IdIndex
+from paper_storage_file import PaperStorageFile
+from storage_files import get_temporary_file_path, sync_file, commit_temporary_files
+from metrics_registry import get_metrics_registry
 
 
 class PaperInfoManager:
 
-    RECORD_FIELD_SEPARATOR = '#'
-    RECORD_STRUCTURE_YEAR_LENGTH = 4
-    RECORD_STRUCTURE_COUNTER_LENGTH = 4
-    RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS = 60
-    RECORD_LENGTH = \
-        RECORD_STRUCTURE_YEAR_LENGTH \
-        + 1 \
-        + RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS * (RECORD_STRUCTURE_YEAR_LENGTH + RECORD_STRUCTURE_COUNTER_LENGTH) \
-        + 1
+    # encoded record: varint publication year (0 if unknown), varint number of citation years,
+    # then per citation year in ascending order- varint delta from previous year and varint count
+    VARINT_VALUE_BITS = 7
+    VARINT_VALUE_MASK = 0x7f
+    VARINT_CONTINUATION_BIT = 0x80
 
     MAX_PAPERS_IN_STORAGE_FILE = 250000
-    OPERATION_LOG_INTERVAL = 10000
-    MAX_CACHE_SIZE = 4000000
+    # metrics progress is reported once per this many operations
+    OPERATION_REPORT_INTERVAL = 10000
+    DEFAULT_CACHE_MEMORY_BUDGET = 2 * 1024 ** 3
+    # rough resident size of a cached record: two dicts, publication year and a few citation years.
+    # it is only the starting point- sizes of evicted records are measured, and cache capacity follows them
+    ESTIMATED_CACHED_RECORD_SIZE = 600
+    # cache entry of a record id, not counted by sys.getsizeof of the record
+    CACHE_ENTRY_OVERHEAD = 100
+    RECORD_SIZE_SAMPLES_IN_EVICTION = 64
+    RECORD_SIZE_SMOOTHING_FACTOR = 0.2
+    # every eviction frees this part of the cache memory budget
     CACHE_CLEANING_FACTOR = 0.01
+    # storage files are flushed in parallel- file writes release the GIL
+    STORAGE_FLUSH_THREADS = 4
+
+    # durability modes: leave syncing to the OS, msync once per eviction batch, or msync every stored record
+    DURABILITY_NONE = 'none'
+    DURABILITY_BATCH = 'batch'
+    DURABILITY_RECORD = 'record'
+
+    # undo log holds stored images of records overwritten since the last checkpoint
+    UNDO_LOG_FILE_PATH = r'storage/papers_undo.log'
+    UNDO_LOG_MAGIC = b'HIUL'
+    UNDO_LOG_HEADER_STRUCT = struct.Struct('<4sQ')
+    UNDO_LOG_ENTRY_STRUCT = struct.Struct('<QI')
 
     PUBLICATION_YEAR_KEY_NAME = 'y'
     CITATION_INFO_KEY_NAME = 'c'
-    STORAGE_FILE_PATH_FORMAT = r'storage/papers_{file_id}.json'
-    MAPPING_FILE_PATH = r'storage/papers_name_mapping.json'
-
-    def __init__(self):
-        self.__records_in_current_storage_file = 0
-        self.__working_storage_file_index = 0
+    STORAGE_FILE_PATH_FORMAT = r'storage/papers_{file_id}.bin'
+    MAPPING_FILE_PATH = r'storage/papers_name_index.bin'
+
+    def __init__(self, durability_mode=DURABILITY_BATCH, cache_memory_budget=DEFAULT_CACHE_MEMORY_BUDGET,
+                 read_only=False):
+        if durability_mode not in \
+                (PaperInfoManager.DURABILITY_NONE, PaperInfoManager.DURABILITY_BATCH, PaperInfoManager.DURABILITY_RECORD):
+            raise Exception('unknown durability mode: {mode}'.format(mode=durability_mode))
+
+        # a read-only manager maps stored files for reading only, any write fails
+        self.__durability_mode = durability_mode
+        self.__read_only = read_only
         self.__operation_counter = 0
-        self.__paper_storage_mapping = dict()
-        self.__file_handlers = dict()
-        self.__record_cache = dict()
-
-    def __get_storage_file_handler(self, file_path):
-        # check if file already open
-        if file_path in self.__file_handlers.keys():
-            return self.__file_handlers[file_path]
-
-        else:
-            # need to open the file and store its handler
-            file_handler = open(file_path, 'w+')
-            self.__file_handlers[file_path] = file_handler
-            return file_handler
-
-    def __record_data_to_paper_record(self, record_data):
-        paper_record = dict()
-        current_index = 0
+        self.__paper_storage_mapping = IdIndex()
+        self.__storage_files = dict()
+        self.__uncommitted_storage_files = set()
+        self.__undo_log_file = None
+        self.__undo_logged_record_ids = set()
+        self.__cache_memory_budget = cache_memory_budget
+        self.__estimated_record_size = PaperInfoManager.ESTIMATED_CACHED_RECORD_SIZE
+        self.__record_cache = RecordCache(self.__get_tuned_cache_capacity())
+        self.__citation_listeners = list()
+
+        # gauges are evaluated only when a metrics snapshot is taken
+        self.__metrics = get_metrics_registry()
+        self.__metrics.add_gauge('paper_records', self.get_number_of_records)
+        self.__metrics.add_gauge('paper_cache_hit_ratio', self.__get_cache_hit_ratio)
+        self.__metrics.add_gauge('paper_cache_record_size', lambda: int(self.__estimated_record_size))
+
+    def __get_storage_file(self, storage_file_index):
+        # check if file already opened
+        if storage_file_index in self.__storage_files:
+            return self.__storage_files[storage_file_index]
+
+        storage_file = PaperStorageFile(
+            PaperInfoManager.STORAGE_FILE_PATH_FORMAT.format(file_id=storage_file_index),
+            PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE, self.__read_only
+        )
+        self.__storage_files[storage_file_index] = storage_file
+        return storage_file
+
+    def __commit_storage(self):
+        # msync every file that was written since the last commit
+        with self.__metrics.time_stage('storage_commit'):
+            for storage_file_index in self.__uncommitted_storage_files:
+                self.__storage_files[storage_file_index].flush()
+        self.__uncommitted_storage_files.clear()
+
+    def __compact_storage(self):
+        # rewrite files where rewritten records left too much garbage
+        compacted_files = [
+            (storage_file_index, storage_file)
+            for storage_file_index, storage_file in sorted(self.__storage_files.items())
+            if storage_file.needs_compaction()
+        ]
+        with ThreadPoolExecutor(PaperInfoManager.STORAGE_FLUSH_THREADS) as flush_executor:
+            garbage_sizes = list(flush_executor.map(lambda file_item: file_item[1].compact(), compacted_files))
+
+        for (storage_file_index, _), garbage_size in zip(compacted_files, garbage_sizes):
+            print('compacted paper storage file #{file_id}, freed {num_bytes} bytes'
+                  .format(file_id=storage_file_index, num_bytes=garbage_size))
+
+    @staticmethod
+    def __append_varint(output_data, value):
+        while value > PaperInfoManager.VARINT_VALUE_MASK:
+            output_data.append((value & PaperInfoManager.VARINT_VALUE_MASK) | PaperInfoManager.VARINT_CONTINUATION_BIT)
+            value >>= PaperInfoManager.VARINT_VALUE_BITS
+        output_data.append(value)
+
+    @staticmethod
+    def __read_varint(record_data, data_offset):
+        value = 0
+        value_shift = 0
+        while True:
+            data_byte = record_data[data_offset]
+            data_offset += 1
+            value |= (data_byte & PaperInfoManager.VARINT_VALUE_MASK) << value_shift
+            if data_byte < PaperInfoManager.VARINT_CONTINUATION_BIT:
+                return value, data_offset
+            value_shift += PaperInfoManager.VARINT_VALUE_BITS
+
+    @staticmethod
+    def decode_record(record_data):
+        # a record that was never written is empty
+        if len(record_data) == 0:
+            return {
+                PaperInfoManager.PUBLICATION_YEAR_KEY_NAME: None,
+                PaperInfoManager.CITATION_INFO_KEY_NAME: dict()
+            }
 
         # parse publication year info
-        paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] = \
-            int(
-                record_data[
-                    current_index
-                    :(current_index + PaperInfoManager.RECORD_STRUCTURE_YEAR_LENGTH)
-                ]
-            )
-        if paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] == 0:
-            paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] = None
-        current_index += PaperInfoManager.RECORD_STRUCTURE_YEAR_LENGTH + 1
-
-        # parse citation info
-        paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME] = dict()
-        for citation_year_index in range(PaperInfoManager.RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS):
-            if record_data[current_index] == PaperInfoManager.RECORD_FIELD_SEPARATOR:
-                break
+        publication_year, data_offset = PaperInfoManager.__read_varint(record_data, 0)
+        number_of_citation_years, data_offset = PaperInfoManager.__read_varint(record_data, data_offset)
+
+        # parse citation info- years are delta encoded
+        citation_info = dict()
+        citation_year = 0
+        for _ in range(number_of_citation_years):
+            year_delta, data_offset = PaperInfoManager.__read_varint(record_data, data_offset)
+            citation_count, data_offset = PaperInfoManager.__read_varint(record_data, data_offset)
+            citation_year += year_delta
+            citation_info[str(citation_year)] = citation_count
+
+        return {
+            PaperInfoManager.PUBLICATION_YEAR_KEY_NAME: publication_year if publication_year != 0 else None,
+            PaperInfoManager.CITATION_INFO_KEY_NAME: citation_info
+        }
 
-            citation_year = \
-                record_data[current_index:current_index+PaperInfoManager.RECORD_STRUCTURE_YEAR_LENGTH]
-            current_index += PaperInfoManager.RECORD_STRUCTURE_YEAR_LENGTH
-            citation_count = \
-                int(
-                    record_data[current_index:current_index+PaperInfoManager.RECORD_STRUCTURE_COUNTER_LENGTH]
-                    .replace(PaperInfoManager.RECORD_FIELD_SEPARATOR, '')
-                )
-            current_index += PaperInfoManager.RECORD_STRUCTURE_COUNTER_LENGTH
+    @staticmethod
+    def encode_citation_history(publication_year, citation_years, citation_counts):
+        # citation_years are ints in ascending order, publication_year is 0 if unknown
+        record_data = bytearray()
+        PaperInfoManager.__append_varint(record_data, publication_year)
+        PaperInfoManager.__append_varint(record_data, len(citation_years))
 
-            paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME][citation_year] = citation_count
+        previous_citation_year = 0
+        for citation_year, citation_count in zip(citation_years, citation_counts):
+            PaperInfoManager.__append_varint(record_data, citation_year - previous_citation_year)
+            PaperInfoManager.__append_varint(record_data, citation_count)
+            previous_citation_year = citation_year
 
-        # return parsed record
-        return paper_record
+        return bytes(record_data)
 
-    def __paper_record_to_record_data(self, paper_record):
-        record_data = str()
+    @staticmethod
+    def encode_record(paper_record):
+        citation_info = paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME]
 
         # encode publication year info
-        if paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] is not None:
-            record_data += str(paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME])
-        else:
-            record_data += '0'.rjust(PaperInfoManager.RECORD_STRUCTURE_YEAR_LENGTH, '0')
-        record_data += PaperInfoManager.RECORD_FIELD_SEPARATOR
-
-        # encode citation history
-        if len(paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME].keys()) \
-                > PaperInfoManager.RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS:
-            print('WARNING: paper has too many citation years! num={citation_count}'
-                  .format(citation_count=len(paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME].keys())))
-
-        # in case there is too many citation years- selects newest years first and skip the beginning
-        sorted_keys = list(paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME].keys())
-        sorted_keys.sort()
-        sorted_keys.reverse()
-        year_key_index = 0
-        while year_key_index < len(sorted_keys) \
-                and year_key_index < PaperInfoManager.RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS:
-            citation_year = sorted_keys[year_key_index]
-            citation_count_string = str(paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME][citation_year])
-            if len(citation_count_string) > PaperInfoManager.RECORD_STRUCTURE_COUNTER_LENGTH:
-                raise Exception('RECORD COUNTER TOO HIGH!!!')
-
-            citation_count_string = citation_count_string.rjust(
-                PaperInfoManager.RECORD_STRUCTURE_COUNTER_LENGTH, PaperInfoManager.RECORD_FIELD_SEPARATOR
-            )
+        publication_year = paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME]
+        publication_year = int(publication_year) if publication_year is not None else 0
 
-            record_data += citation_year + citation_count_string
-            year_key_index += 1
-
-        # pad spare space
-        added_records = len(paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME])
-        pad_length = \
-            (PaperInfoManager.RECORD_STRUCTURE_NUMBER_OF_CITATION_YEARS - added_records) \
-            * (PaperInfoManager.RECORD_STRUCTURE_YEAR_LENGTH + PaperInfoManager.RECORD_STRUCTURE_COUNTER_LENGTH)
-        record_data += PaperInfoManager.RECORD_FIELD_SEPARATOR * pad_length
+        # encode citation history, all years are kept
+        citation_years = sorted(int(citation_year) for citation_year in citation_info.keys())
+        return PaperInfoManager.encode_citation_history(
+            publication_year, citation_years, [citation_info[str(citation_year)] for citation_year in citation_years]
+        )
 
-        record_data += PaperInfoManager.RECORD_FIELD_SEPARATOR
-        return record_data
+    def __get_record_location(self, record_id):
+        # record ids are dense- split to storage file index and record index in the file
+        return divmod(record_id, PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE)
 
     def __get_record_from_storage(self, record_id):
-        # split record_id to get storage file index and relative record index
-        storage_file_index, record_index = record_id.split('_')
-        storage_file_index = int(storage_file_index)
-        record_index = int(record_index)
-
-        # calculate record offset from file start
-        record_offset = record_index * PaperInfoManager.RECORD_LENGTH
-
-        # build file path and read record data
-        storage_file_path = PaperInfoManager.STORAGE_FILE_PATH_FORMAT.format(file_id=storage_file_index)
-        storage_file = self.__get_storage_file_handler(storage_file_path)
-        storage_file.flush()
-        storage_file.seek(record_offset, 0)
-        record_data = storage_file.read(PaperInfoManager.RECORD_LENGTH)
-        storage_file.flush()
+        storage_file_index, record_index = self.__get_record_location(record_id)
+
+        # read record data
+        record_data = self.__get_storage_file(storage_file_index).read_record(record_index)
 
         # parse record_data into paper record structure
         try:
-            paper_record = self.__record_data_to_paper_record(record_data)
+            paper_record = PaperInfoManager.decode_record(record_data)
         except Exception as ex:
             print('Error: failed converting to paper record')
-            print('offset= {offset}'.format(offset=record_offset))
+            print('record id= {record_id}'.format(record_id=record_id))
             raise ex
 
         return paper_record
 
-    def __store_record_to_storage(self, record_id, paper_record):
-        # split record_id to get storage file index and relative record index
-        storage_file_index, record_index = record_id.split('_')
-        storage_file_index = int(storage_file_index)
-        record_index = int(record_index)
-
-        # calculate record offset from file start
-        record_offset = record_index * PaperInfoManager.RECORD_LENGTH
-
-        # build file path and read record data
-        storage_file_path = PaperInfoManager.STORAGE_FILE_PATH_FORMAT.format(file_id=storage_file_index)
-        record_data = self.__paper_record_to_record_data(paper_record)
-
-        storage_file = self.__get_storage_file_handler(storage_file_path)
-        storage_file.flush()
-        os.fsync(storage_file)
-        storage_file.seek(record_offset, 0)
-        storage_file.write(record_data)
-        storage_file.flush()
-        os.fsync(storage_file)
-
-    def __clean_cache(self, clean_factor=CACHE_CLEANING_FACTOR):
-        # calculate how much records to move
-        cache_keys = list(self.__record_cache.keys())
-        cache_keys.sort()
-        records_count = int(len(cache_keys) * clean_factor)
-
-        # move records and remove from cache
-        print('cleaning {num_records} records..'.format(num_records=records_count))
-        for i in range(records_count):
-            if (i % PaperInfoManager.OPERATION_LOG_INTERVAL) == 0:
-                print('record #{record_index}'.format(record_index=i))
-
-            self.__store_record_to_storage(cache_keys[i], self.__record_cache.pop(cache_keys[i]))
-
-    def __add_record_to_cache(self, record_id, paper_record):
+    def __write_record_data(self, record_id, record_data):
+        storage_file_index, record_index = self.__get_record_location(record_id)
+        storage_file = self.__get_storage_file(storage_file_index)
+        storage_file.write_record(record_index, record_data)
+
+        if self.__durability_mode == PaperInfoManager.DURABILITY_RECORD:
+            # msync only the pages holding the record
+            storage_file.flush_record(record_index)
+        else:
+            self.__uncommitted_storage_files.add(storage_file_index)
+
+    def __log_undo_images(self, record_ids):
+        # save stored image of records before their first overwrite since the undo log was started.
+        # the log is synced before the records are written, since mapped pages may reach the disk at any time
+        if self.__undo_log_file is None:
+            return
+
+        logged_records = 0
+        for record_id in record_ids:
+            if record_id in self.__undo_logged_record_ids:
+                continue
+
+            storage_file_index, record_index = self.__get_record_location(record_id)
+            record_data = self.__get_storage_file(storage_file_index).read_record(record_index)
+            self.__undo_log_file.write(PaperInfoManager.UNDO_LOG_ENTRY_STRUCT.pack(record_id, len(record_data)))
+            self.__undo_log_file.write(record_data)
+            self.__undo_logged_record_ids.add(record_id)
+            logged_records += 1
+
+        if logged_records > 0:
+            sync_file(self.__undo_log_file)
+
+    def __store_records_to_storage(self, records):
+        # records is a list of (record_id, paper_record) pairs
+        encoded_records = \
+            [(record_id, PaperInfoManager.encode_record(paper_record)) for record_id, paper_record in records]
+
+        if self.__durability_mode == PaperInfoManager.DURABILITY_RECORD:
+            for record_id, record_data in encoded_records:
+                self.__log_undo_images([record_id])
+                self.__write_record_data(record_id, record_data)
+        else:
+            # one undo log sync for the whole batch
+            self.__log_undo_images([record_id for record_id, record_data in encoded_records])
+            for record_id, record_data in encoded_records:
+                self.__write_record_data(record_id, record_data)
+
+    def __flush_records_to_storage(self, records):
+        """
+        write many records, each storage file is written once- records of a file are merged with its stored
+        records in a single pass (see PaperStorageFile.write_records), and files are written in parallel.
+        records is a list of (record_id, paper_record) pairs.
+        """
+        start_time = time.time()
+        file_records = dict()
+        for record_id, paper_record in records:
+            storage_file_index, record_index = self.__get_record_location(record_id)
+            file_records.setdefault(storage_file_index, dict())[record_index] = \
+                PaperInfoManager.encode_record(paper_record)
+
+        # one undo log sync for all records, files are opened before the parallel part
+        self.__log_undo_images([record_id for record_id, paper_record in records])
+        flushed_files = [
+            (self.__get_storage_file(storage_file_index), updated_records)
+            for storage_file_index, updated_records in sorted(file_records.items())
+        ]
+        with ThreadPoolExecutor(PaperInfoManager.STORAGE_FLUSH_THREADS) as flush_executor:
+            list(flush_executor.map(lambda file_item: file_item[0].write_records(file_item[1]), flushed_files))
+        self.__uncommitted_storage_files.update(file_records.keys())
+
+        self.__metrics.add_time('storage_flush', time.time() - start_time)
+        print('flushed {num_records} records to {num_files} storage files in {seconds:.2f} seconds'.format(
+            num_records=len(records), num_files=len(file_records), seconds=time.time() - start_time
+        ))
+
+    def start_undo_log(self, generation):
+        # begin a new undo log, records overwritten from now on can be rolled back to their current state
+        if self.__undo_log_file is not None:
+            self.__undo_log_file.close()
+
+        self.__undo_log_file = open(PaperInfoManager.UNDO_LOG_FILE_PATH, 'wb')
+        self.__undo_log_file.write(
+            PaperInfoManager.UNDO_LOG_HEADER_STRUCT.pack(PaperInfoManager.UNDO_LOG_MAGIC, generation)
+        )
+        sync_file(self.__undo_log_file)
+        self.__undo_logged_record_ids = set()
+
+    def rollback_undo_log(self, generation):
+        # restore records overwritten after checkpoint 'generation', logs of other generations are obsolete
+        if not os.path.exists(PaperInfoManager.UNDO_LOG_FILE_PATH):
+            return 0
+
+        with open(PaperInfoManager.UNDO_LOG_FILE_PATH, 'rb') as undo_log_file:
+            undo_log_data = undo_log_file.read()
+
+        if len(undo_log_data) < PaperInfoManager.UNDO_LOG_HEADER_STRUCT.size:
+            return 0
+        magic, log_generation = PaperInfoManager.UNDO_LOG_HEADER_STRUCT.unpack_from(undo_log_data, 0)
+        if magic != PaperInfoManager.UNDO_LOG_MAGIC or log_generation != generation:
+            return 0
+
+        # write back stored images, a torn last entry was never followed by its record write
+        restored_records = 0
+        current_offset = PaperInfoManager.UNDO_LOG_HEADER_STRUCT.size
+        while current_offset + PaperInfoManager.UNDO_LOG_ENTRY_STRUCT.size <= len(undo_log_data):
+            record_id, data_length = PaperInfoManager.UNDO_LOG_ENTRY_STRUCT.unpack_from(undo_log_data, current_offset)
+            current_offset += PaperInfoManager.UNDO_LOG_ENTRY_STRUCT.size
+            if current_offset + data_length > len(undo_log_data):
+                break
+
+            storage_file_index, record_index = self.__get_record_location(record_id)
+            self.__get_storage_file(storage_file_index).write_record(
+                record_index, undo_log_data[current_offset:current_offset + data_length]
+            )
+            self.__uncommitted_storage_files.add(storage_file_index)
+            current_offset += data_length
+            restored_records += 1
+
+        self.__commit_storage()
+        print('rolled back {num_records} records to checkpoint #{generation}'
+              .format(num_records=restored_records, generation=generation))
+        return restored_records
+
+    def __get_tuned_cache_capacity(self):
+        return max(1, int(self.__cache_memory_budget / self.__estimated_record_size))
+
+    @staticmethod
+    def __measure_record_size(paper_record):
+        # approximate resident size of a cached record, small ints shared by the interpreter are counted too
+        citation_info = paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME]
+        return PaperInfoManager.CACHE_ENTRY_OVERHEAD + sys.getsizeof(paper_record) + \
+            sys.getsizeof(paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME]) + sys.getsizeof(citation_info) + \
+            sum(sys.getsizeof(citation_year) + sys.getsizeof(citation_count)
+                for citation_year, citation_count in citation_info.items())
+
+    def __tune_cache(self, evicted_records):
+        # follow the measured size of evicted records, capacity is derived from it and the memory budget
+        sampled_records = evicted_records[:PaperInfoManager.RECORD_SIZE_SAMPLES_IN_EVICTION]
+        sampled_record_size = sum(
+            PaperInfoManager.__measure_record_size(paper_record) for _, paper_record, _ in sampled_records
+        ) / len(sampled_records)
+        self.__estimated_record_size += PaperInfoManager.RECORD_SIZE_SMOOTHING_FACTOR * \
+            (sampled_record_size - self.__estimated_record_size)
+        self.__record_cache.set_capacity(self.__get_tuned_cache_capacity())
+
+    def __clean_cache(self):
+        # free a fixed part of the memory budget, and whatever the cache holds above a capacity that shrank
+        records_count = max(1, int(
+            self.__cache_memory_budget * PaperInfoManager.CACHE_CLEANING_FACTOR / self.__estimated_record_size
+        )) + max(0, len(self.__record_cache) - self.__record_cache.get_capacity())
+
+        # evict least recently used records, only modified ones need to be written
+        with self.__metrics.time_stage('cache_eviction'):
+            evicted_records = self.__record_cache.evict(records_count)
+            if len(evicted_records) > 0:
+                self.__tune_cache(evicted_records)
+            dirty_records = \
+                [(record_id, paper_record) for record_id, paper_record, is_dirty in evicted_records if is_dirty]
+            self.__store_records_to_storage(dirty_records)
+
+            # group commit of all evicted records
+            if self.__durability_mode == PaperInfoManager.DURABILITY_BATCH:
+                self.__commit_storage()
+
+        self.__metrics.increment('evicted_records', len(evicted_records))
+        self.__metrics.increment('dirty_evicted_records', len(dirty_records))
+
+    def __get_cache_hit_ratio(self):
+        cache_statistics = self.__record_cache.get_statistics()
+        lookups = cache_statistics[RecordCache.HITS_KEY_NAME] + cache_statistics[RecordCache.MISSES_KEY_NAME]
+        return cache_statistics[RecordCache.HITS_KEY_NAME] / lookups if lookups > 0 else 0.0
+
+    def __add_record_to_cache(self, record_id, paper_record, is_dirty):
         # verify there is room for the record
-        if len(self.__record_cache.keys()) == PaperInfoManager.MAX_CACHE_SIZE:
+        if self.__record_cache.is_full():
             # move records to storage
             self.__clean_cache()
 
-        self.__record_cache[record_id] = paper_record
+        self.__record_cache.put(record_id, paper_record, is_dirty)
 
-    def __get_paper_record(self, paper_id):
-        # get paper record_id
-        paper_record_id = self.get_paper_record_id(paper_id)
-
-        # verify record is in cache
-        if paper_record_id not in self.__record_cache.keys():
+    def __get_record(self, paper_record_id):
+        # look for record in cache
+        paper_record = self.__record_cache.get(paper_record_id)
+        if paper_record is None:
             # load record form storage
             paper_record = self.__get_record_from_storage(paper_record_id)
 
             # store record in cache
-            self.__add_record_to_cache(paper_record_id, paper_record)
-
-        # return record from cache
-        return self.__record_cache[paper_record_id]
-
-    def __store_paper_record(self, paper_id, paper_record):
-        # get paper record_id
-        paper_record_id = self.get_paper_record_id(paper_id)
+            self.__add_record_to_cache(paper_record_id, paper_record, is_dirty=False)
 
-        # store paper record
-        self.__add_record_to_cache(paper_record_id, paper_record)
+        return paper_record
 
     def __create_new_paper_record(self, paper_id, paper_year):
-        # check if need to move to new storage file
-        if self.__records_in_current_storage_file == PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE:
-            # increase working file index and initiate records counter
-            self.__working_storage_file_index += 1
-            self.__records_in_current_storage_file = 0
-
-        # allocate record_id
-        record_id = '{storage_file_index}_{record_index}'.format(
-            storage_file_index=self.__working_storage_file_index,
-            record_index=
-                str(self.__records_in_current_storage_file)
-                    .rjust(len(str(PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE)), '0')
-        )
-        self.__records_in_current_storage_file += 1
-
-        # store mapping
-        self.__paper_storage_mapping[paper_id] = record_id
+        # allocate record_id- the next dense id, which also decides storage file and position in it
+        record_id = self.__paper_storage_mapping.add(paper_id)
 
         # build record
         paper_record = {
@@ -244,31 +407,38 @@ class PaperInfoManager:
             PaperInfoManager.CITATION_INFO_KEY_NAME: dict()
         }
 
-        # store record to working file
-        self.__store_paper_record(paper_id, paper_record)
+        # store record to cache, it is written to working file when evicted
+        self.__add_record_to_cache(record_id, paper_record, is_dirty=True)
+        return record_id
 
-    def __add_citation_year(self, paper_id, citation_year):
+    def __add_citation_year(self, paper_record_id, citation_year, citations_count):
         # get paper record
-        paper_record = self.__get_paper_record(paper_id)
+        paper_record = self.__get_record(paper_record_id)
+        self.__record_cache.mark_dirty(paper_record_id)
 
         # add citation year
         if citation_year not in paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME].keys():
             paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME][citation_year] = 0
 
-        paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME][citation_year] += 1
+        paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME][citation_year] += citations_count
+
+        return paper_record
 
     def add_paper(self, paper_id, paper_year):
         self.__increase_operation_counter()
 
         # verify a paper is'nt added twice
-        if self.get_paper_record_id(paper_id) is not None:
+        paper_record_id = self.get_paper_record_id(paper_id)
+        if paper_record_id is not None:
 
             # get paper record
-            paper_record = self.__get_paper_record(paper_id)
+            paper_record = self.__get_record(paper_record_id)
 
             if paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] is not None:
-                print('ERROR: paper {paper_id} already in storage. pub_year={pub_year} history={citation_history}'
-                    .format(
+                self.__metrics.increment('duplicate_papers')
+                self.__metrics.log(
+                    'duplicate_paper',
+                    'ERROR: paper {paper_id} already in storage. pub_year={pub_year} history={citation_history}'.format(
                         paper_id=paper_id, pub_year=paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME],
                         citation_history=paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME]
                     )
@@ -279,89 +449,221 @@ class PaperInfoManager:
                 # empty paper record created when other paper cited it before
                 # so only need to set the publication year
                 paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] = paper_year
+                self.__record_cache.mark_dirty(paper_record_id)
 
         else:
             # create new paper record
             self.__create_new_paper_record(paper_id, paper_year)
 
+        self.__metrics.increment('papers_added')
         return True
 
-    def add_citation(self, paper_id, citation_year):
+    def add_citation(self, paper_id, citation_year, citations_count=1):
         self.__increase_operation_counter()
 
         # verify paper is in  storage
-        if self.get_paper_record_id(paper_id) is None:
+        paper_record_id = self.get_paper_record_id(paper_id)
+        if paper_record_id is None:
             # create empty paper record
-            self.__create_new_paper_record(paper_id, None)
+            paper_record_id = self.__create_new_paper_record(paper_id, None)
+
+        # add to citation count
+        paper_record = self.__add_citation_year(paper_record_id, citation_year, citations_count)
+        self.__metrics.increment('citations_applied', citations_count)
+
+        # notify listeners with paper's new total citation count
+        if len(self.__citation_listeners) > 0:
+            citation_count = sum(paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME].values())
+            for listener in self.__citation_listeners:
+                listener(paper_record_id, citation_count, citations_count)
+
+    def add_papers(self, papers):
+        """
+        add a batch of papers with their citations, papers is a list of (paper id, paper year, referenced paper ids).
+        result is the same as add_paper and add_citation of each reference, paper by paper, but each paper
+        and each cited (paper, year) is looked up once per batch, and listeners are notified once per them.
+        a paper that fails does not fail the batch, its citations are not counted.
+        returns (record ids of the added papers, None for a failed paper, [(index of failed paper, exception)]).
+        """
+        paper_record_ids = list()
+        failed_papers = list()
+        citations = dict()
+        for paper_index, (paper_id, paper_year, references) in enumerate(papers):
+            try:
+                paper_record_id, paper_citations = self.__add_batch_paper(paper_id, paper_year, references)
+            except Exception as ex:
+                paper_record_ids.append(None)
+                failed_papers.append((paper_index, ex))
+                continue
+
+            paper_record_ids.append(paper_record_id)
+            for citation_key, citations_count in paper_citations.items():
+                citations[citation_key] = citations.get(citation_key, 0) + citations_count
+
+        # count operations as if each paper and citation were added separately
+        number_of_citations = sum(citations.values())
+        number_of_added_papers = len(papers) - len(failed_papers)
+        self.__increase_operation_counter(number_of_added_papers + number_of_citations)
+        self.__metrics.increment('papers_added', number_of_added_papers)
+        self.__metrics.increment('citations_applied', number_of_citations)
+
+        # add citation counts
+        for (paper_record_id, citation_year), citations_count in citations.items():
+            paper_record = self.__add_citation_year(paper_record_id, citation_year, citations_count)
+            if len(self.__citation_listeners) > 0:
+                citation_count = sum(paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME].values())
+                for listener in self.__citation_listeners:
+                    listener(paper_record_id, citation_count, citations_count)
+
+        return paper_record_ids, failed_papers
+
+    def __add_batch_paper(self, paper_id, paper_year, references):
+        # references are listed before the paper's record is created, so a paper without a list creates no record
+        referenced_paper_ids = list(references)
+
+        # add paper record, records are created in the same order as by add_paper and add_citation
+        paper_record_id = self.get_paper_record_id(paper_id)
+        if paper_record_id is None:
+            paper_record_id = self.__create_new_paper_record(paper_id, paper_year)
+        else:
+            paper_record = self.__get_record(paper_record_id)
+            if paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] is not None:
+                self.__metrics.increment('duplicate_papers')
+                self.__metrics.log(
+                    'duplicate_paper', 'ERROR: paper {paper_id} already in storage. pub_year={pub_year}'
+                    .format(paper_id=paper_id, pub_year=paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME])
+                )
+            else:
+                paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME] = paper_year
+                self.__record_cache.mark_dirty(paper_record_id)
+
+        # count citations per cited record and year
+        paper_citations = dict()
+        for referenced_paper_id in referenced_paper_ids:
+            referenced_record_id = self.reserve_paper(referenced_paper_id)
+            citation_key = (referenced_record_id, paper_year)
+            paper_citations[citation_key] = paper_citations.get(citation_key, 0) + 1
+        return paper_record_id, paper_citations
+
+    def add_citation_listener(self, listener):
+        # listener is called as listener(paper_record_id, total_citation_count, added_citations_count)
+        self.__citation_listeners.append(listener)
+
+    def reserve_paper(self, paper_id):
+        # get paper's record id, creating an empty record if paper is not in storage yet
+        paper_record_id = self.get_paper_record_id(paper_id)
+        if paper_record_id is None:
+            paper_record_id = self.__create_new_paper_record(paper_id, None)
+        return paper_record_id
+
+    def allocate_paper_record_id(self, paper_id):
+        # get paper's record id, allocating one without creating a record- an unwritten record is empty
+        return self.__paper_storage_mapping.get_or_add(paper_id)
+
+    def write_record_block(self, first_record_id, records_data):
+        # append encoded records of consecutive record ids directly to storage, bypassing the cache.
+        # used to build storage from scratch, the records must not have been written before
+        record_id = first_record_id
+        data_index = 0
+        while data_index < len(records_data):
+            # write the part that falls in the current storage file
+            storage_file_index, record_index = self.__get_record_location(record_id)
+            number_of_records = \
+                min(len(records_data) - data_index, PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE - record_index)
+            self.__get_storage_file(storage_file_index).append_records(
+                record_index, records_data[data_index:data_index + number_of_records]
+            )
+            self.__uncommitted_storage_files.add(storage_file_index)
 
-        # add one to citation count
-        self.__add_citation_year(paper_id, citation_year)
+            record_id += number_of_records
+            data_index += number_of_records
 
-    def __increase_operation_counter(self):
-        self.__operation_counter += 1
-        if (self.__operation_counter % PaperInfoManager.OPERATION_LOG_INTERVAL) == 0:
-            print('[{timestamp}] >> op #{op_id} papers: {papers_count}'.format(
-                timestamp=time.ctime(),
-                op_id=self.__operation_counter, papers_count=len(self.__paper_storage_mapping))
-            )
+    def get_total_citation_count(self, paper_record_id):
+        paper_record = self.__get_record(paper_record_id)
+        return sum(paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME].values())
+
+    def get_citation_history(self, paper_record_id):
+        # {citation year: count} of the record, it must not be modified
+        return self.__get_record(paper_record_id)[PaperInfoManager.CITATION_INFO_KEY_NAME]
+
+    def __increase_operation_counter(self, number_of_operations=1):
+        previous_operation_counter = self.__operation_counter
+        self.__operation_counter += number_of_operations
+        if (previous_operation_counter // PaperInfoManager.OPERATION_REPORT_INTERVAL) != \
+                (self.__operation_counter // PaperInfoManager.OPERATION_REPORT_INTERVAL):
+            self.__metrics.report_progress()
 
     def get_paper_record_id(self, paper_id):
-        if paper_id in self.__paper_storage_mapping.keys():
-            return self.__paper_storage_mapping[paper_id]
-        else:
-            return None
+        return self.__paper_storage_mapping.get_id(paper_id)
 
-    def store_cache(self):
+    def get_paper_id(self, paper_record_id):
+        return self.__paper_storage_mapping.get_key(paper_record_id)
+
+    def get_number_of_records(self):
+        return len(self.__paper_storage_mapping)
+
+    def iterate_citation_histories(self):
+        # yield citation info of every record, {citation year: count}, ordered by record id
+        for paper_record_id in range(len(self.__paper_storage_mapping)):
+            # read record from cache if possible, otherwise from storage
+            paper_record = self.__record_cache.peek(paper_record_id)
+            if paper_record is None:
+                paper_record = self.__get_record_from_storage(paper_record_id)
+
+            yield paper_record[PaperInfoManager.CITATION_INFO_KEY_NAME]
+
+    def iterate_publication_years(self):
+        # yield publication year of every record, None for papers only cited, ordered by record id
+        for paper_record_id in range(len(self.__paper_storage_mapping)):
+            paper_record = self.__record_cache.peek(paper_record_id)
+            if paper_record is None:
+                paper_record = self.__get_record_from_storage(paper_record_id)
+
+            yield paper_record[PaperInfoManager.PUBLICATION_YEAR_KEY_NAME]
+
+    def iterate_total_citation_counts(self):
+        # yield total citation count of every record, ordered by record id
+        for citation_info in self.iterate_citation_histories():
+            yield sum(citation_info.values())
+
+    def prepare_stored_cache(self, generation=None):
+        # write back every modified record, cached records stay in cache as clean
         print('storing all cache')
-        for i in range(self.__working_storage_file_index + 1):
-            self.__store_full_file(i)
-        # self.__clean_cache(clean_factor=1.0)
+        dirty_records = self.__record_cache.pop_dirty_records()
+        print('storing {num_records} modified records'.format(num_records=len(dirty_records)))
+        self.__flush_records_to_storage(dirty_records)
 
-        # store mapping
-        self.__store_name_mapping()
+        # stored cache is a durability point in all modes
+        self.__commit_storage()
+        self.__compact_storage()
 
-    def __store_name_mapping(self):
-        # convert name mapping to json string
-        mapping_as_string = json.dumps(self.__paper_storage_mapping)
+        # write mapping next to the stored one, returns the files to commit
+        self.__paper_storage_mapping.write(get_temporary_file_path(PaperInfoManager.MAPPING_FILE_PATH, generation))
+        return [PaperInfoManager.MAPPING_FILE_PATH]
 
-        # store string to file
-        with open(PaperInfoManager.MAPPING_FILE_PATH, 'wt') as output_file:
-            output_file.write(mapping_as_string)
+    def commit_stored_cache(self, pending_file_paths, generation=None):
+        commit_temporary_files(pending_file_paths, generation)
+        self.__paper_storage_mapping.load(PaperInfoManager.MAPPING_FILE_PATH)
+
+    def store_cache(self):
+        self.commit_stored_cache(self.prepare_stored_cache())
+
+    def get_storage_statistics(self):
+        # sizes in bytes, summed over opened storage files
+        storage_statistics = {'data_size': 0, 'garbage_size': 0, 'file_size': 0}
+        for storage_file in self.__storage_files.values():
+            for statistic_name, statistic_value in storage_file.get_statistics().items():
+                storage_statistics[statistic_name] += statistic_value
+        return storage_statistics
+
+    def get_cache_statistics(self):
+        cache_statistics = self.__record_cache.get_statistics()
+        cache_statistics['record_size'] = int(self.__estimated_record_size)
+        return cache_statistics
 
     def restore_stored_state(self):
-        # 1. load name mapping
+        # load name mapping- the index is mmapped, and record ids continue from its size
         print('load name mapping..')
-        with open(PaperInfoManager.MAPPING_FILE_PATH, 'rt') as name_mapping_file:
-            mapping_file_content = name_mapping_file.read()
-        # parse mapping as json
-        self.__paper_storage_mapping = json.loads(mapping_file_content)
-
-        # 2. calculate __working_storage_file_index and __records_in_current_storage_file
-        number_of_loaded_papers = len(self.__paper_storage_mapping.keys())
-        self.__working_storage_file_index = int(number_of_loaded_papers / PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE)
-        self.__records_in_current_storage_file = \
-            number_of_loaded_papers \
-            - (self.__working_storage_file_index * PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE)
-
-    def __store_full_file(self, file_index):
-        print('storing full file: index={file_index}'.format(file_index=file_index))
-
-        file_content = str()
-        for record_index in range(PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE):
-            if (record_index % 100) == 0:
-                print('record # {record_index}/{total_in_file}'
-                      .format(record_index=record_index, total_in_file=PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE))
-
-            paper_record_id = '{file_index}_{record_index}'.format(
-                file_index=file_index,
-                record_index=str(record_index).rjust(len(str(PaperInfoManager.MAX_PAPERS_IN_STORAGE_FILE)), '0')
-            )
-            if paper_record_id in self.__record_cache:
-                paper_record_string = self.__paper_record_to_record_data(self.__record_cache.pop(paper_record_id))
-                file_content += paper_record_string
-            else:
-                break
-
-        storage_file_path = PaperInfoManager.STORAGE_FILE_PATH_FORMAT.format(file_id=file_index)
-        with open(storage_file_path, 'wt') as storage_file:
-            storage_file.write(file_content)
+        self.__paper_storage_mapping = IdIndex()
+        self.__paper_storage_mapping.load(PaperInfoManager.MAPPING_FILE_PATH)
+        print('num of loaded papers: {papers_count}'.format(papers_count=len(self.__paper_storage_mapping)))
@@ -0,0 +1,282 @@
+import os
+import mmap
+import struct
+import numpy as np
+from storage_files import get_temporary_file_path, sync_file, sync_directory
+
+
+class PaperStorageFile:
+    """
+    a paper storage file holds variable-length encoded records of up to max_records consecutive record ids.
+
+    file layout: header, offset index of (data offset, data length) per record, data area.
+    a record of length 0 was never written. a record rewritten with a longer encoding is appended at the end
+    of the data area, and its previous data becomes garbage until the file is compacted.
+    the header is updated only when the file is flushed, after the index and data pages it accounts for were
+    synced- a header on disk never points below data that a stored index entry refers to.
+    a read-only storage file maps an existing file for reading only, and can be shared by several processes.
+    """
+
+    FILE_FORMAT_MAGIC = b'HIPR'
+    FILE_FORMAT_VERSION = 2
+    FILE_HEADER_STRUCT = struct.Struct('<4sHHIQQ4x')
+    INDEX_ENTRY_STRUCT = struct.Struct('<QI')
+    INDEX_ENTRY_TYPE = np.dtype([('offset', '<u8'), ('length', '<u4')])
+    MIN_FILE_GROWTH = 1024 ** 2
+    COMPACTION_GARBAGE_RATIO = 0.5
+    REWRITE_MIN_UPDATED_FRACTION = 0.05
+    MAX_BLOCKS_IN_WRITE = 1024
+
+    def __init__(self, file_path, max_records, read_only=False):
+        self.__file_path = file_path
+        self.__max_records = max_records
+        self.__read_only = read_only
+        self.__data_start = \
+            PaperStorageFile.FILE_HEADER_STRUCT.size + max_records * PaperStorageFile.INDEX_ENTRY_STRUCT.size
+        self.__storage_map = None
+        self.__data_end = self.__data_start
+        self.__garbage_size = 0
+        self.__is_header_dirty = False
+
+        # open existing file, or create a new one with an empty index
+        if not os.path.exists(file_path):
+            if read_only:
+                raise Exception('paper storage file not found: {file_path}'.format(file_path=file_path))
+            with open(file_path, 'wb') as storage_file:
+                storage_file.truncate(self.__data_start + PaperStorageFile.MIN_FILE_GROWTH)
+            self.__map_file()
+            self.__is_header_dirty = True
+        else:
+            self.__map_file()
+            self.__read_header()
+
+    def __map_file(self):
+        # map the whole file- the file object can be closed once mapped
+        if self.__read_only:
+            with open(self.__file_path, 'rb') as storage_file:
+                self.__storage_map = mmap.mmap(storage_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(self.__file_path, 'r+b') as storage_file:
+                self.__storage_map = mmap.mmap(storage_file.fileno(), 0)
+
+    def __read_header(self):
+        magic, version, _, max_records, data_end, garbage_size = \
+            PaperStorageFile.FILE_HEADER_STRUCT.unpack_from(self.__storage_map, 0)
+        if magic != PaperStorageFile.FILE_FORMAT_MAGIC:
+            raise Exception('not a paper storage file: {file_path} magic={magic}'
+                            .format(file_path=self.__file_path, magic=magic))
+        if version != PaperStorageFile.FILE_FORMAT_VERSION or max_records != self.__max_records:
+            raise Exception('unsupported paper storage file: {file_path} version={version} records={records}'
+                            .format(file_path=self.__file_path, version=version, records=max_records))
+        self.__data_end = data_end
+        self.__garbage_size = garbage_size
+
+    def __write_header(self):
+        PaperStorageFile.FILE_HEADER_STRUCT.pack_into(
+            self.__storage_map, 0,
+            PaperStorageFile.FILE_FORMAT_MAGIC, PaperStorageFile.FILE_FORMAT_VERSION, 0,
+            self.__max_records, self.__data_end, self.__garbage_size
+        )
+
+    def __commit_header(self):
+        # must follow the sync of the index and data pages written since the last commit
+        if not self.__is_header_dirty:
+            return
+        self.__write_header()
+        self.__storage_map.flush(0, PaperStorageFile.FILE_HEADER_STRUCT.size)
+        self.__is_header_dirty = False
+
+    def __get_index_entry_offset(self, record_index):
+        return PaperStorageFile.FILE_HEADER_STRUCT.size + record_index * PaperStorageFile.INDEX_ENTRY_STRUCT.size
+
+    def __get_index_entry(self, record_index):
+        return PaperStorageFile.INDEX_ENTRY_STRUCT.unpack_from(
+            self.__storage_map, self.__get_index_entry_offset(record_index)
+        )
+
+    def __set_index_entry(self, record_index, data_offset, data_length):
+        PaperStorageFile.INDEX_ENTRY_STRUCT.pack_into(
+            self.__storage_map, self.__get_index_entry_offset(record_index), data_offset, data_length
+        )
+
+    def __reserve_data(self, data_length):
+        # make room at the end of the data area, the file grows by a quarter of its size at least
+        file_size = len(self.__storage_map)
+        if self.__data_end + data_length > file_size:
+            self.__storage_map.resize(max(
+                self.__data_end + data_length, file_size + max(PaperStorageFile.MIN_FILE_GROWTH, file_size // 4)
+            ))
+
+        data_offset = self.__data_end
+        self.__data_end += data_length
+        return data_offset
+
+    def read_record(self, record_index):
+        data_offset, data_length = self.__get_index_entry(record_index)
+        return self.__storage_map[data_offset:data_offset + data_length]
+
+    def write_record(self, record_index, record_data):
+        data_offset, data_length = self.__get_index_entry(record_index)
+
+        # overwrite in place if the new data fits, otherwise append it.
+        # an entry past the data end was written after the last header commit, and is rewritten by a rollback
+        # after a crash- appends may already have reused its data, so it is appended too
+        if data_offset + data_length > self.__data_end:
+            data_offset = self.__reserve_data(len(record_data))
+        elif len(record_data) > data_length:
+            self.__garbage_size += data_length
+            data_offset = self.__reserve_data(len(record_data))
+        else:
+            self.__garbage_size += data_length - len(record_data)
+
+        self.__storage_map[data_offset:data_offset + len(record_data)] = record_data
+        self.__set_index_entry(record_index, data_offset, len(record_data))
+        self.__is_header_dirty = True
+
+    def append_records(self, first_record_index, records_data):
+        # write consecutive records with one sequential write, records must not have been written before
+        data_offset = self.__reserve_data(sum(len(record_data) for record_data in records_data))
+        self.__storage_map[data_offset:self.__data_end] = b''.join(records_data)
+
+        index_entries = list()
+        for record_data in records_data:
+            index_entries.append(PaperStorageFile.INDEX_ENTRY_STRUCT.pack(data_offset, len(record_data)))
+            data_offset += len(record_data)
+        index_start = self.__get_index_entry_offset(first_record_index)
+        self.__storage_map[index_start:index_start + len(records_data) * PaperStorageFile.INDEX_ENTRY_STRUCT.size] = \
+            b''.join(index_entries)
+        self.__is_header_dirty = True
+
+    def flush(self):
+        self.__storage_map.flush()
+        self.__commit_header()
+
+    def flush_record(self, record_index):
+        # msync only the pages holding record's data and its index entry, then the header
+        data_offset, data_length = self.__get_index_entry(record_index)
+        for range_start, range_length in (
+                (data_offset, data_length),
+                (self.__get_index_entry_offset(record_index), PaperStorageFile.INDEX_ENTRY_STRUCT.size)):
+            flush_offset = range_start - (range_start % mmap.PAGESIZE)
+            self.__storage_map.flush(flush_offset, range_start + range_length - flush_offset)
+        self.__commit_header()
+
+    def write_records(self, updated_records):
+        # updated_records is {record index: record data}. many updates are merged into one rewrite of the file
+        if self.needs_compaction() or \
+                len(updated_records) >= PaperStorageFile.REWRITE_MIN_UPDATED_FRACTION * self.__max_records:
+            self.rewrite(updated_records)
+            return
+
+        for record_index, record_data in sorted(updated_records.items()):
+            self.write_record(record_index, record_data)
+
+    def needs_compaction(self):
+        return self.__garbage_size > \
+            PaperStorageFile.COMPACTION_GARBAGE_RATIO * (self.__data_end - self.__data_start)
+
+    def compact(self):
+        # a rewrite without updates leaves no garbage
+        return self.rewrite(dict())
+
+    def rewrite(self, updated_records):
+        """
+        write all records to a new file in record order, in a single pass- updated_records {record index: data}
+        replace stored records. stored records that are back to back are copied as one block, and blocks
+        are written with vectored writes. the new file replaces the current one atomically.
+        returns the garbage size of the current file.
+        """
+        rewritten_file_path = get_temporary_file_path(self.__file_path)
+        storage_view = memoryview(self.__storage_map)
+        index_entries, data_size, data_blocks = self.__build_rewrite_blocks(storage_view, updated_records)
+        with open(rewritten_file_path, 'wb') as rewritten_file:
+            data_end = self.__data_start + data_size
+            rewritten_file.write(PaperStorageFile.FILE_HEADER_STRUCT.pack(
+                PaperStorageFile.FILE_FORMAT_MAGIC, PaperStorageFile.FILE_FORMAT_VERSION, 0,
+                self.__max_records, data_end, 0
+            ))
+            rewritten_file.write(index_entries.tobytes())
+            rewritten_file.flush()
+
+            for block_start in range(0, len(data_blocks), PaperStorageFile.MAX_BLOCKS_IN_WRITE):
+                block_group = data_blocks[block_start:block_start + PaperStorageFile.MAX_BLOCKS_IN_WRITE]
+                # writev is posix only, elsewhere the group is joined into a single write
+                if hasattr(os, 'writev'):
+                    written_size = os.writev(rewritten_file.fileno(), block_group)
+                else:
+                    written_size = os.write(rewritten_file.fileno(), b''.join(block_group))
+                if written_size != sum(len(data_block) for data_block in block_group):
+                    raise Exception('short write to paper storage file: {file_path}'
+                                    .format(file_path=rewritten_file_path))
+
+            # blocks are views of the mapped file, they must be released before it is closed
+            data_blocks = block_group = None
+            storage_view.release()
+
+            rewritten_file.truncate(data_end + PaperStorageFile.MIN_FILE_GROWTH)
+            sync_file(rewritten_file)
+
+        previous_garbage_size = self.__garbage_size
+        self.__storage_map.close()
+        os.replace(rewritten_file_path, self.__file_path)
+        sync_directory(os.path.dirname(self.__file_path))
+        self.__map_file()
+        self.__read_header()
+        self.__is_header_dirty = False
+        return previous_garbage_size
+
+    def __build_rewrite_blocks(self, storage_view, updated_records):
+        # returns new index entries, data size and the data blocks to write in order
+        index_entries = np.frombuffer(
+            self.__storage_map, dtype=PaperStorageFile.INDEX_ENTRY_TYPE,
+            count=self.__max_records, offset=PaperStorageFile.FILE_HEADER_STRUCT.size
+        ).copy()
+        stored_offsets = index_entries['offset'].astype(np.int64)
+        stored_lengths = index_entries['length'].astype(np.int64)
+
+        updated_indices = np.array(sorted(updated_records.keys()), dtype=np.int64)
+        is_updated = np.zeros(self.__max_records, dtype=bool)
+        is_updated[updated_indices] = True
+        record_lengths = stored_lengths.copy()
+        record_lengths[updated_indices] = \
+            [len(updated_records[record_index]) for record_index in updated_indices.tolist()]
+
+        # records are laid out back to back in record order
+        record_ends = np.cumsum(record_lengths)
+        index_entries['offset'] = self.__data_start + record_ends - record_lengths
+        index_entries['length'] = record_lengths
+
+        # split records with data to blocks- an updated record, or stored records that are back to back
+        data_records = np.flatnonzero(record_lengths > 0)
+        data_records_updated = is_updated[data_records]
+        data_records_offsets = stored_offsets[data_records]
+        data_records_ends = data_records_offsets + stored_lengths[data_records]
+        is_block_start = np.ones(len(data_records), dtype=bool)
+        is_block_start[1:] = data_records_updated[1:] | data_records_updated[:-1] | \
+            (data_records_offsets[1:] != data_records_ends[:-1])
+        block_starts = np.flatnonzero(is_block_start).tolist()
+        block_ends = block_starts[1:] + [len(data_records)]
+
+        data_blocks = list()
+        for block_start, block_end in zip(block_starts, block_ends):
+            if data_records_updated[block_start]:
+                data_blocks.append(updated_records[int(data_records[block_start])])
+            else:
+                data_blocks.append(
+                    storage_view[data_records_offsets[block_start]:data_records_ends[block_end - 1]]
+                )
+
+        return index_entries, int(record_ends[-1]) if self.__max_records > 0 else 0, data_blocks
+
+    def get_statistics(self):
+        return {
+            'data_size': self.__data_end - self.__data_start,
+            'garbage_size': self.__garbage_size,
+            'file_size': len(self.__storage_map)
+        }
+
+    def close(self):
+        # a file closed without a flush would be reopened with a header that misses its last writes
+        if self.__is_header_dirty:
+            self.flush()
+        self.__storage_map.close()
@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import zlib
+import argparse
+import multiprocessing
+from itertools import islice
+import numpy as np
+from author_info_manager import AuthorInfoManager
+from paper_info_manager import PaperInfoManager
+from h_index_engine import HIndexEngine, compute_h_indices, load_author_papers
+from checkpoint_manager import CheckpointManager
+from storage_files import write_file_atomically
+from metrics_registry import MetricsRegistry, get_metrics_registry, set_metrics_registry
+from dataset_parser import \
+    PAPER_ID_FIELD_NAME, AUTHOR_LIST_FIELD_NAME, PAPER_YEAR_FIELD_NAME, REFERENCES_FIELD_NAME, \
+    parse_paper_line, build_failed_line, open_dataset_file, load_json
+
+
+# partitioned ingestion- papers are assigned to partitions by crc32 of their id, each partition stands for a node.
+# 1. ingest (per partition): scan all dataset files, keep publication year, citations and authors of owned papers
+#    only, in the partition's own storage directory. then write, for every author of an owned paper, citation
+#    counts of the author's owned papers to the exchange file of the author's partition (crc32 of author id).
+# 2. reduce (per partition): combine citation counts of the partition's authors from all exchange files,
+#    and write their h-indices.
+# 3. merge (coordinator): combine h-indices of all partitions into storage/h_index.json.
+#    it is the only file written to storage/, there is no author or paper info there for the query server.
+# steps exchange data only through files under the partitions directory, so partitions can run on separate
+# machines sharing it. run_partitioned runs all steps with a local process per partition.
+
+PARTITIONS_DIRECTORY_PATH = r'partitions'
+PARTITION_DIRECTORY_NAME_FORMAT = 'partition_{partition_index}'
+EXCHANGE_FILE_NAME_FORMAT = 'authors_{source_partition}_to_{target_partition}.jsonl'
+H_INDEX_FILE_NAME_FORMAT = 'h_index_{partition_index}.json'
+PAPER_BATCH_SIZE = 1000
+
+
+def get_partition_index(key, number_of_partitions):
+    # stable across processes and machines, unlike hash()
+    return zlib.crc32(key.encode('utf-8')) % number_of_partitions
+
+
+def get_partition_directory_path(partitions_directory_path, partition_index):
+    return os.path.join(
+        partitions_directory_path, PARTITION_DIRECTORY_NAME_FORMAT.format(partition_index=partition_index)
+    )
+
+
+def get_exchange_file_path(partitions_directory_path, source_partition, target_partition):
+    return os.path.join(partitions_directory_path, EXCHANGE_FILE_NAME_FORMAT.format(
+        source_partition=source_partition, target_partition=target_partition
+    ))
+
+
+def get_h_index_file_path(partitions_directory_path, partition_index):
+    return os.path.join(
+        partitions_directory_path, H_INDEX_FILE_NAME_FORMAT.format(partition_index=partition_index)
+    )
+
+
+def apply_partition_papers(dataset_file_path, parsed_papers, partition_index, number_of_partitions,
+                           author_info_manager, paper_info_manager):
+    """
+    add owned papers of a batch, with the citations they got from all papers of the batch.
+    parsed_papers is a list of (line index, paper attributes), as in the sequential path.
+    a line that fails is a failed line of every partition it reaches, it does not fail the batch.
+    returns failed lines.
+    """
+    failed_lines = list()
+    owned_papers = list()
+    owned_paper_authors = list()
+    citations = dict()
+    for line_index, paper_attributes in parsed_papers:
+        # the paper and its citations are taken only once all of them are read
+        try:
+            paper_id = paper_attributes[PAPER_ID_FIELD_NAME]
+            paper_year = str(paper_attributes[PAPER_YEAR_FIELD_NAME])
+            is_owned_paper = get_partition_index(paper_id, number_of_partitions) == partition_index
+            owned_paper_author_list = list(set(paper_attributes[AUTHOR_LIST_FIELD_NAME])) if is_owned_paper else None
+            owned_references = [
+                referenced_paper_id for referenced_paper_id in paper_attributes[REFERENCES_FIELD_NAME]
+                if get_partition_index(referenced_paper_id, number_of_partitions) == partition_index
+            ]
+        except Exception as ex:
+            failed_lines.append(build_failed_line(dataset_file_path, line_index, None, ex))
+            continue
+
+        if is_owned_paper:
+            owned_papers.append((paper_id, paper_year, list()))
+            owned_paper_authors.append((line_index, owned_paper_author_list))
+        for referenced_paper_id in owned_references:
+            citation_key = (referenced_paper_id, paper_year)
+            citations[citation_key] = citations.get(citation_key, 0) + 1
+
+    paper_record_ids, failed_papers = paper_info_manager.add_papers(owned_papers)
+    for paper_index, ex in failed_papers:
+        failed_lines.append(build_failed_line(dataset_file_path, owned_paper_authors[paper_index][0], None, ex))
+    for (referenced_paper_id, citation_year), citations_count in citations.items():
+        paper_info_manager.add_citation(referenced_paper_id, citation_year, citations_count)
+    for paper_record_id, (line_index, author_list) in zip(paper_record_ids, owned_paper_authors):
+        if paper_record_id is None:
+            continue
+        try:
+            author_info_manager.add_paper_authors(paper_record_id, author_list)
+        except Exception as ex:
+            failed_lines.append(build_failed_line(dataset_file_path, line_index, None, ex))
+
+    return failed_lines
+
+
+def ingest_partition_file(dataset_file_info, partition_index, number_of_partitions, author_info_manager,
+                          paper_info_manager, checkpoint_manager):
+    dataset_file_path, first_line, start_position = dataset_file_info
+    failed_lines = list()
+    metrics_registry = get_metrics_registry()
+
+    dataset_file, line_index = open_dataset_file(dataset_file_path, first_line, start_position)
+    with dataset_file:
+        while True:
+            file_lines = list(islice(dataset_file, PAPER_BATCH_SIZE))
+            if len(file_lines) == 0:
+                break
+
+            parsed_papers = list()
+            for file_line in file_lines:
+                try:
+                    paper_attributes = parse_paper_line(file_line, line_index)
+                    if paper_attributes is None:
+                        metrics_registry.increment('skipped_lines')
+                    else:
+                        parsed_papers.append((line_index, paper_attributes))
+
+                except Exception as ex:
+                    failed_lines.append(build_failed_line(dataset_file_path, line_index, file_line, ex))
+
+                line_index += 1
+            metrics_registry.increment('lines_parsed', len(file_lines))
+
+            with metrics_registry.time_stage('apply'):
+                failed_lines += apply_partition_papers(
+                    dataset_file_path, parsed_papers, partition_index, number_of_partitions, author_info_manager,
+                    paper_info_manager
+                )
+            checkpoint_manager.on_lines_processed(dataset_file_path, dataset_file.tell(), line_index, len(file_lines))
+            metrics_registry.report_progress()
+
+    return failed_lines
+
+
+def export_author_citations(partitions_directory_path, partition_index, number_of_partitions,
+                            author_info_manager, paper_info_manager):
+    """
+    write citation counts of each author's owned papers to the exchange file of the author's partition.
+    uncited papers do not affect the h-index, so only authors are listed for them.
+    """
+    citation_counts = np.fromiter(
+        paper_info_manager.iterate_total_citation_counts(), dtype=np.int64,
+        count=paper_info_manager.get_number_of_records()
+    )
+    author_offsets, paper_indices = load_author_papers(author_info_manager)
+    author_citations = citation_counts[paper_indices]
+
+    exchange_lines = [list() for _ in range(number_of_partitions)]
+    for author_index in range(author_info_manager.get_number_of_authors()):
+        author_id = author_info_manager.get_author_id(author_index)
+        paper_citations = author_citations[author_offsets[author_index]:author_offsets[author_index + 1]]
+        exchange_lines[get_partition_index(author_id, number_of_partitions)].append(
+            json.dumps([author_id, paper_citations[paper_citations > 0].tolist()])
+        )
+
+    for target_partition, target_lines in enumerate(exchange_lines):
+        write_file_atomically(
+            get_exchange_file_path(partitions_directory_path, partition_index, target_partition),
+            ''.join(exchange_line + '\n' for exchange_line in target_lines).encode('utf-8')
+        )
+
+
+def ingest_partition(partition_index, number_of_partitions, db_file_info_list, partitions_directory_path,
+                     should_load_state=False, memory_budget=None,
+                     metrics_snapshot_interval=MetricsRegistry.DEFAULT_SNAPSHOT_INTERVAL_SECONDS,
+                     checkpoint_interval=CheckpointManager.DEFAULT_CHECKPOINT_INTERVAL):
+    """
+    ingest step of one partition. the partition's storage is in its own directory, it is checkpointed
+    like the storage of the sequential path, and may be resumed with should_load_state.
+    db_file_info_list is a list of [file path, first line].
+    """
+    # storage paths are relative, managers work in the partition directory
+    partitions_directory_path = os.path.abspath(partitions_directory_path)
+    db_file_info_list = [[os.path.abspath(file_path), first_line] for file_path, first_line in db_file_info_list]
+    partition_directory_path = get_partition_directory_path(partitions_directory_path, partition_index)
+    os.makedirs(os.path.join(partition_directory_path, 'storage'), exist_ok=True)
+    os.chdir(partition_directory_path)
+
+    set_metrics_registry(MetricsRegistry(snapshot_interval=metrics_snapshot_interval))
+    if memory_budget is None:
+        author_info_manager = AuthorInfoManager()
+        paper_info_manager = PaperInfoManager()
+    else:
+        author_info_manager = AuthorInfoManager(memory_budget=memory_budget // 3)
+        paper_info_manager = PaperInfoManager(cache_memory_budget=memory_budget - memory_budget // 3)
+    checkpoint_manager = CheckpointManager(author_info_manager, paper_info_manager, checkpoint_interval)
+
+    if should_load_state:
+        checkpoint_manager.recover()
+        author_info_manager.load_author_info()
+        paper_info_manager.restore_stored_state()
+    checkpoint_manager.start()
+
+    failed_lines = list()
+    for dataset_file_path, first_line in db_file_info_list:
+        print('partition {partition_index}: processing file: {file_path}'
+              .format(partition_index=partition_index, file_path=dataset_file_path))
+        failed_lines += ingest_partition_file(
+            [dataset_file_path, first_line, checkpoint_manager.get_file_position(dataset_file_path)],
+            partition_index, number_of_partitions, author_info_manager, paper_info_manager, checkpoint_manager
+        )
+
+    checkpoint_manager.write_checkpoint()
+    export_author_citations(
+        partitions_directory_path, partition_index, number_of_partitions, author_info_manager, paper_info_manager
+    )
+    print('partition {partition_index}: {num_papers} paper records, {num_authors} authors, {num_lines} failed lines'
+          .format(partition_index=partition_index, num_papers=paper_info_manager.get_number_of_records(),
+                  num_authors=author_info_manager.get_number_of_authors(), num_lines=len(failed_lines)))
+    get_metrics_registry().close()
+
+
+def reduce_partition(partition_index, number_of_partitions, partitions_directory_path):
+    # h-index of the partition's authors, from citation counts exported by all partitions
+    author_citations = dict()
+    for source_partition in range(number_of_partitions):
+        exchange_file_path = get_exchange_file_path(partitions_directory_path, source_partition, partition_index)
+        if not os.path.exists(exchange_file_path):
+            raise Exception('exchange file not found, partition {source_partition} did not finish ingest: {file_path}'
+                            .format(source_partition=source_partition, file_path=exchange_file_path))
+        with open(exchange_file_path, 'rb') as exchange_file:
+            for exchange_line in exchange_file:
+                author_id, paper_citations = load_json(exchange_line)
+                author_paper_citations = author_citations.get(author_id)
+                if author_paper_citations is None:
+                    author_citations[author_id] = paper_citations
+                else:
+                    author_paper_citations.extend(paper_citations)
+
+    author_ids = list(author_citations.keys())
+    author_offsets = np.zeros(len(author_ids) + 1, dtype=np.int64)
+    np.cumsum([len(author_citations[author_id]) for author_id in author_ids], out=author_offsets[1:])
+    citation_counts = np.fromiter(
+        (citation_count for author_id in author_ids for citation_count in author_citations[author_id]),
+        dtype=np.int64, count=int(author_offsets[-1])
+    )
+    h_indices = compute_h_indices(citation_counts, author_offsets, np.arange(len(citation_counts)))
+
+    write_file_atomically(
+        get_h_index_file_path(partitions_directory_path, partition_index),
+        json.dumps(dict(zip(author_ids, h_indices.tolist()))).encode('utf-8')
+    )
+    print('partition {partition_index}: h-index of {num_authors} authors'
+          .format(partition_index=partition_index, num_authors=len(author_ids)))
+
+
+def merge_partitions(number_of_partitions, partitions_directory_path,
+                     h_index_file_path=HIndexEngine.H_INDEX_STORAGE_FILE_PATH):
+    # authors are disjoint between partitions
+    h_indices = dict()
+    for partition_index in range(number_of_partitions):
+        with open(get_h_index_file_path(partitions_directory_path, partition_index), 'rb') as h_index_file:
+            h_indices.update(load_json(h_index_file.read()))
+
+    with open(h_index_file_path, 'wt') as storage_file:
+        storage_file.write(json.dumps(h_indices))
+    print('merged h-index of {num_authors} authors from {num_partitions} partitions'
+          .format(num_authors=len(h_indices), num_partitions=number_of_partitions))
+
+
+def run_partition_processes(target, arguments_list):
+    # a step is complete only when every partition finished it successfully
+    partition_processes = [multiprocessing.Process(target=target, args=arguments) for arguments in arguments_list]
+    for partition_process in partition_processes:
+        partition_process.start()
+    for partition_process in partition_processes:
+        partition_process.join()
+
+    failed_partitions = [
+        partition_index for partition_index, partition_process in enumerate(partition_processes)
+        if partition_process.exitcode != 0
+    ]
+    if len(failed_partitions) > 0:
+        raise Exception('partitions failed: {partitions}'.format(partitions=failed_partitions))
+
+
+def run_partitioned(db_file_info_list, number_of_partitions, partitions_directory_path=PARTITIONS_DIRECTORY_PATH,
+                    should_load_state=False, memory_budget=None,
+                    metrics_snapshot_interval=MetricsRegistry.DEFAULT_SNAPSHOT_INTERVAL_SECONDS,
+                    checkpoint_interval=CheckpointManager.DEFAULT_CHECKPOINT_INTERVAL):
+    # all steps with a local process per partition, memory budget is shared by the partitions
+    start_time = time.time()
+    os.makedirs(partitions_directory_path, exist_ok=True)
+    partition_memory_budget = None if memory_budget is None else memory_budget // number_of_partitions
+
+    print('ingest {num_partitions} partitions'.format(num_partitions=number_of_partitions))
+    run_partition_processes(ingest_partition, [
+        (partition_index, number_of_partitions, db_file_info_list, partitions_directory_path, should_load_state,
+         partition_memory_budget, metrics_snapshot_interval, checkpoint_interval)
+        for partition_index in range(number_of_partitions)
+    ])
+
+    print('reduce {num_partitions} partitions'.format(num_partitions=number_of_partitions))
+    run_partition_processes(reduce_partition, [
+        (partition_index, number_of_partitions, partitions_directory_path)
+        for partition_index in range(number_of_partitions)
+    ])
+
+    merge_partitions(number_of_partitions, partitions_directory_path)
+    print('partitioned ingestion took {seconds:.2f} seconds'.format(seconds=time.time() - start_time))
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='partitioned ingestion, a step at a time or all locally')
+    argument_parser.add_argument('step', choices=['ingest', 'reduce', 'merge', 'run'])
+    argument_parser.add_argument('dataset_files', nargs='*')
+    argument_parser.add_argument('--partitions', type=int, required=True)
+    argument_parser.add_argument('--partition', type=int, help='partition index of the ingest and reduce steps')
+    argument_parser.add_argument('--directory', default=PARTITIONS_DIRECTORY_PATH)
+    argument_parser.add_argument('--load-state', action='store_true')
+    arguments = argument_parser.parse_intermixed_args()
+    dataset_file_info_list = [[dataset_file_path, 0] for dataset_file_path in arguments.dataset_files]
+
+    if arguments.step in ('ingest', 'reduce') and arguments.partition is None:
+        argument_parser.error('--partition is required by the {step} step'.format(step=arguments.step))
+    if arguments.step == 'ingest':
+        ingest_partition(arguments.partition, arguments.partitions, dataset_file_info_list, arguments.directory,
+                         arguments.load_state)
+    elif arguments.step == 'reduce':
+        reduce_partition(arguments.partition, arguments.partitions, arguments.directory)
+    elif arguments.step == 'merge':
+        merge_partitions(arguments.partitions, arguments.directory)
+    else:
+        run_partitioned(dataset_file_info_list, arguments.partitions, arguments.directory, arguments.load_state)
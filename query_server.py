@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from urllib.parse import unquote, urlsplit, parse_qs
+import numpy as np
+from record_cache import RecordCache
+from author_info_manager import AuthorInfoManager
+from paper_info_manager import PaperInfoManager
+from h_index_engine import compute_h_indices
+from author_leaderboard import AuthorLeaderboard
+from metrics_registry import get_metrics_registry
+
+
+class QueryServer:
+    """
+    read-only http query service over the author and paper info stored in storage/.
+    stores are mmapped read-only, so the worker processes of a server share them through the page cache.
+    GET endpoints, with json responses:
+        /authors/{author id}/h_index
+        /authors/{author id}/citations      citations per year, summed over the author's papers
+        /authors/{author id}/co_authors
+        /papers/{paper id}/citations        citations per year
+        /leaderboard/{h_index or citations}?k=100&since=2010        top k authors, optionally active since a year
+        /leaderboard/{h_index or citations}?author={author id}&since=2010        rank of the author
+    queries that arrive within a short window are answered together- each paper record is read once per batch,
+    and the h-indices of a batch are computed at once. responses are kept in an LRU result cache.
+    storage must not be written while the server is running. storage of a partitioned ingestion holds only the
+    merged h-indices, it can not be served.
+    """
+
+    DEFAULT_HOST = '127.0.0.1'
+    DEFAULT_PORT = 8080
+    DEFAULT_RESULT_CACHE_SIZE = 100000
+    PAPER_CACHE_MEMORY_BUDGET = 256 * 1024 ** 2
+    MAX_BATCH_SIZE = 256
+    BATCH_WINDOW_SECONDS = 0.0005
+
+    AUTHORS_PATH_NAME = 'authors'
+    PAPERS_PATH_NAME = 'papers'
+    H_INDEX_QUERY_NAME = 'h_index'
+    CITATIONS_QUERY_NAME = 'citations'
+    CO_AUTHORS_QUERY_NAME = 'co_authors'
+    AUTHOR_QUERY_NAMES = frozenset([H_INDEX_QUERY_NAME, CITATIONS_QUERY_NAME, CO_AUTHORS_QUERY_NAME])
+    PAPER_QUERY_NAMES = frozenset([CITATIONS_QUERY_NAME])
+    LEADERBOARD_PATH_NAME = 'leaderboard'
+    DEFAULT_LEADERBOARD_SIZE = 100
+    MAX_LEADERBOARD_SIZE = 10000
+
+    HTTP_STATUS_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                           500: 'Internal Server Error'}
+
+    def __init__(self, result_cache_size=DEFAULT_RESULT_CACHE_SIZE):
+        if not os.path.exists(AuthorInfoManager.AUTHOR_INDEX_FILE_PATH):
+            raise Exception('author info not found in storage, storage of a partitioned ingestion can not be served: '
+                            '{file_path}'.format(file_path=AuthorInfoManager.AUTHOR_INDEX_FILE_PATH))
+        self.__author_info_manager = AuthorInfoManager()
+        self.__author_info_manager.load_author_info()
+        self.__paper_info_manager = PaperInfoManager(
+            cache_memory_budget=QueryServer.PAPER_CACHE_MEMORY_BUDGET, read_only=True
+        )
+        self.__paper_info_manager.restore_stored_state()
+        self.__author_leaderboard = None
+        if os.path.exists(AuthorLeaderboard.INFO_FILE_PATH):
+            self.__author_leaderboard = AuthorLeaderboard()
+            self.__author_leaderboard.load()
+            # authors added after the leaderboard was stored are not ranked, their queries get 404
+            if self.__author_leaderboard.get_number_of_authors() != self.__author_info_manager.get_number_of_authors():
+                print('Warning: author leaderboard has {num_ranked} authors, author info has {num_authors}'.format(
+                    num_ranked=self.__author_leaderboard.get_number_of_authors(),
+                    num_authors=self.__author_info_manager.get_number_of_authors()
+                ))
+
+        # result cache maps query key to (status, response body)
+        self.__result_cache = RecordCache(result_cache_size)
+        self.__pending_queries = list()
+        self.__batch_timer = None
+        self.__metrics = get_metrics_registry()
+
+    @staticmethod
+    def __parse_query_key(request_target):
+        # returns (path name, query name, entity id), or None for an unknown path
+        path_parts = request_target.split('?', 1)[0].strip('/').split('/')
+        if len(path_parts) != 3:
+            return None
+
+        path_name, entity_id, query_name = path_parts[0], unquote(path_parts[1]), path_parts[2]
+        if (path_name == QueryServer.AUTHORS_PATH_NAME and query_name in QueryServer.AUTHOR_QUERY_NAMES) or \
+                (path_name == QueryServer.PAPERS_PATH_NAME and query_name in QueryServer.PAPER_QUERY_NAMES):
+            return path_name, query_name, entity_id
+        return None
+
+    @staticmethod
+    def __build_response(status, response_data):
+        return status, json.dumps(response_data).encode()
+
+    @staticmethod
+    def __format_citation_history(citation_history):
+        return {str(citation_year): citation_history[citation_year] for citation_year in sorted(citation_history)}
+
+    def __answer_author_h_indices(self, author_queries):
+        # author_queries is a list of (query key, author id, author index), all h-indices are computed at once
+        author_papers = [
+            self.__author_info_manager.get_stored_author(author_index)[0] for _, _, author_index in author_queries
+        ]
+        author_offsets = np.zeros(len(author_papers) + 1, dtype=np.int64)
+        np.cumsum([len(papers) for papers in author_papers], out=author_offsets[1:])
+        all_author_papers = np.concatenate(author_papers) if len(author_papers) > 0 else np.empty(0, dtype=np.int64)
+
+        # papers are read once, in record id order
+        unique_papers, paper_positions = np.unique(all_author_papers, return_inverse=True)
+        citation_counts = np.array(
+            [self.__paper_info_manager.get_total_citation_count(paper_record_id)
+             for paper_record_id in unique_papers.tolist()],
+            dtype=np.int64
+        )
+        h_indices = compute_h_indices(citation_counts, author_offsets, paper_positions).tolist()
+
+        return {
+            query_key: QueryServer.__build_response(200, {
+                'author': author_id, 'h_index': h_index, 'papers': len(papers)
+            })
+            for (query_key, author_id, _), h_index, papers in zip(author_queries, h_indices, author_papers)
+        }
+
+    def __answer_author_citations(self, author_id, author_index, citation_histories):
+        # citation_histories caches histories of papers read in the current batch
+        author_citation_history = dict()
+        for paper_record_id in self.__author_info_manager.get_stored_author(author_index)[0].tolist():
+            citation_history = citation_histories.get(paper_record_id)
+            if citation_history is None:
+                citation_history = self.__paper_info_manager.get_citation_history(paper_record_id)
+                citation_histories[paper_record_id] = citation_history
+            for citation_year, citation_count in citation_history.items():
+                author_citation_history[int(citation_year)] = \
+                    author_citation_history.get(int(citation_year), 0) + citation_count
+
+        return QueryServer.__build_response(200, {
+            'author': author_id,
+            'citations': QueryServer.__format_citation_history(author_citation_history),
+            'total_citations': sum(author_citation_history.values())
+        })
+
+    def __answer_author_co_authors(self, author_id, author_index):
+        co_author_indices = self.__author_info_manager.get_stored_author(author_index)[1].tolist()
+        return QueryServer.__build_response(200, {
+            'author': author_id,
+            'co_authors': [self.__author_info_manager.get_author_id(co_author_index)
+                           for co_author_index in co_author_indices]
+        })
+
+    def __answer_paper_citations(self, paper_id, citation_histories):
+        paper_record_id = self.__paper_info_manager.get_paper_record_id(paper_id)
+        if paper_record_id is None:
+            return QueryServer.__build_response(404, {'error': 'unknown paper: {paper_id}'.format(paper_id=paper_id)})
+
+        citation_history = citation_histories.get(paper_record_id)
+        if citation_history is None:
+            citation_history = self.__paper_info_manager.get_citation_history(paper_record_id)
+            citation_histories[paper_record_id] = citation_history
+
+        paper_citation_history = {int(citation_year): citation_count
+                                  for citation_year, citation_count in citation_history.items()}
+        return QueryServer.__build_response(200, {
+            'paper': paper_id,
+            'citations': QueryServer.__format_citation_history(paper_citation_history),
+            'total_citations': sum(paper_citation_history.values())
+        })
+
+    def __answer_queries(self, query_keys):
+        # returns {query key: (status, response body)} for unique query keys
+        query_results = dict()
+        citation_histories = dict()
+        h_index_queries = list()
+        for query_key in query_keys:
+            path_name, query_name, entity_id = query_key
+            if path_name == QueryServer.PAPERS_PATH_NAME:
+                query_results[query_key] = self.__answer_paper_citations(entity_id, citation_histories)
+                continue
+
+            author_index = self.__author_info_manager.get_author_index(entity_id)
+            if author_index is None:
+                query_results[query_key] = QueryServer.__build_response(
+                    404, {'error': 'unknown author: {author_id}'.format(author_id=entity_id)}
+                )
+            elif query_name == QueryServer.H_INDEX_QUERY_NAME:
+                h_index_queries.append((query_key, entity_id, author_index))
+            elif query_name == QueryServer.CITATIONS_QUERY_NAME:
+                query_results[query_key] = self.__answer_author_citations(entity_id, author_index, citation_histories)
+            else:
+                query_results[query_key] = self.__answer_author_co_authors(entity_id, author_index)
+
+        query_results.update(self.__answer_author_h_indices(h_index_queries))
+        return query_results
+
+    def __answer_pending_queries(self):
+        # answer the current batch, and cache its results
+        if self.__batch_timer is not None:
+            self.__batch_timer.cancel()
+            self.__batch_timer = None
+        pending_queries = self.__pending_queries
+        self.__pending_queries = list()
+
+        start_time = time.perf_counter()
+        try:
+            query_results = self.__answer_queries(set(query_key for query_key, _ in pending_queries))
+        except Exception as ex:
+            for _, query_future in pending_queries:
+                if not query_future.done():
+                    query_future.set_exception(ex)
+            return
+
+        for query_key, query_result in query_results.items():
+            if self.__result_cache.is_full():
+                self.__result_cache.evict(1)
+            self.__result_cache.put(query_key, query_result, False)
+        for query_key, query_future in pending_queries:
+            if not query_future.done():
+                query_future.set_result(query_results[query_key])
+
+        self.__metrics.add_time('query_batch', time.perf_counter() - start_time)
+        self.__metrics.increment('query_batches')
+
+    def __answer_leaderboard_query(self, request_target):
+        # leaderboard queries take milliseconds, they are answered without batching
+        split_target = urlsplit(request_target)
+        path_parts = split_target.path.strip('/').split('/')
+        if len(path_parts) != 2 or path_parts[1] not in AuthorLeaderboard.METRICS:
+            return QueryServer.__build_response(404, {'error': 'unknown path: {path}'.format(path=request_target)})
+        if self.__author_leaderboard is None:
+            return QueryServer.__build_response(404, {'error': 'author leaderboard is not stored'})
+
+        metric = path_parts[1]
+        query_parameters = {name: values[-1] for name, values in parse_qs(split_target.query).items()}
+        try:
+            active_since_year = int(query_parameters['since']) if 'since' in query_parameters else None
+            number_of_authors = int(query_parameters.get('k', QueryServer.DEFAULT_LEADERBOARD_SIZE))
+        except ValueError:
+            return QueryServer.__build_response(400, {'error': 'k and since must be integers'})
+        if not 0 < number_of_authors <= QueryServer.MAX_LEADERBOARD_SIZE:
+            return QueryServer.__build_response(400, {
+                'error': 'k must be between 1 and {max_size}'.format(max_size=QueryServer.MAX_LEADERBOARD_SIZE)
+            })
+
+        if 'author' not in query_parameters:
+            return QueryServer.__build_response(200, {
+                'metric': metric,
+                'active_since_year': active_since_year,
+                'authors': [
+                    {'author': self.__author_info_manager.get_author_id(author_index), metric: author_value}
+                    for author_index, author_value in
+                    self.__author_leaderboard.get_top_authors(metric, number_of_authors, active_since_year)
+                ]
+            })
+
+        author_id = query_parameters['author']
+        author_index = self.__author_info_manager.get_author_index(author_id)
+        author_values = None if author_index is None else self.__author_leaderboard.get_author_values(author_index)
+        if author_values is None:
+            return QueryServer.__build_response(404, {
+                'error': 'unknown author: {author_id}'.format(author_id=author_id)
+            })
+        return QueryServer.__build_response(200, {
+            'metric': metric,
+            'active_since_year': active_since_year,
+            'author': author_id,
+            'rank': self.__author_leaderboard.get_author_rank(metric, author_index, active_since_year),
+            metric: author_values[metric]
+        })
+
+    async def __query(self, request_method, request_target):
+        # returns (status, response body)
+        if request_method != 'GET':
+            return QueryServer.__build_response(405, {'error': 'only GET is supported'})
+        if request_target.strip('/').startswith(QueryServer.LEADERBOARD_PATH_NAME + '/'):
+            self.__metrics.increment('leaderboard_queries')
+            return self.__answer_leaderboard_query(request_target)
+        query_key = QueryServer.__parse_query_key(request_target)
+        if query_key is None:
+            return QueryServer.__build_response(404, {'error': 'unknown path: {path}'.format(path=request_target)})
+
+        self.__metrics.increment('queries')
+        query_result = self.__result_cache.get(query_key)
+        if query_result is not None:
+            return query_result
+
+        # join the current batch, it is answered when full or when its window ends
+        event_loop = asyncio.get_running_loop()
+        query_future = event_loop.create_future()
+        self.__pending_queries.append((query_key, query_future))
+        if len(self.__pending_queries) >= QueryServer.MAX_BATCH_SIZE:
+            self.__answer_pending_queries()
+        elif self.__batch_timer is None:
+            self.__batch_timer = event_loop.call_later(QueryServer.BATCH_WINDOW_SECONDS, self.__answer_pending_queries)
+
+        try:
+            return await query_future
+        except Exception as ex:
+            return QueryServer.__build_response(500, {'error': str(ex)})
+
+    async def __handle_connection(self, stream_reader, stream_writer):
+        # http/1.1 with keep-alive, requests of a connection are answered in order
+        try:
+            while True:
+                try:
+                    request_head = await stream_reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+
+                request_lines = request_head.decode('latin-1').split('\r\n')
+                request_headers = dict()
+                for header_line in request_lines[1:]:
+                    if ':' in header_line:
+                        header_name, header_value = header_line.split(':', 1)
+                        request_headers[header_name.strip().lower()] = header_value.strip()
+
+                # request body is not used. without a valid length the next request can not be found,
+                # so the connection is closed after the error response
+                content_length = request_headers.get('content-length', '0')
+                is_valid_content_length = content_length.isdigit()
+                if is_valid_content_length and int(content_length) > 0:
+                    try:
+                        await stream_reader.readexactly(int(content_length))
+                    except asyncio.IncompleteReadError:
+                        break
+
+                request_parts = request_lines[0].split(' ')
+                if not is_valid_content_length:
+                    status, response_body = QueryServer.__build_response(400, {'error': 'bad content length'})
+                    http_version = 'HTTP/1.1'
+                elif len(request_parts) != 3:
+                    status, response_body = QueryServer.__build_response(400, {'error': 'bad request line'})
+                    http_version = 'HTTP/1.1'
+                else:
+                    request_method, request_target, http_version = request_parts
+                    status, response_body = await self.__query(request_method, request_target)
+
+                keep_alive = http_version == 'HTTP/1.1' and is_valid_content_length and \
+                    request_headers.get('connection', '').lower() != 'close'
+                stream_writer.write(
+                    'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {length}\r\n'
+                    'Connection: {connection}\r\n\r\n'.format(
+                        status=status, reason=QueryServer.HTTP_STATUS_REASONS[status], length=len(response_body),
+                        connection='keep-alive' if keep_alive else 'close'
+                    ).encode('latin-1') + response_body
+                )
+                await stream_writer.drain()
+                if not keep_alive:
+                    break
+
+        except ConnectionError:
+            pass
+        finally:
+            stream_writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, reuse_port=False):
+        query_server = await asyncio.start_server(self.__handle_connection, host, port, reuse_port=reuse_port)
+        print('serving queries on {host}:{port}'.format(host=host, port=port))
+        async with query_server:
+            await query_server.serve_forever()
+
+
+def run_query_server(host, port, result_cache_size, reuse_port=False):
+    # stores are opened in the serving process, so they are mapped by each worker
+    asyncio.run(QueryServer(result_cache_size).serve(host, port, reuse_port))
+
+
+def serve_queries(host=QueryServer.DEFAULT_HOST, port=QueryServer.DEFAULT_PORT, number_of_workers=1,
+                  result_cache_size=QueryServer.DEFAULT_RESULT_CACHE_SIZE):
+    # several workers listen on the same port, the kernel spreads connections between them
+    if number_of_workers == 1:
+        run_query_server(host, port, result_cache_size)
+        return
+
+    worker_processes = [
+        multiprocessing.Process(target=run_query_server, args=(host, port, result_cache_size, True))
+        for _ in range(number_of_workers)
+    ]
+    for worker_process in worker_processes:
+        worker_process.start()
+    for worker_process in worker_processes:
+        worker_process.join()
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='serve h-index and citation queries from storage/')
+    argument_parser.add_argument('--host', default=QueryServer.DEFAULT_HOST)
+    argument_parser.add_argument('--port', type=int, default=QueryServer.DEFAULT_PORT)
+    argument_parser.add_argument('--workers', type=int, default=1)
+    argument_parser.add_argument('--cache-size', type=int, default=QueryServer.DEFAULT_RESULT_CACHE_SIZE)
+    arguments = argument_parser.parse_args()
+    serve_queries(arguments.host, arguments.port, arguments.workers, arguments.cache_size)
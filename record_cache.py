@@ -0,0 +1,95 @@
+from collections import OrderedDict
+
+
+class RecordCache:
+    """
+    LRU cache of paper records with dirty tracking.
+    records are kept in access order- the least recently used record is evicted first,
+    and only records modified since they were loaded need to be written back.
+    """
+
+    HITS_KEY_NAME = 'hits'
+    MISSES_KEY_NAME = 'misses'
+    EVICTIONS_KEY_NAME = 'evictions'
+    DIRTY_EVICTIONS_KEY_NAME = 'dirty_evictions'
+    SIZE_KEY_NAME = 'size'
+    CAPACITY_KEY_NAME = 'capacity'
+
+    def __init__(self, capacity):
+        self.__capacity = capacity
+        self.__records = OrderedDict()
+        self.__dirty_keys = set()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__dirty_evictions = 0
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __contains__(self, record_id):
+        return record_id in self.__records
+
+    def get_capacity(self):
+        return self.__capacity
+
+    def set_capacity(self, capacity):
+        # a smaller capacity takes effect on the next evictions
+        self.__capacity = capacity
+
+    def is_full(self):
+        return len(self.__records) >= self.__capacity
+
+    def get(self, record_id):
+        # return cached record and mark it as most recently used, or None on miss
+        paper_record = self.__records.get(record_id)
+        if paper_record is None:
+            self.__misses += 1
+            return None
+
+        self.__hits += 1
+        self.__records.move_to_end(record_id)
+        return paper_record
+
+    def peek(self, record_id):
+        # return cached record without touching recency or statistics
+        return self.__records.get(record_id)
+
+    def put(self, record_id, paper_record, is_dirty):
+        self.__records[record_id] = paper_record
+        self.__records.move_to_end(record_id)
+        if is_dirty:
+            self.__dirty_keys.add(record_id)
+
+    def mark_dirty(self, record_id):
+        self.__dirty_keys.add(record_id)
+
+    def evict(self, records_count):
+        # pop least recently used records, returns list of (record_id, paper_record, is_dirty)
+        evicted_records = list()
+        for i in range(min(records_count, len(self.__records))):
+            record_id, paper_record = self.__records.popitem(last=False)
+            is_dirty = record_id in self.__dirty_keys
+            if is_dirty:
+                self.__dirty_keys.remove(record_id)
+                self.__dirty_evictions += 1
+            evicted_records.append((record_id, paper_record, is_dirty))
+
+        self.__evictions += len(evicted_records)
+        return evicted_records
+
+    def pop_dirty_records(self):
+        # return all dirty (record_id, paper_record) pairs, sorted by record id, and mark them clean
+        dirty_records = [(record_id, self.__records[record_id]) for record_id in sorted(self.__dirty_keys)]
+        self.__dirty_keys.clear()
+        return dirty_records
+
+    def get_statistics(self):
+        return {
+            RecordCache.HITS_KEY_NAME: self.__hits,
+            RecordCache.MISSES_KEY_NAME: self.__misses,
+            RecordCache.EVICTIONS_KEY_NAME: self.__evictions,
+            RecordCache.DIRTY_EVICTIONS_KEY_NAME: self.__dirty_evictions,
+            RecordCache.SIZE_KEY_NAME: len(self.__records),
+            RecordCache.CAPACITY_KEY_NAME: self.__capacity
+        }
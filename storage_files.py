@@ -0,0 +1,58 @@
+import os
+import time
+from metrics_registry import get_metrics_registry
+
+
+TEMPORARY_FILE_SUFFIX = '.tmp'
+GENERATION_TEMPORARY_FILE_SUFFIX_FORMAT = '.{generation}.tmp'
+
+
+def get_temporary_file_path(file_path, generation=None):
+    # files written for a checkpoint carry its generation, so leftovers of a failed checkpoint are never committed
+    if generation is None:
+        return file_path + TEMPORARY_FILE_SUFFIX
+    return file_path + GENERATION_TEMPORARY_FILE_SUFFIX_FORMAT.format(generation=generation)
+
+
+def sync_file(open_file):
+    start_time = time.perf_counter()
+    open_file.flush()
+    os.fsync(open_file.fileno())
+    get_metrics_registry().add_time('fsync', time.perf_counter() - start_time)
+
+
+def sync_directory(directory_path):
+    # a replace is durable only once the directory holding the file is synced.
+    # windows can not open a directory as a file, so the directory is not synced there
+    if os.name == 'nt':
+        return
+    start_time = time.perf_counter()
+    directory_descriptor = os.open(directory_path or '.', os.O_RDONLY)
+    try:
+        os.fsync(directory_descriptor)
+    finally:
+        os.close(directory_descriptor)
+    get_metrics_registry().add_time('fsync', time.perf_counter() - start_time)
+
+
+def write_file_atomically(file_path, data):
+    temporary_file_path = get_temporary_file_path(file_path)
+    with open(temporary_file_path, 'wb') as temporary_file:
+        temporary_file.write(data)
+        sync_file(temporary_file)
+    os.replace(temporary_file_path, file_path)
+    sync_directory(os.path.dirname(file_path))
+
+
+def commit_temporary_files(file_paths, generation=None):
+    # replace each file by its temporary version, files that were already replaced are skipped
+    replaced_directories = set()
+    for file_path in file_paths:
+        temporary_file_path = get_temporary_file_path(file_path, generation)
+        if os.path.exists(temporary_file_path):
+            os.replace(temporary_file_path, file_path)
+            replaced_directories.add(os.path.dirname(file_path))
+
+    # one directory sync for all files replaced in it
+    for directory_path in sorted(replaced_directories):
+        sync_directory(directory_path)
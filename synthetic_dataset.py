@@ -0,0 +1,115 @@
+import json
+import uuid
+import random
+
+
+class SyntheticDatasetGenerator:
+    """
+    seeded generator of dblp-ref style json lines, the same seed and scale always give the same files.
+    citations and authorship are skewed the way they are in dblp- both are drawn by preferential attachment,
+    so a few papers get most citations and a few authors write most papers (power-law tails):
+    - a reference picks an earlier paper with probability proportional to its citations so far plus one
+    - an author slot picks a new author with probability NEW_AUTHOR_PROBABILITY, otherwise an existing author
+      with probability proportional to the number of papers written so far
+    papers are generated in publication year order, a small part of references point to papers outside
+    of the dataset, like references to papers missing from the dump.
+    """
+
+    DEFAULT_SEED = 1
+    FIRST_YEAR = 1980
+    LAST_YEAR = 2017
+    MEAN_REFERENCES = 10
+    MEAN_EXTRA_AUTHORS = 2
+    NEW_AUTHOR_PROBABILITY = 0.3
+    EXTERNAL_REFERENCE_PROBABILITY = 0.05
+    NO_REFERENCES_FIELD_PROBABILITY = 0.2
+
+    def __init__(self, seed=DEFAULT_SEED):
+        self.__random = random.Random(seed)
+        self.__paper_ids = list()
+        self.__paper_indices = dict()
+        # a paper appears once, and once more for each citation it got
+        self.__citation_targets = list()
+        # an author appears once for each paper written
+        self.__author_slots = list()
+        self.__number_of_authors = 0
+
+    def __new_paper_id(self):
+        return str(uuid.UUID(int=self.__random.getrandbits(128)))
+
+    def __draw_geometric(self, mean):
+        # number of failures before a success, with the given mean
+        success_probability = 1.0 / (mean + 1)
+        value = 0
+        while self.__random.random() > success_probability:
+            value += 1
+        return value
+
+    def __draw_authors(self):
+        paper_authors = set()
+        for _ in range(1 + self.__draw_geometric(SyntheticDatasetGenerator.MEAN_EXTRA_AUTHORS)):
+            if len(self.__author_slots) == 0 or \
+                    self.__random.random() < SyntheticDatasetGenerator.NEW_AUTHOR_PROBABILITY:
+                paper_authors.add(self.__number_of_authors)
+                self.__number_of_authors += 1
+            else:
+                paper_authors.add(self.__random.choice(self.__author_slots))
+
+        self.__author_slots.extend(paper_authors)
+        return ['author {author_index}'.format(author_index=author_index) for author_index in sorted(paper_authors)]
+
+    def __draw_references(self):
+        references = set()
+        for _ in range(self.__draw_geometric(SyntheticDatasetGenerator.MEAN_REFERENCES)):
+            if len(self.__citation_targets) == 0 or \
+                    self.__random.random() < SyntheticDatasetGenerator.EXTERNAL_REFERENCE_PROBABILITY:
+                references.add(self.__new_paper_id())
+            else:
+                references.add(self.__paper_ids[self.__random.choice(self.__citation_targets)])
+        return sorted(references)
+
+    def generate_paper(self, paper_year):
+        paper_attributes = {
+            'id': self.__new_paper_id(),
+            'title': 'synthetic paper {paper_index}'.format(paper_index=len(self.__paper_ids)),
+            'authors': self.__draw_authors(),
+            'year': paper_year,
+            'venue': 'synthetic venue',
+            'n_citation': 0,
+            'abstract': ''
+        }
+        references = self.__draw_references()
+        if len(references) > 0 or self.__random.random() > SyntheticDatasetGenerator.NO_REFERENCES_FIELD_PROBABILITY:
+            paper_attributes['references'] = references
+
+        # references are taken before the paper itself can be cited
+        for referenced_paper_id in references:
+            referenced_paper_index = self.__paper_indices.get(referenced_paper_id)
+            if referenced_paper_index is not None:
+                self.__citation_targets.append(referenced_paper_index)
+        self.__paper_indices[paper_attributes['id']] = len(self.__paper_ids)
+        self.__citation_targets.append(len(self.__paper_ids))
+        self.__paper_ids.append(paper_attributes['id'])
+
+        return paper_attributes
+
+    def generate_files(self, file_path_format, number_of_papers, number_of_files=1):
+        """
+        write number_of_papers papers split evenly to number_of_files files, file paths are
+        file_path_format.format(file_id=i). returns file info list as expected by main.main.
+        """
+        db_file_info_list = list()
+        number_of_years = SyntheticDatasetGenerator.LAST_YEAR - SyntheticDatasetGenerator.FIRST_YEAR + 1
+        papers_per_year = number_of_papers / number_of_years
+        paper_index = 0
+        for file_id in range(number_of_files):
+            file_path = file_path_format.format(file_id=file_id)
+            with open(file_path, 'wt') as dataset_file:
+                file_end = (file_id + 1) * number_of_papers // number_of_files
+                while paper_index < file_end:
+                    paper_year = SyntheticDatasetGenerator.FIRST_YEAR + int(paper_index / papers_per_year)
+                    dataset_file.write(json.dumps(self.generate_paper(paper_year)) + '\n')
+                    paper_index += 1
+            db_file_info_list.append([file_path, 0])
+
+        return db_file_info_list
@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import multiprocessing
+import pytest
+
+# modules are flat at the repository root, and storage paths are relative to the working directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_dataset import SyntheticDatasetGenerator
+from paper_info_manager import PaperInfoManager
+import main
+
+NUMBER_OF_PAPERS = 3000
+NUMBER_OF_FILES = 2
+# small storage files, so records are spread over several of them
+MAX_PAPERS_IN_STORAGE_FILE = 500
+# small budgets, so paper records are evicted and author shards released while ingesting
+SMALL_MEMORY_BUDGET = 90000
+CHECKPOINT_INTERVAL = 500
+CRASH_EXIT_CODE = 17
+
+
+def compute_h_indices(db_file_info_list):
+    # recompute h-indices straight from the dataset lines, independently of the managers
+    citation_counts = dict()
+    author_papers = dict()
+    for dataset_file_path, _ in db_file_info_list:
+        with open(dataset_file_path, 'rt') as dataset_file:
+            for file_line in dataset_file:
+                paper_attributes = json.loads(file_line)
+                for referenced_paper_id in paper_attributes.get('references', list()):
+                    citation_counts[referenced_paper_id] = citation_counts.get(referenced_paper_id, 0) + 1
+                for author_id in set(paper_attributes['authors']):
+                    author_papers.setdefault(author_id, list()).append(paper_attributes['id'])
+
+    h_indices = dict()
+    for author_id, paper_ids in author_papers.items():
+        paper_citations = sorted((citation_counts.get(paper_id, 0) for paper_id in paper_ids), reverse=True)
+        h_indices[author_id] = sum(
+            1 for paper_position, citations in enumerate(paper_citations) if citations >= paper_position + 1
+        )
+    return h_indices
+
+
+def load_stored_h_indices():
+    with open('storage/h_index.json', 'rt') as h_index_file:
+        return json.load(h_index_file)
+
+
+def crash_on_call(owner_class, method_name, crash_call_index):
+    # replace the method, so the process exits at its crash_call_index-th call without cleaning up
+    original_method = getattr(owner_class, method_name)
+    number_of_calls = [0]
+
+    def crashing_method(*args, **kwargs):
+        number_of_calls[0] += 1
+        if number_of_calls[0] == crash_call_index:
+            os._exit(CRASH_EXIT_CODE)
+        return original_method(*args, **kwargs)
+
+    setattr(owner_class, method_name, crashing_method)
+
+
+def ingest_until_crash(dataset_files, owner_class, method_name, crash_call_index, main_arguments):
+    crash_on_call(owner_class, method_name, crash_call_index)
+    main.main(dataset_files, **main_arguments)
+
+
+def run_crashing_ingestion(dataset_files, owner_class, method_name, crash_call_index, main_arguments):
+    # forked, so the crash loses unflushed state like a killed process does
+    ingestion_process = multiprocessing.get_context('fork').Process(
+        target=ingest_until_crash, args=(dataset_files, owner_class, method_name, crash_call_index, main_arguments)
+    )
+    ingestion_process.start()
+    ingestion_process.join()
+    assert ingestion_process.exitcode == CRASH_EXIT_CODE
+
+
+@pytest.fixture(scope='session')
+def dataset_files(tmp_path_factory):
+    dataset_directory = tmp_path_factory.mktemp('dataset')
+    return SyntheticDatasetGenerator(SyntheticDatasetGenerator.DEFAULT_SEED).generate_files(
+        str(dataset_directory / 'dblp-ref-{file_id}.json'), NUMBER_OF_PAPERS, NUMBER_OF_FILES
+    )
+
+
+@pytest.fixture(scope='session')
+def expected_h_indices(dataset_files):
+    return compute_h_indices(dataset_files)
+
+
+@pytest.fixture
+def storage_directory(tmp_path, monkeypatch):
+    # empty working directory with a storage directory, as main expects
+    os.makedirs(tmp_path / 'storage')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(PaperInfoManager, 'MAX_PAPERS_IN_STORAGE_FILE', MAX_PAPERS_IN_STORAGE_FILE)
+    return tmp_path
@@ -0,0 +1,34 @@
+import json
+import pytest
+import main
+from author_info_manager import AuthorInfoManager
+from author_leaderboard import AuthorLeaderboard
+
+
+@pytest.mark.parametrize('main_arguments', [{}, {'bulk_build': True}], ids=['sequential', 'bulk'])
+def test_year_out_of_range_leaves_leaderboard_consistent(storage_directory, main_arguments):
+    # year 70000 does not fit the 16 bit last active year, the line is skipped before its paper or authors are added
+    dataset_file_path = str(storage_directory / 'dblp-ref-wide-year.json')
+    with open(dataset_file_path, 'wt') as dataset_file:
+        for paper_id, paper_year, author_list, references in [
+            ('x', 2000, ['author x'], []),
+            ('y', 2001, ['author y'], ['x']),
+            ('z', 70000, ['author x', 'author z'], ['x'])
+        ]:
+            dataset_file.write(json.dumps({
+                'id': paper_id, 'authors': author_list, 'year': paper_year, 'references': references
+            }) + '\n')
+
+    main.main([[dataset_file_path, 0]], **main_arguments)
+
+    author_info_manager = AuthorInfoManager()
+    author_info_manager.load_author_info()
+    author_leaderboard = AuthorLeaderboard()
+    author_leaderboard.load()
+    assert author_info_manager.get_number_of_authors() == 2
+    assert author_leaderboard.get_number_of_authors() == author_info_manager.get_number_of_authors()
+
+    author_values = author_leaderboard.get_author_values(author_info_manager.get_author_index('author x'))
+    assert author_values['last_active_year'] == 2000
+    assert author_values[AuthorLeaderboard.CITATIONS_METRIC] == 1
+    assert author_leaderboard.get_top_authors(AuthorLeaderboard.H_INDEX_METRIC, 10, active_since_year=2002) == []
@@ -0,0 +1,55 @@
+import random
+import main
+from author_info_manager import AuthorInfoManager
+from synthetic_dataset import SyntheticDatasetGenerator
+from conftest import compute_h_indices, load_stored_h_indices
+
+
+def test_author_shards_round_trip(storage_directory):
+    random_generator = random.Random(1)
+    expected_papers = dict()
+    expected_co_authors = dict()
+    # a tiny memory budget releases stored shards, so later papers read authors back from them
+    author_info_manager = AuthorInfoManager(memory_budget=10000)
+    for paper_record_id in range(3000):
+        author_ids = list({
+            'author {author_index}'.format(author_index=random_generator.randint(0, 500))
+            for _ in range(random_generator.randint(1, 4))
+        })
+        author_info_manager.add_paper_authors(paper_record_id, author_ids)
+        for author_id in author_ids:
+            expected_papers.setdefault(author_id, set()).add(paper_record_id)
+            expected_co_authors.setdefault(author_id, set()).update(set(author_ids) - {author_id})
+        if paper_record_id % 1000 == 999:
+            author_info_manager.store_author_info()
+    author_info_manager.store_author_info()
+
+    loaded_manager = AuthorInfoManager()
+    loaded_manager.load_author_info()
+    assert loaded_manager.get_number_of_authors() == len(expected_papers)
+    for author_id, paper_record_ids in expected_papers.items():
+        author_index = loaded_manager.get_author_index(author_id)
+        assert set(loaded_manager.get_author_papers(author_index)) == paper_record_ids
+        stored_papers, stored_co_authors = loaded_manager.get_stored_author(author_index)
+        assert set(stored_papers.tolist()) == paper_record_ids
+        # co-authors are stored as sorted neighbor lists of author indices
+        assert stored_co_authors.tolist() == sorted(stored_co_authors.tolist())
+        assert {loaded_manager.get_author_id(co_author_index) for co_author_index in stored_co_authors.tolist()} == \
+            expected_co_authors[author_id]
+
+
+def test_fresh_run_ignores_stale_shards(storage_directory, dataset_files):
+    # a run that does not load state starts over in storage left by a larger run
+    main.main(dataset_files)
+    smaller_dataset_files = SyntheticDatasetGenerator(SyntheticDatasetGenerator.DEFAULT_SEED + 1).generate_files(
+        str(storage_directory / 'dblp-ref-small-{file_id}.json'), 300
+    )
+    main.main(smaller_dataset_files)
+    expected_h_indices = compute_h_indices(smaller_dataset_files)
+    assert load_stored_h_indices() == expected_h_indices
+
+    loaded_manager = AuthorInfoManager()
+    loaded_manager.load_author_info()
+    assert loaded_manager.get_number_of_authors() == len(expected_h_indices)
+    for author_index in range(loaded_manager.get_number_of_authors()):
+        assert len(loaded_manager.get_author_papers(author_index)) > 0
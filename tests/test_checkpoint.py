@@ -0,0 +1,63 @@
+import os
+import pytest
+import main
+import storage_files
+from checkpoint_manager import CheckpointManager
+from author_info_manager import AuthorInfoManager
+from paper_storage_file import PaperStorageFile
+from author_leaderboard import AuthorLeaderboard
+from conftest import SMALL_MEMORY_BUDGET, CHECKPOINT_INTERVAL, load_stored_h_indices, run_crashing_ingestion
+
+
+@pytest.mark.parametrize('owner_class, method_name, crash_call_index', [
+    # between checkpoints- records written after the last checkpoint are rolled back
+    (CheckpointManager, 'on_lines_processed', 3),
+    # after the checkpoint file was replaced, before pending files were renamed
+    (AuthorInfoManager, 'commit_author_info', 3),
+    (AuthorLeaderboard, 'commit_leaderboard', 2),
+    # paper storage- in the middle of an eviction batch, after index entries were written but before the header
+    # that accounts for them was synced, and while a checkpoint compacts a storage file
+    (PaperStorageFile, 'write_record', 5000),
+    (PaperStorageFile, 'flush', 3000),
+    (PaperStorageFile, 'rewrite', 2),
+], ids=['between_checkpoints', 'before_author_rename', 'before_leaderboard_rename', 'during_record_writes',
+        'before_header_commit', 'during_compaction'])
+@pytest.mark.parametrize('main_arguments', [
+    {'memory_budget': SMALL_MEMORY_BUDGET, 'checkpoint_interval': CHECKPOINT_INTERVAL},
+    {'memory_budget': SMALL_MEMORY_BUDGET, 'checkpoint_interval': CHECKPOINT_INTERVAL, 'number_of_workers': 4},
+], ids=['sequential', 'parallel'])
+def test_crash_then_resume(storage_directory, dataset_files, expected_h_indices, monkeypatch,
+                           owner_class, method_name, crash_call_index, main_arguments):
+    monkeypatch.setattr(main, 'MIN_DATASET_RANGE_SIZE', 1)
+    run_crashing_ingestion(dataset_files, owner_class, method_name, crash_call_index, main_arguments)
+    assert os.path.exists(CheckpointManager.CHECKPOINT_FILE_PATH)
+
+    main.main(dataset_files, should_load_state=True, **main_arguments)
+    assert load_stored_h_indices() == expected_h_indices
+
+    author_info_manager = AuthorInfoManager()
+    author_info_manager.load_author_info()
+    assert author_info_manager.get_number_of_authors() == len(expected_h_indices)
+
+    # leaderboard is stored with the same checkpoint, so it ranks every author by the recomputed h-index
+    author_leaderboard = AuthorLeaderboard()
+    author_leaderboard.load()
+    assert author_leaderboard.get_number_of_authors() == author_info_manager.get_number_of_authors()
+    top_author_index, top_h_index = author_leaderboard.get_top_authors(AuthorLeaderboard.H_INDEX_METRIC, 1)[0]
+    assert top_h_index == max(expected_h_indices.values())
+    assert expected_h_indices[author_info_manager.get_author_id(top_author_index)] == top_h_index
+
+
+def test_directory_sync_is_skipped_on_windows(storage_directory, monkeypatch):
+    # a directory can not be opened there, the commit must not fail on it
+    def open_file_only(file_path, flags, *args, **kwargs):
+        if os.path.isdir(file_path):
+            raise PermissionError('directory can not be opened: {file_path}'.format(file_path=file_path))
+        return original_open(file_path, flags, *args, **kwargs)
+
+    original_open = os.open
+    monkeypatch.setattr(os, 'open', open_file_only)
+    monkeypatch.setattr(os, 'name', 'nt')
+    storage_files.write_file_atomically('storage/data.bin', b'data')
+    with open('storage/data.bin', 'rb') as data_file:
+        assert data_file.read() == b'data'
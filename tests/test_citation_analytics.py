@@ -0,0 +1,58 @@
+import json
+import numpy as np
+import main
+from paper_info_manager import PaperInfoManager
+from author_info_manager import AuthorInfoManager
+from citation_analytics import CitationAnalyticsIndex
+
+
+def test_as_of_year_queries(storage_directory, dataset_files, expected_h_indices):
+    main.main(dataset_files, should_build_analytics_index=True)
+    paper_info_manager = PaperInfoManager()
+    paper_info_manager.restore_stored_state()
+    citation_histories = list(paper_info_manager.iterate_citation_histories())
+    analytics_index = CitationAnalyticsIndex()
+    analytics_index.load()
+    first_year, last_year = analytics_index.get_year_range()
+
+    paper_indices = np.arange(len(citation_histories))
+    for as_of_year, window_years in [
+            (first_year - 1, None), (first_year, None), ((first_year + last_year) // 2, None),
+            ((first_year + last_year) // 2, 3), (last_year, None), (last_year + 10, 5)]:
+        assert analytics_index.get_citation_counts(paper_indices, as_of_year, window_years).tolist() == [
+            sum(citation_count for citation_year, citation_count in citation_history.items()
+                if int(citation_year) <= as_of_year and (window_years is None or
+                                                         int(citation_year) > as_of_year - window_years))
+            for citation_history in citation_histories
+        ]
+
+    # as of the last year, h-indices are the final ones
+    author_info_manager = AuthorInfoManager()
+    author_info_manager.load_author_info()
+    h_indices = analytics_index.calculate_author_metrics(
+        np.arange(author_info_manager.get_number_of_authors()), last_year
+    )[CitationAnalyticsIndex.H_INDEX_KEY_NAME]
+    assert {
+        author_info_manager.get_author_id(author_index): h_index for author_index, h_index in enumerate(h_indices)
+    } == expected_h_indices
+
+
+def test_outlier_years_do_not_widen_index(storage_directory):
+    # paper a is cited in years 1, 2001 and 9999- the index keeps three pairs, not a column per year
+    dataset_file_path = str(storage_directory / 'dblp-ref-outlier-years.json')
+    with open(dataset_file_path, 'wt') as dataset_file:
+        for paper_id, paper_year, references in [
+                ('a', 2000, []), ('b', 1, ['a']), ('c', 9999, ['a']), ('d', 2001, ['a'])]:
+            dataset_file.write(json.dumps({
+                'id': paper_id, 'authors': ['author ' + paper_id], 'year': paper_year, 'references': references
+            }) + '\n')
+
+    main.main([[dataset_file_path, 0]], should_build_analytics_index=True)
+    analytics_index = CitationAnalyticsIndex()
+    analytics_index.load()
+    assert analytics_index.get_year_range() == (1, 9999)
+    assert np.load(CitationAnalyticsIndex.CUMULATIVE_CITATIONS_FILE_PATH).shape == (3,)
+    # paper a has record id 0, paper b 1
+    assert analytics_index.get_citation_counts([0, 1], 2000).tolist() == [1, 0]
+    assert analytics_index.get_citation_counts([0, 1], 9999).tolist() == [3, 0]
+    assert analytics_index.get_citation_counts([0, 1], 9998, 9000).tolist() == [1, 0]
@@ -0,0 +1,55 @@
+import bz2
+import gzip
+import json
+import lzma
+import shutil
+import functools
+import pytest
+import main
+from checkpoint_manager import CheckpointManager
+from ingestion_pipeline import IngestionPipeline
+from conftest import NUMBER_OF_PAPERS, CHECKPOINT_INTERVAL, load_stored_h_indices, run_crashing_ingestion
+
+# small pipeline chunks, so a compressed file is applied and checkpointed in several chunks
+PIPELINE_CHUNK_SIZE = 128 * 1024
+
+
+def write_compressed_dataset_file(dataset_files, compressed_file_path, file_extension):
+    # all dataset lines in one compressed file, so checkpoints save offsets in the middle of it
+    if file_extension == '.gz':
+        compressed_file = gzip.open(compressed_file_path, 'wb')
+    elif file_extension == '.bz2':
+        compressed_file = bz2.open(compressed_file_path, 'wb')
+    elif file_extension == '.xz':
+        compressed_file = lzma.open(compressed_file_path, 'wb')
+    else:
+        zstandard = pytest.importorskip('zstandard')
+        compressed_file = zstandard.ZstdCompressor().stream_writer(open(compressed_file_path, 'wb'))
+    with compressed_file:
+        for dataset_file_path, _ in dataset_files:
+            with open(dataset_file_path, 'rb') as dataset_file:
+                shutil.copyfileobj(dataset_file, compressed_file)
+
+
+@pytest.mark.parametrize('file_extension', ['.gz', '.bz2', '.xz', '.zst'])
+@pytest.mark.parametrize('main_arguments, crash_call_index', [
+    ({'checkpoint_interval': CHECKPOINT_INTERVAL}, 3),
+    ({'checkpoint_interval': CHECKPOINT_INTERVAL, 'number_of_parser_workers': 2}, 8),
+], ids=['sequential', 'pipeline'])
+def test_compressed_crash_then_resume(storage_directory, dataset_files, expected_h_indices, monkeypatch,
+                                      file_extension, main_arguments, crash_call_index):
+    monkeypatch.setattr(main, 'IngestionPipeline', functools.partial(IngestionPipeline, chunk_size=PIPELINE_CHUNK_SIZE))
+    compressed_file_path = str(storage_directory / ('dblp-ref' + file_extension))
+    write_compressed_dataset_file(dataset_files, compressed_file_path, file_extension)
+    compressed_files = [[compressed_file_path, 0]]
+
+    # the crash comes after a checkpoint saved a decompressed offset inside the file
+    run_crashing_ingestion(compressed_files, CheckpointManager, 'on_lines_processed', crash_call_index, main_arguments)
+    with open(CheckpointManager.CHECKPOINT_FILE_PATH, 'rt') as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    byte_offset, line_index = checkpoint[CheckpointManager.FILE_POSITIONS_KEY_NAME][compressed_file_path]
+    assert byte_offset > 0 and 0 < line_index < NUMBER_OF_PAPERS
+
+    # resume seeks the decompressed stream to the saved offset
+    main.main(compressed_files, should_load_state=True, **main_arguments)
+    assert load_stored_h_indices() == expected_h_indices
@@ -0,0 +1,23 @@
+from id_index import IdIndex
+
+
+def test_id_index_round_trip(storage_directory):
+    keys = ['paper {key_index}'.format(key_index=key_index) for key_index in range(5000)]
+    id_index = IdIndex()
+    for key in keys:
+        id_index.add(key)
+    id_index.store('storage/ids.bin')
+
+    # ids added after a load live in the overlay and are written with the stored ones
+    loaded_index = IdIndex()
+    loaded_index.load('storage/ids.bin')
+    assert loaded_index.get_or_add('new paper') == len(keys)
+    loaded_index.store('storage/ids.bin')
+
+    stored_index = IdIndex()
+    stored_index.load('storage/ids.bin')
+    assert len(stored_index) == len(keys) + 1
+    for key_id, key in enumerate(keys + ['new paper']):
+        assert stored_index.get_id(key) == key_id
+        assert stored_index.get_key(key_id) == key
+    assert stored_index.get_id('missing paper') is None
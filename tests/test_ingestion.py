@@ -0,0 +1,118 @@
+import os
+import json
+import pytest
+import main
+import partitioned_ingestion
+from author_info_manager import AuthorInfoManager
+from paper_info_manager import PaperInfoManager
+from metrics_registry import MetricsRegistry
+from conftest import SMALL_MEMORY_BUDGET, CHECKPOINT_INTERVAL, load_stored_h_indices
+
+
+@pytest.mark.parametrize('main_arguments', [
+    {},
+    {'number_of_parser_workers': 2},
+    {'number_of_workers': 3},
+    {'bulk_build': True},
+    {'memory_budget': SMALL_MEMORY_BUDGET, 'checkpoint_interval': CHECKPOINT_INTERVAL},
+    {'number_of_partitions': 3},
+], ids=['sequential', 'pipeline', 'parallel', 'bulk', 'small_budget', 'partitioned'])
+def test_ingestion_matches_recomputation(storage_directory, dataset_files, expected_h_indices, monkeypatch,
+                                         main_arguments):
+    # split files to several ranges per worker
+    monkeypatch.setattr(main, 'MIN_DATASET_RANGE_SIZE', 1)
+    main.main(dataset_files, **main_arguments)
+    assert load_stored_h_indices() == expected_h_indices
+
+
+def test_bulk_build_external_merge(storage_directory, dataset_files, expected_h_indices):
+    # a budget of a few thousand citation keys per run forces several runs and merge blocks
+    main.main(dataset_files, bulk_build=True, memory_budget=60000)
+    assert len([file_name for file_name in os.listdir('storage') if file_name.startswith('bulk_run_')]) == 0
+    assert load_stored_h_indices() == expected_h_indices
+
+
+@pytest.mark.parametrize('main_arguments', [
+    {}, {'number_of_parser_workers': 2}, {'number_of_workers': 2}, {'bulk_build': True}, {'number_of_partitions': 2}
+], ids=['sequential', 'pipeline', 'parallel', 'bulk', 'partitioned'])
+def test_bad_lines_are_skipped(storage_directory, dataset_files, expected_h_indices, main_arguments):
+    # a repeated paper line (without references, so citations do not change), and lines without an integer year
+    # or with a year out of range- the year of a bulk build citation key is 16 bits wide
+    dataset_file_path = str(storage_directory / 'dblp-ref-bad.json')
+    with open(dataset_files[0][0], 'rt') as dataset_file:
+        paper_attributes = json.loads(dataset_file.readline())
+    paper_attributes.pop('references', None)
+    with open(dataset_file_path, 'wt') as bad_dataset_file:
+        bad_dataset_file.write(json.dumps(paper_attributes) + '\n')
+        for paper_year in [None, 'unknown', 1999.5, 0, 70000, '70000']:
+            bad_dataset_file.write(json.dumps({
+                'id': 'paper without year {paper_year}'.format(paper_year=paper_year),
+                'authors': ['author 0', 'author without year'], 'year': paper_year,
+                'references': [paper_attributes['id']]
+            }) + '\n')
+        bad_dataset_file.write('not a json line\n')
+        for field_name in ['references', 'authors']:
+            bad_dataset_file.write(json.dumps(dict({
+                'id': 'paper with null {field_name}'.format(field_name=field_name),
+                'authors': ['author 0'], 'year': 2000, 'references': [paper_attributes['id']]
+            }, **{field_name: None})) + '\n')
+
+    main.main(dataset_files + [[dataset_file_path, 0]], **main_arguments)
+    assert load_stored_h_indices() == expected_h_indices
+    if 'number_of_partitions' in main_arguments:
+        return
+
+    # bad lines are counted in the final metrics snapshot, whichever process parsed them-
+    # the repeated paper fails on its authors, the line that is not json and the null fields fail to parse.
+    # every partition scans all lines, each one keeps its own metrics
+    with open(MetricsRegistry.SNAPSHOT_FILE_PATH, 'rt') as snapshot_file:
+        counters = json.loads(snapshot_file.readlines()[-1])['counters']
+    assert counters.get('skipped_lines') == 6
+    assert counters.get('failed_lines') == 4
+
+
+@pytest.mark.parametrize('main_arguments', [{}, {'bulk_build': True}], ids=['sequential', 'bulk'])
+def test_year_out_of_range_is_not_credited(storage_directory, main_arguments):
+    # year 70000 in a bulk build citation key would credit the citation of paper x to the next record, paper y
+    dataset_file_path = str(storage_directory / 'dblp-ref-wide-year.json')
+    with open(dataset_file_path, 'wt') as dataset_file:
+        for paper_id, paper_year, references in [('x', 2000, []), ('y', 2000, []), ('z', 70000, ['x'])]:
+            dataset_file.write(json.dumps({
+                'id': paper_id, 'authors': ['author ' + paper_id], 'year': paper_year, 'references': references
+            }) + '\n')
+
+    main.main([[dataset_file_path, 0]], **main_arguments)
+    assert load_stored_h_indices() == {'author x': 0, 'author y': 0}
+
+
+@pytest.mark.parametrize('main_arguments', [
+    {'bulk_build': True}, {'number_of_workers': 2}, {'number_of_parser_workers': 2},
+    {'should_build_analytics_index': True}, {'should_trace_memory': True}
+], ids=['bulk', 'parallel', 'pipeline', 'analytics_index', 'trace_memory'])
+def test_partitioned_rejects_unsupported_options(storage_directory, dataset_files, main_arguments):
+    # partitions store only the merged h-index, options that need the single storage are not dropped silently
+    with pytest.raises(ValueError):
+        main.main(dataset_files, number_of_partitions=2, **main_arguments)
+    assert not os.path.exists('partitions')
+
+
+def test_partition_batch_survives_bad_paper(storage_directory):
+    # attributes that got past parsing but can not be applied fail their line in every partition, not the batch
+    parsed_papers = [
+        (0, {'id': 'paper a', 'authors': ['author a'], 'year': 2000, 'references': []}),
+        (1, {'id': 'paper b', 'authors': ['author b'], 'year': 2000, 'references': None}),
+        (2, {'id': 'paper c', 'authors': ['author c'], 'year': 2001, 'references': ['paper a']}),
+    ]
+    for partition_index in range(2):
+        author_info_manager = AuthorInfoManager()
+        paper_info_manager = PaperInfoManager()
+        failed_lines = partitioned_ingestion.apply_partition_papers(
+            'dblp-ref-bad.json', parsed_papers, partition_index, 2, author_info_manager, paper_info_manager
+        )
+        assert [failed_line['line_index'] for failed_line in failed_lines] == [1]
+        owned_paper_ids = [paper_id for paper_id in ['paper a', 'paper c']
+                           if partitioned_ingestion.get_partition_index(paper_id, 2) == partition_index]
+        assert author_info_manager.get_number_of_authors() == len(owned_paper_ids)
+        if partitioned_ingestion.get_partition_index('paper a', 2) == partition_index:
+            paper_record_id = paper_info_manager.get_paper_record_id('paper a')
+            assert paper_info_manager.get_citation_history(paper_record_id) == {'2001': 1}
@@ -0,0 +1,69 @@
+import random
+import main
+from checkpoint_manager import CheckpointManager
+from author_info_manager import AuthorInfoManager
+from conftest import SMALL_MEMORY_BUDGET, load_stored_h_indices, run_crashing_ingestion
+
+
+def count_calls(monkeypatch, owner_class, method_name):
+    original_method = getattr(owner_class, method_name)
+    number_of_calls = [0]
+
+    def counting_method(*args, **kwargs):
+        number_of_calls[0] += 1
+        return original_method(*args, **kwargs)
+
+    monkeypatch.setattr(owner_class, method_name, counting_method)
+    return number_of_calls
+
+
+def test_memory_budget_does_not_trigger_checkpoints(storage_directory, dataset_files, expected_h_indices,
+                                                     monkeypatch):
+    # authors over the budget spill their shards, only the final checkpoint is written
+    number_of_checkpoints = count_calls(monkeypatch, CheckpointManager, 'write_checkpoint')
+    number_of_spills = count_calls(monkeypatch, AuthorInfoManager, 'spill_modified_shards')
+    main.main(dataset_files, memory_budget=SMALL_MEMORY_BUDGET)
+
+    assert number_of_checkpoints[0] == 1
+    assert number_of_spills[0] > 0
+    assert load_stored_h_indices() == expected_h_indices
+
+
+def test_spilled_shards_round_trip(storage_directory):
+    # authors keep being added, a spill releases shards below the budget, so spills do not follow every check
+    random_generator = random.Random(1)
+    expected_papers = dict()
+    author_info_manager = AuthorInfoManager(memory_budget=300000)
+    number_of_checks = 0
+    number_of_spills = 0
+    for paper_record_id in range(3000):
+        author_ids = list({
+            'author {author_index}'.format(author_index=random_generator.randint(0, 100000))
+            for _ in range(random_generator.randint(1, 4))
+        })
+        author_info_manager.add_paper_authors(paper_record_id, author_ids)
+        for author_id in author_ids:
+            expected_papers.setdefault(author_id, set()).add(paper_record_id)
+        if paper_record_id % 20 == 19:
+            number_of_checks += 1
+            if author_info_manager.is_over_memory_budget():
+                author_info_manager.spill_modified_shards(1)
+                number_of_spills += 1
+
+    assert 0 < number_of_spills <= number_of_checks // 2
+    author_info_manager.commit_author_info(author_info_manager.prepare_author_info(1), 1)
+
+    loaded_manager = AuthorInfoManager()
+    loaded_manager.load_author_info()
+    assert loaded_manager.get_number_of_authors() == len(expected_papers)
+    for author_id, paper_record_ids in expected_papers.items():
+        assert set(loaded_manager.get_author_papers(loaded_manager.get_author_index(author_id))) == paper_record_ids
+
+
+def test_crash_after_spill_then_resume(storage_directory, dataset_files, expected_h_indices):
+    # the crash follows a spill of the second checkpoint's shards, the resumed run starts from the first one
+    main_arguments = {'memory_budget': SMALL_MEMORY_BUDGET, 'checkpoint_interval': 1500}
+    run_crashing_ingestion(dataset_files, CheckpointManager, 'on_lines_processed', 4, main_arguments)
+
+    main.main(dataset_files, should_load_state=True, **main_arguments)
+    assert load_stored_h_indices() == expected_h_indices
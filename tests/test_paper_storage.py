@@ -0,0 +1,58 @@
+import os
+import random
+import pytest
+from paper_info_manager import PaperInfoManager
+
+
+@pytest.mark.parametrize('has_writev', [True, False], ids=['writev', 'joined_write'])
+def test_paper_storage_round_trip(storage_directory, monkeypatch, has_writev):
+    # a tiny cache makes records go through eviction, rewrite and reload
+    if not has_writev:
+        monkeypatch.delattr(os, 'writev', raising=False)
+    random_generator = random.Random(1)
+    expected_histories = dict()
+    paper_info_manager = PaperInfoManager(cache_memory_budget=20000)
+    for paper_index in range(2000):
+        paper_id = 'paper {paper_index}'.format(paper_index=paper_index)
+        paper_info_manager.add_paper(paper_id, str(random_generator.randint(1980, 2017)))
+        expected_histories[paper_id] = dict()
+        for _ in range(random_generator.randint(0, 5)):
+            cited_paper_id = 'paper {paper_index}'.format(paper_index=random_generator.randint(0, paper_index))
+            citation_year = str(random_generator.randint(1980, 2017))
+            paper_info_manager.add_citation(cited_paper_id, citation_year)
+            cited_history = expected_histories[cited_paper_id]
+            cited_history[citation_year] = cited_history.get(citation_year, 0) + 1
+    paper_info_manager.store_cache()
+
+    restored_manager = PaperInfoManager()
+    restored_manager.restore_stored_state()
+    assert restored_manager.get_number_of_records() == len(expected_histories)
+    for paper_id, citation_history in expected_histories.items():
+        paper_record_id = restored_manager.get_paper_record_id(paper_id)
+        assert restored_manager.get_citation_history(paper_record_id) == citation_history
+
+
+def test_paper_record_codec_round_trip():
+    paper_records = [
+        {PaperInfoManager.PUBLICATION_YEAR_KEY_NAME: None, PaperInfoManager.CITATION_INFO_KEY_NAME: dict()},
+        {PaperInfoManager.PUBLICATION_YEAR_KEY_NAME: 1995, PaperInfoManager.CITATION_INFO_KEY_NAME: {'1996': 1}},
+        {
+            PaperInfoManager.PUBLICATION_YEAR_KEY_NAME: 2017,
+            PaperInfoManager.CITATION_INFO_KEY_NAME: {'2017': 300, '1980': 2 ** 40, '2030': 127, '2000': 128}
+        }
+    ]
+    for paper_record in paper_records:
+        assert PaperInfoManager.decode_record(PaperInfoManager.encode_record(paper_record)) == paper_record
+
+
+def test_failed_paper_does_not_fail_batch(storage_directory):
+    # a paper without a reference list fails alone, before its record is created
+    paper_info_manager = PaperInfoManager()
+    paper_record_ids, failed_papers = paper_info_manager.add_papers([
+        ('paper a', '2000', ['paper b']), ('paper c', '2000', None), ('paper d', '2001', ['paper a', 'paper b'])
+    ])
+    assert [paper_index for paper_index, ex in failed_papers] == [1]
+    assert paper_record_ids[1] is None
+    assert paper_info_manager.get_paper_record_id('paper c') is None
+    assert paper_info_manager.get_citation_history(paper_info_manager.get_paper_record_id('paper a')) == {'2001': 1}
+    assert paper_info_manager.get_total_citation_count(paper_info_manager.get_paper_record_id('paper b')) == 2
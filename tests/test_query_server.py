@@ -0,0 +1,111 @@
+import json
+import time
+import socket
+import http.client
+import urllib.parse
+import multiprocessing
+import pytest
+import main
+import query_server
+from query_server import QueryServer
+
+SERVER_START_TIMEOUT_SECONDS = 30
+
+
+def get_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind((QueryServer.DEFAULT_HOST, 0))
+        return free_socket.getsockname()[1]
+
+
+@pytest.fixture
+def server_port(storage_directory, dataset_files):
+    # build the store, then serve it from a forked process
+    main.main(dataset_files)
+    port = get_free_port()
+    server_process = multiprocessing.get_context('fork').Process(
+        target=query_server.run_query_server, args=(QueryServer.DEFAULT_HOST, port, 1000)
+    )
+    server_process.start()
+    try:
+        start_time = time.time()
+        while True:
+            try:
+                socket.create_connection((QueryServer.DEFAULT_HOST, port)).close()
+                break
+            except ConnectionError:
+                assert server_process.is_alive() and time.time() - start_time < SERVER_START_TIMEOUT_SECONDS
+                time.sleep(0.1)
+        yield port
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+
+def get_json(connection, request_path):
+    connection.request('GET', request_path)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def get_author_path(author_id, query_name):
+    return '/authors/{author_id}/{query_name}'.format(author_id=urllib.parse.quote(author_id), query_name=query_name)
+
+
+def test_author_h_indices(server_port, expected_h_indices):
+    # one keep-alive connection answers all queries in order
+    connection = http.client.HTTPConnection(QueryServer.DEFAULT_HOST, server_port)
+    for author_id, h_index in sorted(expected_h_indices.items())[:300]:
+        status, response_body = get_json(connection, get_author_path(author_id, QueryServer.H_INDEX_QUERY_NAME))
+        assert status == 200
+        assert response_body[QueryServer.H_INDEX_QUERY_NAME] == h_index
+    connection.close()
+
+
+def test_leaderboard(server_port, expected_h_indices):
+    connection = http.client.HTTPConnection(QueryServer.DEFAULT_HOST, server_port)
+    status, response_body = get_json(connection, '/leaderboard/h_index?k=10')
+    assert status == 200
+    assert [author['h_index'] for author in response_body['authors']] == \
+        sorted(expected_h_indices.values(), reverse=True)[:10]
+
+    top_author_id = response_body['authors'][0]['author']
+    status, response_body = get_json(
+        connection, '/leaderboard/h_index?author={author_id}'.format(author_id=urllib.parse.quote(top_author_id))
+    )
+    assert status == 200 and response_body['rank'] == 1
+    connection.close()
+
+
+@pytest.mark.parametrize('request_path, expected_status', [
+    (get_author_path('missing author', QueryServer.H_INDEX_QUERY_NAME), 404),
+    ('/authors/author%200/unknown_query', 404),
+    ('/leaderboard/unknown_metric', 404),
+    ('/leaderboard/h_index?k=none', 400),
+    ('/leaderboard/h_index?author=missing%20author', 404),
+])
+def test_bad_queries(server_port, request_path, expected_status):
+    connection = http.client.HTTPConnection(QueryServer.DEFAULT_HOST, server_port)
+    status, response_body = get_json(connection, request_path)
+    assert status == expected_status
+    assert 'error' in response_body
+    connection.close()
+
+
+def test_bad_content_length(server_port):
+    with socket.create_connection((QueryServer.DEFAULT_HOST, server_port)) as client_socket:
+        client_socket.sendall(b'GET /authors/author%200/h_index HTTP/1.1\r\nContent-Length: abc\r\n\r\n')
+        response_data = b''
+        while True:
+            received_data = client_socket.recv(4096)
+            if len(received_data) == 0:
+                break
+            response_data += received_data
+    assert response_data.startswith(b'HTTP/1.1 400 ')
+
+
+def test_partitioned_storage_is_not_served(storage_directory, dataset_files):
+    # partitioned ingestion writes only the merged h-index to storage/
+    main.main(dataset_files, number_of_partitions=2)
+    with pytest.raises(Exception, match='partitioned'):
+        QueryServer()